@@ -17,70 +17,16 @@ print(get_loudest(a.sections))
 # 
 
 # %%
-import librosa
-import numpy as np
-from pychorus.constants import N_FFT
-from pychorus.similarity_matrix import TimeTimeSimilarityMatrix, TimeLagSimilarityMatrix
+# beat-synchronous chroma and a blockwise time-lag similarity, cached with the rest of the analysis
+from openmxr.analyze.chorus import get_chorus, get_repeats
 
-def create_chroma(y, sr, n_fft=N_FFT):
-    """
-    Generate the notes present in a song
-
-    Returns: tuple of 12 x n chroma, song wav data, sample rate (usually 22050)
-             and the song length in seconds
-    """
-    
-    song_length_sec = y.shape[0] / float(sr)
-    S = np.abs(librosa.stft(y, n_fft=n_fft))**2
-    chroma = librosa.feature.chroma_stft(S=S, sr=sr)
-
-    return chroma, y, sr, song_length_sec
-
-chroma, _, sr, _ = create_chroma(song.audio_mono, song.sample_rate)
-time_time_similarity = TimeTimeSimilarityMatrix(chroma, sr)
-time_lag_similarity = TimeLagSimilarityMatrix(chroma, sr)
-num_samples = chroma.shape[1]
-
-# Visualize the results
-# print(time_lag_similarity.display())
-# time_time_similarity.display()
-
-# %%
-from pychorus.helpers import local_maxima_rows, detect_lines, SMOOTHING_SIZE_SEC
-smoothing_size_samples = int(SMOOTHING_SIZE_SEC * sr)
-time_lag_similarity.denoise(time_time_similarity.matrix,
-                            smoothing_size_samples)
-
-
-
-# %%
-# Detect lines in the image
-clip_length_samples = len(song.audio_mono)
-candidate_rows = local_maxima_rows(time_lag_similarity.matrix)
-
-
-# %%
-lines = detect_lines(time_lag_similarity.matrix, candidate_rows,
-                        clip_length_samples)
+repeats = get_repeats(song)
+for segment in repeats[:5]:
+    print(f"{segment.start:7.2f}s - {segment.end:7.2f}s  repeated {segment.repeats}x  score {segment.score:.2f}")
 
 # %%
-from json import JSONEncoder
-
-class NumpyArrayEncoder(JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return JSONEncoder.default(self, obj)
-
-
-# %%
-import json
-with open("file.json", "w") as f:
-    json.dump(time_time_similarity.matrix, f, cls=NumpyArrayEncoder)
-
-
-# %%
-N_FFT
+chorus = get_chorus(song)
+print(chorus)
 
 # %%
 from matplotlib import pyplot as plt
@@ -90,19 +36,8 @@ plt.cla()
 # %matplotlib ipympl
 from matplotlib import pyplot as plt
 
-def normalize_2d_array(arr):
-    min_val = np.min(arr)
-    max_val = np.max(arr)
-
-    normalized_arr = (arr - min_val) / (max_val - min_val)
-
-    return normalized_arr
-
-# plt.imshow(normalize_2d_array(time_time_similarity.matrix), vmin=0, vmax=1)
-# plt.colorbar()
-# plt.title('Grayscale Image')
+# plt.figure(figsize=(12, 2))
+# for segment in repeats:
+#     plt.axvspan(segment.start, segment.end, alpha=0.1 * segment.repeats)
+# plt.title('Repeated sections')
 # plt.show()
-# plt.savefig('imshow_plot_2K.png', dpi=200)
-
-
-
@@ -0,0 +1,34 @@
+import shutil
+import subprocess
+import numpy as np
+import numpy.typing as npt
+
+SAMPLE_RATE = 48000
+
+
+def synthetic_audio(seconds: float, sample_rate: int = SAMPLE_RATE, bpm: float = 124, seed: int = 0) -> npt.NDArray[np.float32]:
+    """Stereo float32 (channels, frames) that looks like music to the analysis:
+    a kick on every beat, a chord changing every bar and some noise"""
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * sample_rate)
+    t = np.arange(frames, dtype=np.float32) / sample_rate
+    beat = 60 / bpm
+    phase = (t % beat) / beat
+    kick = np.sin(2 * np.pi * 55 * t) * np.exp(-phase * 12)
+    # i - vi - iv - v, one chord per bar
+    roots = np.array([220.0, 185.0, 146.8, 164.8], dtype=np.float32)[(t // (4 * beat)).astype(np.intp) % 4]
+    chord = sum(np.sin(2 * np.pi * roots * ratio * t) for ratio in (1, 1.26, 1.5)) / 3
+    mono = (0.5 * kick + 0.3 * chord + 0.02 * rng.standard_normal(frames)).astype(np.float32)
+    return np.stack((mono, np.roll(mono, 240)))
+
+
+def has_ffmpeg() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def encode_opus(audio: npt.NDArray[np.float32], sample_rate: int = SAMPLE_RATE) -> bytes:
+    """The audio as webm/opus, the format youtube serves"""
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error",
+           "-f", "f32le", "-ar", str(sample_rate), "-ac", str(audio.shape[0]), "-i", "pipe:",
+           "-c:a", "libopus", "-b:a", "128k", "-f", "webm", "pipe:"]
+    return subprocess.run(cmd, input=np.ascontiguousarray(audio.T).tobytes(), capture_output=True, check=True).stdout
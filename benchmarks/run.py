@@ -0,0 +1,302 @@
+"""Offline benchmarks of OpenMXR's hot paths.
+
+    python -m benchmarks.run [names...] [--seconds 240] [--save-baseline]
+
+Every benchmark runs in its own process inside a scratch directory, so
+peak RSS is per benchmark and nothing touches the real ./.cache.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+import json
+import multiprocessing
+import os
+from os import path
+import resource
+import sys
+import tempfile
+import time
+from typing import Callable
+
+from benchmarks.fixtures import SAMPLE_RATE, encode_opus, has_ffmpeg, synthetic_audio
+from benchmarks.server import RangeServer
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+BASELINE = path.join(ROOT, "benchmarks", "baseline.json")
+# slower than the baseline by more than this fraction is a regression
+TOLERANCE = 0.2
+
+
+class Skip(Exception):
+    pass
+
+
+@dataclass
+class Result:
+    name: str
+    seconds: float = 0
+    # bytes or operations processed in `seconds`
+    amount: float = 0
+    unit: str = "B"
+    peak_rss: int = 0
+    # a missing fixture, not the code's fault
+    skipped: str | None = None
+    failed: str | None = None
+
+    @property
+    def throughput(self) -> str:
+        rate = self.amount / self.seconds if self.seconds else 0
+        if self.unit == "B":
+            return f"{rate / 1024 ** 2:9.1f} MiB/s"
+        return f"{rate:9.0f} {self.unit}/s"
+
+
+BENCHMARKS: dict[str, Callable[[argparse.Namespace], tuple[float, float, str]]] = {}
+
+
+def benchmark(name: str):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def best_of(repeat: int, function: Callable[[], object]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        began = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - began)
+    return best
+
+
+def opus_fixture(options) -> bytes:
+    if not has_ffmpeg():
+        raise Skip("ffmpeg not found")
+    return encode_opus(synthetic_audio(options.seconds))
+
+
+def cached_song(options, key: str = "bench"):
+    from openmxr.cache import AudioCache
+    from openmxr.song import Song
+    AudioCache("audio").set(key, (SAMPLE_RATE, synthetic_audio(options.seconds)))
+    song = Song.from_cache(key)
+    song.load_audio()
+    return song
+
+
+@benchmark("download")
+def bench_download(options):
+    from openmxr.downloader.DownloadTask import DownloadTask
+    data = os.urandom(options.download_bytes)
+    with RangeServer(data, options.throttle) as server:
+        seconds = best_of(options.repeat, lambda: DownloadTask(server.url).start())
+    return seconds, len(data), "B"
+
+
+@benchmark("download_stream")
+def bench_download_stream(options):
+    from openmxr.downloader.DownloadTask import DownloadTask
+    data = os.urandom(options.download_bytes)
+
+    def consume():
+        for _ in DownloadTask(server.url).stream():
+            pass
+    with RangeServer(data, options.throttle) as server:
+        seconds = best_of(options.repeat, consume)
+    return seconds, len(data), "B"
+
+
+@benchmark("convert_opus_to_wav")
+def bench_convert(options):
+    from openmxr.convert import convert_opus_to_wav
+    opus = opus_fixture(options)
+    return best_of(options.repeat, lambda: convert_opus_to_wav(opus)), len(opus), "B"
+
+
+@benchmark("decode_audio")
+def bench_decode(options):
+    from openmxr.convert import decode_audio
+    opus = opus_fixture(options)
+    return best_of(options.repeat, lambda: decode_audio(opus)), len(opus), "B"
+
+
+@benchmark("audio_cache")
+def bench_audio_cache(options):
+    from openmxr.cache import AudioCache
+    import numpy as np
+    cache = AudioCache("audio")
+    audio = synthetic_audio(options.seconds)
+
+    def round_trip():
+        cache.set("bench", (SAMPLE_RATE, audio))
+        # touch every sample, a memmap that's never read costs nothing
+        np.sum(cache.get("bench")[1]) # type: ignore
+    return best_of(options.repeat, round_trip), audio.nbytes, "B"
+
+
+@benchmark("resampled")
+def bench_resampled(options):
+    from openmxr.resample import resampled_cache
+    song = cached_song(options)
+
+    def resample():
+        resampled_cache.clear()
+        song.resampled(44100, mono=True)
+    return best_of(options.repeat, resample), song.audio_header.frames, "frames" # type: ignore
+
+
+@benchmark("cache_set")
+def bench_cache_set(options):
+    from openmxr.cache import Cache
+    cache = Cache("bench")
+    items = {f"key-{i}": {"index": i, "title": f"track {i}"} for i in range(options.entries)}
+
+    def set_all():
+        for key, value in items.items():
+            cache.set(key, value)
+    return best_of(options.repeat, set_all), len(items), "ops"
+
+
+@benchmark("cache_get")
+def bench_cache_get(options):
+    from openmxr.cache import Cache
+    cache = Cache("bench")
+    cache.set_many({f"key-{i}": {"index": i, "title": f"track {i}"} for i in range(options.entries)})
+
+    def get_all():
+        for i in range(options.entries):
+            cache.get(f"key-{i}")
+    return best_of(options.repeat, get_all), options.entries, "ops"
+
+
+@benchmark("cache_get_many")
+def bench_cache_get_many(options):
+    from openmxr.cache import Cache
+    cache = Cache("bench")
+    cache.set_many({f"key-{i}": {"index": i, "title": f"track {i}"} for i in range(options.entries)})
+    keys = [f"key-{i}" for i in range(options.entries)]
+    return best_of(options.repeat, lambda: cache.get_many(keys)), options.entries, "ops"
+
+
+@benchmark("analysis")
+def bench_analysis(options):
+    try:
+        import librosa, madmom # noqa: F401
+    except ImportError as e:
+        raise Skip(str(e))
+    from openmxr.analyze.engine import AnalysisEngine, AnalysisCache
+    song = cached_song(options)
+
+    def analyze():
+        # a fresh cache every time, otherwise only the first run computes anything
+        AnalysisEngine(cache=AnalysisCache(f"analysis-{time.monotonic_ns()}")).run(song)
+    return best_of(options.repeat, analyze), options.seconds, "audio s"
+
+
+@benchmark("imports")
+def bench_imports(options):
+    from openmxr.utils.importtime import IMPORT_BUDGETS, measure_import
+    total = 0
+    for module, budget in IMPORT_BUDGETS.items():
+        elapsed, heavy = measure_import(module)
+        if elapsed > budget or heavy:
+            raise Exception(f"{module} took {elapsed:.2f}s to import (budget {budget:.2f}s){' and imports ' + ', '.join(heavy) if heavy else ''}")
+        total += elapsed
+    return total, len(IMPORT_BUDGETS), "modules"
+
+
+def peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_one(name: str, options) -> Result:
+    with tempfile.TemporaryDirectory(prefix="openmxr-bench-") as directory:
+        # the caches live under the relative ./.cache
+        os.chdir(directory)
+        # for the fresh interpreters of the import benchmark
+        os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))
+        try:
+            seconds, amount, unit = BENCHMARKS[name](options)
+        except Skip as e:
+            return Result(name, skipped=str(e))
+        return Result(name, seconds, amount, unit, peak_rss())
+
+
+def run(names: list[str], options) -> list[Result]:
+    results = []
+    for name in names:
+        # a fresh process per benchmark, so its peak RSS is its own
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            try:
+                results.append(executor.submit(_run_one, name, options).result())
+            except Exception as e:
+                results.append(Result(name, failed=f"{type(e).__name__}: {e}"))
+    return results
+
+
+def load_baseline(filename: str = BASELINE) -> dict[str, dict]:
+    if not path.exists(filename):
+        return {}
+    with open(filename) as file:
+        return json.load(file)
+
+
+def save_baseline(results: list[Result], filename: str = BASELINE):
+    with open(filename, "w") as file:
+        json.dump({result.name: asdict(result) for result in results if not result.skipped and not result.failed}, file, indent=2)
+        file.write("\n")
+
+
+def report(results: list[Result], baseline: dict[str, dict], tolerance: float = TOLERANCE) -> list[str]:
+    """Prints the results, returns the benchmarks slower than their baseline"""
+    regressions = []
+    print(f"{'benchmark':20} {'seconds':>9} {'throughput':>17} {'peak RSS':>10} {'vs baseline':>12}")
+    for result in results:
+        if result.skipped:
+            print(f"{result.name:20} skipped: {result.skipped}")
+            continue
+        if result.failed:
+            print(f"{result.name:20} FAILED: {result.failed}")
+            continue
+        change = ""
+        if (base := baseline.get(result.name)) and base["seconds"]:
+            ratio = result.seconds / base["seconds"] - 1
+            change = f"{ratio:+.0%}"
+            if ratio > tolerance:
+                regressions.append(result.name)
+                change += " !"
+        print(f"{result.name:20} {result.seconds:9.3f} {result.throughput:>17} {result.peak_rss / 1024 ** 2:7.0f} MiB {change:>12}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("names", nargs="*", help=f"any of {', '.join(BENCHMARKS)}, defaults to all of them")
+    parser.add_argument("--seconds", type=float, default=240, help="length of the synthetic tracks")
+    parser.add_argument("--download-bytes", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--throttle", type=float, default=None, help="bytes per second per connection")
+    parser.add_argument("--entries", type=int, default=10000, help="entries for the cache benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    options = parser.parse_args(argv)
+    if unknown := [name for name in options.names if name not in BENCHMARKS]:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    results = run(options.names or list(BENCHMARKS), options)
+    regressions = report(results, load_baseline(options.baseline), options.tolerance)
+    if options.save_baseline:
+        save_baseline(results, options.baseline)
+    if regressions:
+        print(f"regressions: {', '.join(regressions)}")
+    if failed := [result.name for result in results if result.failed]:
+        print(f"failed: {', '.join(failed)}")
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
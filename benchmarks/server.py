@@ -0,0 +1,80 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import re
+import threading
+import time
+
+RANGE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+class RangeServer:
+    """Serves one blob over HTTP with Range support, a local stand-in for googlevideo.
+
+    `bytes_per_second` throttles every connection on its own, like a CDN
+    limiting each request rather than the client.
+    """
+    data: bytes
+    bytes_per_second: float | None
+
+    def __init__(self, data: bytes, bytes_per_second: float | None = None):
+        self.data = data
+        self.bytes_per_second = bytes_per_second
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(server.data)))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+
+            def do_GET(self):
+                server.requests += 1
+                start, end = 0, len(server.data) - 1
+                if (match := RANGE.fullmatch(self.headers.get("Range", ""))):
+                    start = int(match[1])
+                    end = min(int(match[2]) if match[2] else end, end)
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(server.data)}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(end + 1 - start))
+                self.end_headers()
+                server._send(self.wfile, start, end)
+
+        self._http = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._http.daemon_threads = True
+        self._thread = threading.Thread(target=self._http.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._http.server_address[1]}/audio"
+
+    def _send(self, file, start: int, end: int):
+        view = memoryview(self.data)
+        began = time.monotonic()
+        sent = 0
+        try:
+            for offset in range(start, end + 1, 65536):
+                part = view[offset:min(offset + 65536, end + 1)]
+                file.write(part)
+                sent += len(part)
+                if self.bytes_per_second:
+                    ahead = sent / self.bytes_per_second - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._http.shutdown()
+        self._http.server_close()
@@ -1,16 +1,8 @@
-from spotdl import Spotdl
-from spotdl.utils.config import DEFAULT_CONFIG
-from spotdl.download.downloader import Downloader
-from yt_dlp import YoutubeDL
+from openmxr.clients import get_client
 
-sp_client = Spotdl(
-    client_id=DEFAULT_CONFIG["client_id"],
-    client_secret=DEFAULT_CONFIG["client_secret"],
-    user_auth=DEFAULT_CONFIG["user_auth"],
-    cache_path=DEFAULT_CONFIG["cache_path"],
-    no_cache=True,
-    headless=True,
-)
 
-yt_client = Downloader(settings={"simple_tui": True})
-dl_client = YoutubeDL({'format': 'bestaudio/best'})
\ No newline at end of file
+def __getattr__(name: str):
+    # `from openmxr import sp_client` keeps working, the client is only built when asked for
+    if name in ("sp_client", "yt_client", "dl_client"):
+        return get_client(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,89 @@
+import argparse
+import logging
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="openmxr")
+    parser.add_argument("--metrics", default=None, help="append timing, byte and cache events to this JSON lines file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="download and cache every track of a playlist")
+    ingest.add_argument("playlist", nargs="?", default="playlist.yaml")
+    ingest.add_argument("--io-workers", type=int, default=8)
+    ingest.add_argument("--cpu-workers", type=int, default=None)
+
+    analyze = commands.add_parser("analyze", help="analyze cached tracks on every core")
+    analyze.add_argument("yt_links", nargs="*", help="defaults to every track with cached audio")
+    analyze.add_argument("--workers", type=int, default=None)
+    analyze.add_argument("--max-memory", type=int, default=None, help="bytes the tracks in flight may use together")
+
+    mix = commands.add_parser("mix", help="render a playlist into one beat-matched mix")
+    mix.add_argument("playlist", nargs="?", default="playlist.yaml")
+    mix.add_argument("-o", "--output", default="mix.wav", help="WAV file, or - for raw float32 on stdout")
+    mix.add_argument("--bpm", type=float, default=None)
+    mix.add_argument("--fade-bars", type=int, default=8)
+
+    cache = commands.add_parser("cache", help="report or prune on-disk cache usage")
+    cache.add_argument("action", choices=["report", "prune"])
+    cache.add_argument("--audio-max-bytes", type=int, default=None, help="evict least recently used audio down to this size")
+    cache.add_argument("--partial-max-age", type=float, default=7 * 24 * 3600, help="seconds before an interrupted download is dropped")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    from openmxr import metrics
+    metrics.set_progress_reporter(metrics.LogProgressReporter())
+    if args.metrics:
+        metrics.set_recorder(metrics.MetricsRecorder([metrics.JSONLinesExporter(args.metrics)]))
+
+    if args.command == "ingest":
+        from openmxr.ingest import ingest_playlist
+        tracks = ingest_playlist(args.playlist, io_workers=args.io_workers, cpu_workers=args.cpu_workers)
+        for track in tracks:
+            print(f"{track.index:4} {track.stage:8} {sum(track.timings.values()):7.1f}s {track.error or ''}")
+        return 1 if any(track.stage == "failed" for track in tracks) else 0
+
+    if args.command == "analyze":
+        from openmxr.analyze.batch import analyze_library
+        results = analyze_library(args.yt_links or None, workers=args.workers, max_memory=args.max_memory)
+        for result in results:
+            print(f"{result.status:7} {result.seconds:7.1f}s {round(result.bpm or 0) or '':>4} {'' if result.key is None else result.key:>3} {result.yt_link} {result.error or ''}")
+        return 1 if any(result.status == "failed" for result in results) else 0
+
+    if args.command == "mix":
+        from openmxr.ingest import load_playlist, resolve_playlist
+        from openmxr.mix.output import render_to
+        from openmxr.mix.renderer import MixRenderer, MixTrack
+        entries = load_playlist(args.playlist)
+        resolve_playlist(entries)
+        tracks = []
+        for entry in entries:
+            song = entry.find()
+            analysis = song.analyze()
+            # keep only the mapped samples, the downmixed and resampled copies the analysis left would add up over a set
+            song.release()
+            song.load_audio()
+            tracks.append(MixTrack.from_analysis(song, analysis, args.fade_bars))
+        renderer = MixRenderer(tracks, bpm=args.bpm, fade_bars=args.fade_bars)
+        frames = render_to(renderer, sys.stdout.buffer if args.output == "-" else args.output)
+        logging.info(f"rendered {frames / renderer.sample_rate / 60:.1f} minutes at {renderer.bpm:.1f}bpm")
+        return 0
+
+    if args.command == "cache":
+        from openmxr.cache import AUDIO_CACHE_MAX_BYTES, AudioCache, Cache, cache_usage
+        from openmxr.downloader.DownloadTask import prune_partial_downloads
+        if args.action == "prune":
+            for name, *_ in cache_usage():
+                if not name.endswith("/"):
+                    print(f"{name}: {Cache(name).prune()} expired entries removed")
+            evicted = AudioCache("audio").evict(args.audio_max_bytes or AUDIO_CACHE_MAX_BYTES)
+            print(f"audio: {len(evicted)} files evicted")
+            print(f"partial: {prune_partial_downloads(args.partial_max_age)} files removed")
+        print(f"{'cache':24} {'entries':>8} {'MiB':>10} {'expired':>8}")
+        for name, entries, size, expired in cache_usage():
+            print(f"{name:24} {entries:8} {size / 1024 ** 2:10.1f} {expired:8}")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
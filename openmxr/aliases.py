@@ -0,0 +1,66 @@
+from openmxr.cache import Cache, RecordCache
+from openmxr.models.TrackRecord import TrackRecord
+from openmxr.utils.ids import spotify_track_id, spotify_url, youtube_video_id
+
+
+def alias_keys(spotify_link: str | None = None, youtube_link: str | None = None) -> list[str]:
+    """Canonical aliases for whatever identifies a track, the youtube one first since it names the audio"""
+    keys = []
+    if youtube_link and (video_id := youtube_video_id(youtube_link)):
+        keys.append(f"youtube:{video_id}")
+    if spotify_link and (track_id := spotify_track_id(spotify_link)):
+        keys.append(f"spotify:{track_id}")
+    return keys
+
+
+def canonical_spotify_link(link: str) -> str:
+    """open.spotify.com/track/<id> without share parameters, links that don't parse stay as they are"""
+    track_id = spotify_track_id(link)
+    return spotify_url(track_id) if track_id else link
+
+
+class AliasIndex:
+    """Maps Spotify ids and YouTube video ids to one `TrackRecord`.
+
+    Records are keyed by YouTube video id, since that's what the audio is
+    downloaded from. The first link a video was cached under stays its
+    `yt_link`, so a different url for the same video still finds the audio.
+    """
+    records: RecordCache
+    aliases: Cache
+
+    def __init__(self, records: RecordCache | None = None, aliases: Cache | None = None):
+        self.records = records or RecordCache("tracks", TrackRecord)
+        self.aliases = aliases or Cache("aliases")
+
+    def lookup(self, spotify_link: str | None = None, youtube_link: str | None = None) -> TrackRecord | None:
+        keys = alias_keys(spotify_link, youtube_link)
+        if not keys:
+            return None
+        found = self.aliases.get_many(keys)
+        for key in keys:
+            if key in found and (record := self.records.get(found[key])):
+                return record
+        return None
+
+    def register(self, yt_link: str, spotify_link: str | None = None, digest: str | None = None) -> TrackRecord | None:
+        """Record a resolved track under every alias it has, only writes what changed"""
+        video_id = youtube_video_id(yt_link)
+        if not video_id:
+            return None
+        existing = self.records.get(video_id)
+        spotify_id = spotify_track_id(spotify_link) if spotify_link else None
+        record = TrackRecord(
+            youtube_id=video_id,
+            yt_link=existing.yt_link if existing else yt_link,
+            spotify_id=spotify_id or (existing.spotify_id if existing else None),
+            spotify_link=(spotify_url(spotify_id) if spotify_id else None) or (existing.spotify_link if existing else None),
+            digest=digest or (existing.digest if existing else None),
+        )
+        if existing is None or existing.to_dict() != record.to_dict():
+            self.records.set(video_id, record)
+        keys = alias_keys(record.spotify_link, yt_link)
+        current = self.aliases.get_many(keys)
+        if missing := {key: video_id for key in keys if current.get(key) != video_id}:
+            self.aliases.set_many(missing)
+        return record
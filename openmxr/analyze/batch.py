@@ -0,0 +1,161 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+import logging
+import multiprocessing
+import os
+import time
+from typing import Callable
+
+from openmxr import metrics
+from openmxr.analyze.engine import ANALYSIS_SAMPLE_RATE, get_engine
+from openmxr.cache import AudioCache, Cache, PCMHeader
+from openmxr.song import Song
+
+# rough working set of one track per second of audio: the 44.1kHz mono signal,
+# the complex STFT and its power, and madmom's spectrograms and activations
+ANALYSIS_BYTES_PER_SECOND = 2 * 1024 * 1024
+
+
+@dataclass
+class BatchResult:
+    yt_link: str
+    # done, cached or failed
+    status: str
+    seconds: float = 0
+    bpm: float | None = None
+    key: int | None = None
+    error: str | None = None
+
+
+def estimate_memory(header: PCMHeader) -> int:
+    """Peak bytes analyzing one track takes in a worker, on top of the worker itself"""
+    seconds = header.frames / header.sample_rate
+    # the cached audio is mapped, only the resampled copy is really allocated
+    return int(seconds * (ANALYSIS_BYTES_PER_SECOND + header.channels * ANALYSIS_SAMPLE_RATE * 4))
+
+
+def _init_worker():
+    # builds the engine (and with it the madmom networks) once per worker instead of per track
+    get_engine()
+
+
+def _analyze_worker(yt_link: str) -> BatchResult:
+    """Runs in the pool, only the link crosses the process boundary, the audio is mapped from the cache"""
+    began = time.monotonic()
+    song = Song.from_cache(yt_link)
+    song.load_audio()
+    try:
+        results = get_engine().run(song)
+    finally:
+        # a worker goes through many tracks, don't let it hold on to them
+        song.release()
+    return BatchResult(yt_link, "done", time.monotonic() - began,
+                       bpm=float(results["tempo"]["bpm"]), key=int(results["key"]["key"]))
+
+
+class BatchAnalyzer:
+    """Analyzes cached tracks on a process pool.
+
+    Every worker keeps one engine, so madmom's processors are built once
+    per process. Stage results are written to the analysis cache as soon
+    as they're computed, a crash only loses the tracks in flight, and
+    tracks whose stages are all cached are never sent to a worker.
+    Tracks are only started while their estimated memory fits in
+    `max_memory`, one always runs even if it's over.
+    """
+    yt_links: list[str]
+    workers: int
+    max_memory: int | None
+    on_result: Callable[[BatchResult], None]
+
+    def __init__(self, yt_links: list[str], workers: int | None = None, max_memory: int | None = None, on_result: Callable[[BatchResult], None] | None = None):
+        self.yt_links = list(dict.fromkeys(yt_links))
+        self.workers = workers or os.cpu_count() or 1
+        self.max_memory = max_memory
+        self.on_result = on_result or self.log_result
+        self._audio_cache = AudioCache("audio")
+
+    @staticmethod
+    def log_result(result: BatchResult):
+        if result.status == "failed":
+            logging.error(f"{result.yt_link}: analysis failed: {result.error}")
+        else:
+            logging.info(f"{result.yt_link}: {result.status} in {result.seconds:.1f}s")
+
+    def _pending(self, results: list[BatchResult]) -> list[tuple[str, int]]:
+        engine = get_engine()
+        pending = []
+        for yt_link in self.yt_links:
+            header = self._audio_cache.header(yt_link, migrate=True)
+            if header is None:
+                result = BatchResult(yt_link, "failed", error="audio not cached")
+            elif engine.is_cached(header.digest):
+                result = BatchResult(yt_link, "cached")
+            else:
+                pending.append((yt_link, estimate_memory(header)))
+                continue
+            results.append(result)
+            self.on_result(result)
+        # biggest first, so the small ones fill the gaps at the end
+        pending.sort(key=lambda item: -item[1])
+        return pending
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn, the parent may be running download threads
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker)
+
+    def run(self) -> list[BatchResult]:
+        results: list[BatchResult] = []
+        pending = self._pending(results)
+        running: dict[Future, tuple[str, int]] = {}
+        in_use = 0
+        pool = self._new_pool()
+
+        def finish(result: BatchResult):
+            results.append(result)
+            self.on_result(result)
+
+        try:
+            while pending or running:
+                while pending and len(running) < self.workers:
+                    fits = [i for i, (_, size) in enumerate(pending) if self.max_memory is None or in_use + size <= self.max_memory]
+                    if not fits and running:
+                        break
+                    yt_link, size = pending.pop(fits[0] if fits else -1)
+                    running[pool.submit(metrics.recorded(_analyze_worker, yt_link))] = (yt_link, size)
+                    in_use += size
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    yt_link, size = running.pop(future)
+                    in_use -= size
+                    try:
+                        finish(metrics.replay(future.result()))
+                    except BrokenProcessPool as e:
+                        broken = True
+                        finish(BatchResult(yt_link, "failed", error=f"worker died: {e}"))
+                    except Exception as e:
+                        finish(BatchResult(yt_link, "failed", error=str(e)))
+                if broken:
+                    # a worker was killed (usually out of memory), everything it shared the pool with is gone too
+                    for yt_link, _ in running.values():
+                        finish(BatchResult(yt_link, "failed", error="worker pool died"))
+                    running.clear()
+                    in_use = 0
+                    pool.shutdown(cancel_futures=True)
+                    pool = self._new_pool()
+        finally:
+            pool.shutdown(cancel_futures=True)
+        failed = [result for result in results if result.status == "failed"]
+        logging.info(f"analyzed {len(results) - len(failed)} of {len(results)} tracks")
+        return results
+
+
+def analyze_library(yt_links: list[str] | None = None, **kwargs) -> list[BatchResult]:
+    """Analyze the given tracks, or every track with cached audio when none are given"""
+    if yt_links is None:
+        audio_cache = AudioCache("audio")
+        # tracks only looked up, never downloaded, have metadata but nothing to analyze
+        yt_links = [yt_link for yt_link in Cache("yt").keys() if audio_cache.header(yt_link, migrate=True) is not None]
+    return BatchAnalyzer(yt_links, **kwargs).run()
@@ -0,0 +1,129 @@
+from dataclasses import dataclass
+import numpy as np
+import numpy.typing as npt
+
+from openmxr.analyze.engine import HOP_LENGTH, N_FFT, get_engine
+from openmxr.song import Song
+
+# a repetition has to last at least this many beats (4 bars of 4/4) to count
+MIN_BEATS = 16
+# cosine similarity of mean-removed beat chroma, averaged over MIN_BEATS, that counts as a repeat
+THRESHOLD = 0.5
+# seconds of audio transformed at once while building chroma
+CHROMA_BLOCK_SECONDS = 30
+# bytes the lag blocks of the similarity may take
+SIMILARITY_BLOCK_BYTES = 8 * 1024 * 1024
+
+# one row per repeated stretch: [start, end) repeats [start - lag, end - lag), in seconds
+REPEAT_DTYPE = np.dtype([("start", "f4"), ("end", "f4"), ("lag", "f4"), ("score", "f4"), ("repeats", "u2")])
+
+
+@dataclass
+class Segment:
+    start: float
+    end: float
+    score: float
+    repeats: int
+
+
+def beat_chroma(signal: npt.NDArray, sample_rate: int, beats: npt.NDArray) -> npt.NDArray[np.float32]:
+    """12 x len(beats) chroma averaged between consecutive beats.
+
+    The spectrogram is built `CHROMA_BLOCK_SECONDS` at a time and folded
+    into the beat grid right away, so only one block is ever in memory.
+    """
+    import librosa
+    beats = np.asarray(beats, dtype=np.float64)
+    sums = np.zeros((12, len(beats) + 1), dtype=np.float64)
+    counts = np.zeros(len(beats) + 1, dtype=np.int64)
+    frames = max(0, 1 + (len(signal) - N_FFT) // HOP_LENGTH)
+    block_frames = int(CHROMA_BLOCK_SECONDS * sample_rate / HOP_LENGTH)
+    for first in range(0, frames, block_frames):
+        count = min(block_frames, frames - first)
+        block = signal[first * HOP_LENGTH:(first + count - 1) * HOP_LENGTH + N_FFT]
+        power = np.abs(librosa.stft(block, n_fft=N_FFT, hop_length=HOP_LENGTH, center=False)) ** 2
+        chroma = librosa.feature.chroma_stft(S=power, sr=sample_rate, n_fft=N_FFT, hop_length=HOP_LENGTH, tuning=0.0)
+        centres = ((first + np.arange(chroma.shape[1])) * HOP_LENGTH + N_FFT / 2) / sample_rate
+        # column 0 collects the frames before the first beat and is dropped
+        columns = np.searchsorted(beats, centres, side="right")
+        np.add.at(sums.T, columns, chroma.T)
+        counts += np.bincount(columns, minlength=len(counts))
+    return (sums[:, 1:] / np.maximum(counts[1:], 1)).astype(np.float32)
+
+
+def find_repeats(chroma: npt.NDArray, min_beats: int = MIN_BEATS, threshold: float = THRESHOLD) -> npt.NDArray:
+    """Repeated stretches of beats, as (start, end, lag, score) in beats.
+
+    Walks the time-lag similarity a block of lags at a time, so memory
+    stays at `SIMILARITY_BLOCK_BYTES` however long the track is, instead
+    of the full beats x beats matrix.
+    """
+    beats = chroma.shape[1]
+    features = chroma - chroma.mean(axis=1, keepdims=True)
+    features /= np.maximum(np.linalg.norm(features, axis=0), 1e-6)
+    features = np.ascontiguousarray(features.T, dtype=np.float32)
+    lags_per_block = max(1, SIMILARITY_BLOCK_BYTES // (4 * 3 * max(beats, 1)))
+    found = []
+    for first_lag in range(min_beats, beats - min_beats + 1, lags_per_block):
+        lags = np.arange(first_lag, min(first_lag + lags_per_block, beats - min_beats + 1))
+        # similarity[k, i] compares beat i with beat i - lags[k], zero where there's nothing to compare
+        similarity = np.zeros((len(lags), beats), dtype=np.float32)
+        for k, lag in enumerate(lags):
+            np.einsum("ij,ij->i", features[lag:], features[:-lag], out=similarity[k, lag:])
+        # average over min_beats along each diagonal, smoothed[k, i] covers beats i .. i + min_beats - 1
+        cumulative = np.cumsum(similarity, axis=1, dtype=np.float32)
+        cumulative = np.concatenate((np.zeros((len(lags), 1), dtype=np.float32), cumulative), axis=1)
+        smoothed = (cumulative[:, min_beats:] - cumulative[:, :-min_beats]) / min_beats
+        # windows reaching before the lag would compare against nothing
+        smoothed[np.arange(smoothed.shape[1]) < lags[:, None]] = -1
+        above = np.concatenate((np.zeros((len(lags), 1), bool), smoothed >= threshold, np.zeros((len(lags), 1), bool)), axis=1)
+        rows, edges = np.nonzero(np.diff(above.astype(np.int8), axis=1))
+        for k, start, stop in zip(rows[::2], edges[::2], edges[1::2]):
+            # the windows reach past the repeat on both sides, trim back to the beats that match
+            matching = np.nonzero(similarity[k, start:stop - 1 + min_beats] >= threshold)[0]
+            start, end = start + matching[0], start + matching[-1] + 1
+            found.append((start, end, lags[k], float(similarity[k, start:end].mean())))
+    return np.array(found, dtype=np.float64).reshape(-1, 4)
+
+
+def rank_repeats(repeats: npt.NDArray, beats: npt.NDArray) -> npt.NDArray:
+    """Repeats in seconds, with how many other repeats cover the same stretch, most repeated first"""
+    result = np.zeros(len(repeats), dtype=REPEAT_DTYPE)
+    if not len(repeats):
+        return result
+    start, end, lag = repeats[:, :3].T.astype(np.intp)
+    score = repeats[:, 3]
+    # the last beat lasts as long as a typical one
+    edges = np.append(beats, beats[-1] + np.median(np.diff(beats)))
+    # a stretch is covered by a repeat when they overlap by at least half of the stretch
+    # both halves of every repeat count, the stretch itself and the earlier one it copies
+    lo = np.concatenate((start, start - lag))
+    hi = np.concatenate((end, end - lag))
+    overlap = np.minimum(end[:, None], hi[None]) - np.maximum(start[:, None], lo[None])
+    repeated = (overlap >= (end - start)[:, None] / 2).sum(axis=1)
+    result["start"] = edges[start]
+    result["end"] = edges[end]
+    result["lag"] = edges[start] - edges[start - lag]
+    result["score"] = score
+    result["repeats"] = repeated
+    return result[np.lexsort((-result["score"], -result["repeats"]))]
+
+
+def detect_repeats(signal: npt.NDArray, sample_rate: int, beats: npt.NDArray) -> npt.NDArray:
+    """Every repeated stretch of a mono signal on a beat grid (detected downbeats or Spotify's beats)"""
+    beats = np.asarray(beats, dtype=np.float64)
+    if len(beats) < 2 * MIN_BEATS:
+        return np.zeros(0, dtype=REPEAT_DTYPE)
+    return rank_repeats(find_repeats(beat_chroma(signal, sample_rate, beats)), beats)
+
+
+def get_repeats(song: Song) -> list[Segment]:
+    """Repeated stretches of a song, most repeated first, cached with the rest of its analysis"""
+    repeats = get_engine().run(song)["chorus"]["repeats"]
+    return [Segment(float(row["start"]), float(row["end"]), float(row["score"]), int(row["repeats"])) for row in repeats]
+
+
+def get_chorus(song: Song) -> Segment | None:
+    """The most repeated stretch, which in most pop songs is the chorus"""
+    repeats = get_repeats(song)
+    return repeats[0] if repeats else None
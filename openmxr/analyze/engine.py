@@ -0,0 +1,209 @@
+from dataclasses import dataclass, field
+import logging
+import threading
+from typing import IO, Any, Callable
+import numpy as np
+import numpy.typing as npt
+
+from openmxr import metrics
+from openmxr.analyze.heat_moments import get_heat_moments
+from openmxr.cache import Cache
+from openmxr.models.AnalyzedTrack import AnalyzedTrack
+from openmxr.song import Song
+from openmxr.spotify.analyze import SpotifyAnalysis
+
+# madmom's downbeat RNN is trained on 44.1kHz
+ANALYSIS_SAMPLE_RATE = 44100
+N_FFT = 2048
+# 10ms hops, the same 100 frames per second madmom's DBN runs at
+HOP_LENGTH = 441
+# bump when the shared spectrogram changes, every stage built on it is recomputed
+FRONTEND_VERSION = 1
+
+
+class AnalysisCache(Cache):
+    """Per-stage results as npz, a dict of arrays per entry"""
+    binary_format = True
+
+    def load(self, file: IO[Any]):
+        with np.load(file) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+
+    def dump(self, data, file):
+        np.savez(file, **data)
+
+
+@dataclass
+class FrontEnd:
+    """One power spectrogram of the mono 44.1kHz signal, shared by every spectral stage"""
+    power: npt.NDArray[np.float32]
+
+    @classmethod
+    def compute(cls, signal: npt.NDArray) -> "FrontEnd":
+        import librosa
+        spectrum = librosa.stft(signal, n_fft=N_FFT, hop_length=HOP_LENGTH)
+        return cls(power=(np.abs(spectrum) ** 2).astype(np.float32))
+
+
+@dataclass
+class AnalysisContext:
+    """What one track's stages share, each piece computed the first time a stage asks for it"""
+    song: Song
+    processors: "MadmomProcessors"
+    results: dict[str, dict[str, npt.NDArray]] = field(default_factory=dict)
+    _signal: npt.NDArray | None = None
+    _frontend: FrontEnd | None = None
+
+    @property
+    def signal(self) -> npt.NDArray:
+        if self._signal is None:
+            self._signal = np.ascontiguousarray(self.song.resampled(ANALYSIS_SAMPLE_RATE, mono=True), dtype=np.float32)
+        return self._signal
+
+    @property
+    def frontend(self) -> FrontEnd:
+        if self._frontend is None:
+            self._frontend = FrontEnd.compute(self.signal)
+        return self._frontend
+
+
+class MadmomProcessors:
+    """madmom's processors load their networks when built, so they're built once and reused"""
+    def __init__(self):
+        self._downbeat_rnn = None
+        self._downbeat_dbn = None
+
+    def downbeats(self, signal: npt.NDArray) -> npt.NDArray:
+        if self._downbeat_rnn is None:
+            from madmom.features.downbeats import DBNDownBeatTrackingProcessor, RNNDownBeatProcessor
+            self._downbeat_rnn = RNNDownBeatProcessor()
+            self._downbeat_dbn = DBNDownBeatTrackingProcessor(beats_per_bar=[4], fps=100)
+        activations = self._downbeat_rnn(signal, sample_rate=ANALYSIS_SAMPLE_RATE, num_channels=1)
+        return self._downbeat_dbn(activations) # type: ignore
+
+
+@dataclass
+class Stage:
+    name: str
+    version: int
+    compute: Callable[[AnalysisContext], dict[str, npt.NDArray]]
+    depends: tuple[str, ...] = ()
+    uses_frontend: bool = False
+
+
+def _downbeats(context: AnalysisContext):
+    # madmom builds its own multi-resolution spectrograms, it only shares the resampled signal
+    return {"downbeats": np.asarray(context.processors.downbeats(context.signal), dtype=np.float64).reshape(-1, 2)}
+
+
+def _tempo(context: AnalysisContext):
+    beats = context.results["downbeats"]["downbeats"][:, 0]
+    if len(beats) > 2:
+        return {"bpm": np.array(60 / np.median(np.diff(beats)))}
+    # too few tracked beats, estimate from the onset envelope instead
+    import librosa
+    mel = librosa.feature.melspectrogram(S=context.frontend.power, sr=ANALYSIS_SAMPLE_RATE)
+    envelope = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=ANALYSIS_SAMPLE_RATE, hop_length=HOP_LENGTH)
+    tempo = librosa.feature.tempo if hasattr(librosa.feature, "tempo") else librosa.beat.tempo
+    return {"bpm": np.asarray(tempo(onset_envelope=envelope, sr=ANALYSIS_SAMPLE_RATE, hop_length=HOP_LENGTH))[0]}
+
+
+def _key(context: AnalysisContext):
+    import librosa
+    chroma = librosa.feature.chroma_stft(S=context.frontend.power, sr=ANALYSIS_SAMPLE_RATE, n_fft=N_FFT, hop_length=HOP_LENGTH)
+    mean_chroma = chroma.mean(axis=1)
+    return {"key": np.array(int(np.argmax(mean_chroma))), "chroma": mean_chroma.astype(np.float32)}
+
+
+def _chorus(context: AnalysisContext):
+    from openmxr.analyze.chorus import detect_repeats
+    # every tracked beat, not only the downbeats
+    beats = context.results["downbeats"]["downbeats"][:, 0]
+    return {"repeats": detect_repeats(context.signal, ANALYSIS_SAMPLE_RATE, beats)}
+
+
+STAGES = [
+    Stage("downbeats", 1, _downbeats),
+    Stage("tempo", 1, _tempo, depends=("downbeats",), uses_frontend=True),
+    Stage("key", 1, _key, uses_frontend=True),
+    Stage("chorus", 1, _chorus, depends=("downbeats",)),
+]
+
+
+class AnalysisEngine:
+    """Runs the analysis stages of a track and keeps every stage's result.
+
+    Results are cached by the md5 of the cached audio and a fingerprint of
+    the stage's version, the versions it depends on and the front-end
+    version, so changing one algorithm only recomputes what built on it.
+    """
+    stages: list[Stage]
+    cache: AnalysisCache
+
+    def __init__(self, stages: list[Stage] = STAGES, cache: AnalysisCache | None = None):
+        self.stages = stages
+        self.cache = cache or AnalysisCache("analysis")
+        self.processors = MadmomProcessors()
+        self._fingerprints: dict[str, str] = {}
+        for stage in stages:
+            parts = [f"{stage.name}{stage.version}"]
+            parts += [self._fingerprints[name] for name in stage.depends]
+            if stage.uses_frontend:
+                parts.append(f"frontend{FRONTEND_VERSION}")
+            self._fingerprints[stage.name] = ".".join(parts)
+
+    def cache_key(self, digest: str, stage: Stage) -> str:
+        return f"{digest}:{self._fingerprints[stage.name]}"
+
+    def is_cached(self, digest: str) -> bool:
+        """Whether every stage of the audio with this digest is already stored"""
+        keys = [self.cache_key(digest, stage) for stage in self.stages]
+        return len(self.cache.backend.get_many(keys)) == len(keys)
+
+    def run(self, song: Song) -> dict[str, dict[str, npt.NDArray]]:
+        header = song.audio_header
+        if header is None:
+            song.load_audio()
+            header = song.audio_header
+        if header is None:
+            raise Exception("audio not cached, can't analyze")
+        keys = {stage.name: self.cache_key(header.digest, stage) for stage in self.stages}
+        cached = self.cache.get_many(keys.values())
+        context = AnalysisContext(song, self.processors)
+        for stage in self.stages:
+            if (result := cached.get(keys[stage.name])) is None:
+                logging.info(f"analyzing {stage.name} of {song.yt_link}")
+                with metrics.span("analysis", track=song.yt_link, stage=stage.name):
+                    result = stage.compute(context)
+                self.cache.set(keys[stage.name], result)
+            context.results[stage.name] = result
+        return context.results
+
+    def analyze(self, song: Song) -> AnalyzedTrack:
+        results = self.run(song)
+        sample_rate = song.sample_rate
+        downbeats = results["downbeats"]["downbeats"]
+        bars = downbeats[downbeats[:, 1] == 1, 0] if len(downbeats) else downbeats[:, 0]
+        # spotify's sections add cue candidates, only when they're already cached, analysis stays offline
+        spotify_analysis = SpotifyAnalysis.cached(song)
+        return AnalyzedTrack(
+            meta=song.metadata,
+            sample_rate=sample_rate,
+            key=int(results["key"]["key"]),
+            waveform=song.waveform,
+            downbeats=[int(i) for i in np.round(bars * sample_rate)],
+            best_downbeats=[cue.sample for cue in get_heat_moments(song, downbeats, spotify_analysis)],
+            bpm=int(round(float(results["tempo"]["bpm"]))),
+        )
+
+
+_engine: AnalysisEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> AnalysisEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AnalysisEngine()
+        return _engine
@@ -1,17 +1,96 @@
+from dataclasses import dataclass
+import numpy as np
+import numpy.typing as npt
 from openmxr.song import Song
+from openmxr.spotify.analyze import AnalysisColumns, nearest_start
 
+# how much a candidate from each source counts when they land on the same bar
+HEATMAP_WEIGHT = 1.0
+SECTION_WEIGHT = 0.6
 
-def get_heat_moments(song: Song):
-    pass
 
-def has_heatmap(song: Song) -> list[int]:
-    return song.youtube_meta.get("heatmap", None) and True
+@dataclass
+class CuePoint:
+    sample: int
+    score: float
+
+
+def heatmap_peaks(heatmap: list[tuple[float, float, float]]) -> tuple[npt.NDArray, npt.NDArray]:
+    """Centres (seconds) and normalized values of the local maxima of youtube's replay graph"""
+    if not heatmap:
+        return np.empty(0), np.empty(0)
+    start, end, value = np.asarray(heatmap, dtype=np.float64).T
+    padded = np.concatenate(([-np.inf], value, [-np.inf]))
+    peaks = (value >= padded[:-2]) & (value > padded[2:])
+    top = value.max() or 1.0
+    return ((start + end) / 2)[peaks], value[peaks] / top
+
+
+def section_candidates(sections: npt.NDArray) -> tuple[npt.NDArray, npt.NDArray]:
+    """Section starts (seconds) scored by their loudness relative to the rest of the track"""
+    if not len(sections):
+        return np.empty(0), np.empty(0)
+    loudness = sections["loudness"].astype(np.float64)
+    spread = np.ptp(loudness) or 1.0
+    return sections["start"].astype(np.float64), (loudness - loudness.min()) / spread
+
+
+def bar_starts(downbeats: npt.NDArray | None = None, analysis: AnalysisColumns | None = None) -> npt.NDArray:
+    """Bar boundaries in seconds, from madmom's (time, beat number) downbeats or Spotify's bars"""
+    if downbeats is not None and len(downbeats):
+        downbeats = np.asarray(downbeats)
+        if downbeats.ndim == 2:
+            downbeats = downbeats[downbeats[:, 1] == 1, 0]
+        return np.sort(downbeats.astype(np.float64))
+    if analysis is not None:
+        return analysis.bars["start"].astype(np.float64)
+    return np.empty(0)
+
+
+def rank_moments(times: npt.NDArray, scores: npt.NDArray, bars: npt.NDArray, sample_rate: int, count: int = 3, min_distance: float = 8.0) -> tuple[npt.NDArray[np.int64], npt.NDArray]:
+    """Snap candidate times to bars, add up candidates sharing a bar and keep the
+    best `count` that are at least `min_distance` seconds apart.
+
+    Returns cue positions in samples and their scores, best first.
+    """
+    if not len(times):
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    if len(bars):
+        bar_index, inverse = np.unique(nearest_start(bars, times), return_inverse=True)
+        positions = bars[bar_index]
+        totals = np.bincount(inverse, weights=scores)
+    else:
+        positions, totals = times, scores
+    order = np.argsort(-totals, kind="stable")
+    picked: list[int] = []
+    for i in order:
+        if len(picked) == count:
+            break
+        if not picked or np.min(np.abs(positions[picked] - positions[i])) >= min_distance:
+            picked.append(i)
+    return np.round(positions[picked] * sample_rate).astype(np.int64), totals[picked]
+
+
+def get_heat_moments(song: Song, downbeats: npt.NDArray | None = None, analysis: AnalysisColumns | None = None, count: int = 3) -> list[CuePoint]:
+    """Ranked cue points merged from the heatmap and Spotify's sections, snapped to bars"""
+    heat_times, heat_scores = heatmap_peaks(song.youtube_meta.heatmap or [])
+    section_times, section_scores = section_candidates(analysis.sections) if analysis is not None else (np.empty(0), np.empty(0))
+    times = np.concatenate((heat_times, section_times))
+    scores = np.concatenate((heat_scores * HEATMAP_WEIGHT, section_scores * SECTION_WEIGHT))
+    samples, totals = rank_moments(times, scores, bar_starts(downbeats, analysis), song.sample_rate, count)
+    return [CuePoint(int(sample), float(score)) for sample, score in zip(samples, totals)]
+
+def has_heatmap(song: Song) -> bool:
+    return bool(song.youtube_meta.heatmap)
 
 def from_heatmap(song: Song):
-    if not song.youtube_meta.get("heatmap"):
+    if not song.youtube_meta.heatmap:
         raise Exception("heatmap not available")
-    items = sorted(song.youtube_meta["heatmap"], reverse=True, key=lambda x:x["value"])[:3]
-    return [int(i["start_time"] * song.sample_rate+i["end_time"] * song.sample_rate)//2 for i in items]
-    
-def from_spotify(song: Song) -> list[int]:
-    pass
\ No newline at end of file
+    start, end, value = np.asarray(song.youtube_meta.heatmap, dtype=np.float64).T
+    top = np.argsort(-value, kind="stable")[:3]
+    return [int(i) for i in ((start[top] + end[top]) * song.sample_rate) // 2]
+
+def from_spotify(song: Song, analysis: AnalysisColumns) -> list[int]:
+    """Section starts in samples, loudest first"""
+    times, scores = section_candidates(analysis.sections)
+    return [int(i) for i in np.round(times[np.argsort(-scores, kind="stable")] * song.sample_rate)]
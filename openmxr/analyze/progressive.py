@@ -0,0 +1,186 @@
+"""Analysis fed one decoded block at a time, while the track is still downloading.
+
+Onsets, loudness and chroma are accumulated block by block, so a
+provisional tempo, key and downbeat grid is there a few seconds into the
+stream. Once the whole track is cached the full engine replaces them.
+"""
+from dataclasses import dataclass, field
+import math
+from typing import Callable
+import numpy as np
+import numpy.typing as npt
+
+from openmxr.song import Song
+
+# onset frames per second, the rate the engine's beat tracker runs at too
+FRAME_RATE = 100
+N_FFT = 2048
+# chroma needs finer frequency bins than onsets, semitones are only 6Hz apart at 100Hz
+CHROMA_N_FFT = 8192
+MIN_BPM = 60
+MAX_BPM = 200
+# tempos are weighted towards this one, octave errors are the usual mistake
+PRIOR_BPM = 120
+# audio needed before a tempo is worth reporting
+MIN_SECONDS = 6.0
+# seconds of onsets the tempo is estimated from
+TEMPO_WINDOW = 30.0
+# the kick drum band, whose onsets mark the downbeats
+LOW_BAND_HZ = 150.0
+
+
+@dataclass
+class Estimate:
+    # seconds of audio analyzed
+    seconds: float
+    bpm: float | None = None
+    # pitch class of the strongest chroma bin, like the engine's key stage
+    key: int | None = None
+    # frames at the track's sample rate
+    downbeats: list[int] = field(default_factory=list)
+    # dBFS of everything so far
+    loudness: float | None = None
+    # refined by the full engine
+    final: bool = False
+
+
+class ProgressiveAnalyzer:
+    """Running onset, loudness and chroma accumulators, `feed` blocks and ask for an `estimate` any time"""
+    sample_rate: int
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.hop = sample_rate // FRAME_RATE
+        self.frames = 0
+        self._window = np.hanning(N_FFT).astype(np.float32)
+        frequencies = np.fft.rfftfreq(N_FFT, 1 / sample_rate)
+        self._low_bins = frequencies < LOW_BAND_HZ
+        # power of the bins from about G2 to C8 folded onto their pitch class, C first
+        frequencies = np.fft.rfftfreq(CHROMA_N_FFT, 1 / sample_rate)
+        pitched = (frequencies > 95) & (frequencies < 4200)
+        classes = (np.round(12 * np.log2(frequencies[pitched] / 440.0)).astype(int) + 9) % 12
+        self._chroma_window = np.hanning(CHROMA_N_FFT).astype(np.float32)
+        self._chroma_map = np.zeros((len(frequencies), 12), dtype=np.float32)
+        self._chroma_map[np.flatnonzero(pitched), classes] = 1
+        self._chroma = np.zeros(12, dtype=np.float64)
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._chroma_buffer = np.zeros(0, dtype=np.float32)
+        self._previous: npt.NDArray[np.float32] | None = None
+        self._onsets: list[npt.NDArray[np.float32]] = []
+        self._low_onsets: list[npt.NDArray[np.float32]] = []
+        self._square_sum = 0.0
+
+    @property
+    def seconds(self) -> float:
+        return self.frames / self.sample_rate
+
+    def feed(self, block: npt.NDArray):
+        """A (channels, frames) or mono float block, the next one of the track"""
+        mono = np.asarray(block if block.ndim == 1 else block.mean(axis=0), dtype=np.float32)
+        self.frames += len(mono)
+        self._square_sum += float(np.dot(mono, mono))
+        self._feed_chroma(mono)
+        self._buffer = np.concatenate([self._buffer, mono])
+        if len(self._buffer) < N_FFT:
+            return
+        count = (len(self._buffer) - N_FFT) // self.hop + 1
+        frames = np.lib.stride_tricks.sliding_window_view(self._buffer, N_FFT)[::self.hop][:count]
+        magnitude = np.abs(np.fft.rfft(frames * self._window, axis=1)).astype(np.float32)
+        compressed = np.log1p(100 * magnitude)
+        previous = compressed[:1] if self._previous is None else self._previous[None]
+        # spectral flux, how much louder each bin got since the previous frame
+        flux = np.maximum(np.diff(compressed, axis=0, prepend=previous), 0)
+        self._onsets.append(flux.sum(axis=1))
+        self._low_onsets.append(flux[:, self._low_bins].sum(axis=1))
+        self._previous = compressed[-1]
+        self._buffer = self._buffer[count * self.hop:]
+
+    def _feed_chroma(self, mono: npt.NDArray[np.float32]):
+        # half overlapping windows, only the long term average is kept
+        hop = CHROMA_N_FFT // 2
+        self._chroma_buffer = np.concatenate([self._chroma_buffer, mono])
+        if len(self._chroma_buffer) < CHROMA_N_FFT:
+            return
+        count = (len(self._chroma_buffer) - CHROMA_N_FFT) // hop + 1
+        frames = np.lib.stride_tricks.sliding_window_view(self._chroma_buffer, CHROMA_N_FFT)[::hop][:count]
+        power = np.abs(np.fft.rfft(frames * self._chroma_window, axis=1)) ** 2
+        self._chroma += power.sum(axis=0) @ self._chroma_map
+        self._chroma_buffer = self._chroma_buffer[count * hop:]
+
+    def _onset_envelope(self) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.float32]]:
+        if len(self._onsets) > 1:
+            self._onsets = [np.concatenate(self._onsets)]
+            self._low_onsets = [np.concatenate(self._low_onsets)]
+        if not self._onsets:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+        return self._onsets[0], self._low_onsets[0]
+
+    def _tempo(self, onsets: npt.NDArray) -> float | None:
+        recent = onsets[-int(TEMPO_WINDOW * FRAME_RATE):]
+        recent = recent - recent.mean()
+        longest = int(math.ceil(60 * FRAME_RATE / MIN_BPM)) + 1
+        if len(recent) < 2 * longest:
+            return None
+        spectrum = np.fft.rfft(recent, 2 * len(recent))
+        autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum))[:longest + 1]
+        lags = np.arange(int(60 * FRAME_RATE / MAX_BPM), longest)
+        prior = np.exp(-0.5 * np.log2(60 * FRAME_RATE / lags / PRIOR_BPM) ** 2)
+        best = int(lags[np.argmax(autocorrelation[lags] * prior)])
+        # parabolic interpolation between the neighbouring lags, frames are 10ms apart
+        left, middle, right = autocorrelation[best - 1:best + 2]
+        denominator = left - 2 * middle + right
+        offset = 0.5 * (left - right) / denominator if denominator else 0.0
+        return 60 * FRAME_RATE / (best + float(np.clip(offset, -0.5, 0.5)))
+
+    def _downbeats(self, onsets: npt.NDArray, low_onsets: npt.NDArray, bpm: float) -> list[int]:
+        period = 60 * FRAME_RATE / bpm
+        count = int((len(onsets) - 1) / period)
+        if count < 4:
+            return []
+        # the beat phase that lands on the most onsets, then the bar phase with the most kick drum
+        grid = np.arange(count) * period
+        phases = np.arange(int(period))
+        scores = onsets[np.minimum((phases[:, None] + grid[None]).astype(int), len(onsets) - 1)].sum(axis=1)
+        beats = (phases[np.argmax(scores)] + grid).astype(int)
+        beats = beats[beats < len(onsets)]
+        bar_scores = [low_onsets[beats[phase::4]].sum() for phase in range(4)]
+        downbeats = beats[int(np.argmax(bar_scores))::4]
+        # an onset frame is heard at the middle of its window
+        return [int(frame * self.hop + N_FFT // 2) for frame in downbeats]
+
+    def estimate(self) -> Estimate:
+        estimate = Estimate(self.seconds)
+        if self.frames:
+            estimate.loudness = 10 * math.log10(max(self._square_sum / self.frames, 1e-10))
+        if self._chroma.any():
+            estimate.key = int(np.argmax(self._chroma))
+        if self.seconds < MIN_SECONDS:
+            return estimate
+        onsets, low_onsets = self._onset_envelope()
+        if (bpm := self._tempo(onsets)):
+            estimate.bpm = bpm
+            estimate.downbeats = self._downbeats(onsets, low_onsets, bpm)
+        return estimate
+
+
+def analyze_progressive(song: Song, on_estimate: Callable[[Estimate], None] | None = None, interval: float = 2.0, refine: bool = True) -> Estimate:
+    """Stream the track in, reporting a provisional estimate every `interval` seconds of audio.
+
+    With `refine` the last estimate comes from the full engine, run once
+    the track is cached.
+    """
+    header = song.audio_header if song.has_cached_audio else None
+    analyzer = ProgressiveAnalyzer(header.sample_rate if header else song.decode_sample_rate)
+    reported = 0.0
+    for block in song.stream_audio_blocks():
+        analyzer.feed(block)
+        if on_estimate and analyzer.seconds - reported >= interval:
+            reported = analyzer.seconds
+            on_estimate(analyzer.estimate())
+    estimate = analyzer.estimate()
+    if refine:
+        track = song.analyze()
+        estimate = Estimate(estimate.seconds, float(track.bpm), track.key, track.downbeats, estimate.loudness, final=True)
+    if on_estimate:
+        on_estimate(estimate)
+    return estimate
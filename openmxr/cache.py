@@ -1,28 +1,49 @@
+from dataclasses import dataclass
+import hashlib
 from io import BytesIO, TextIOWrapper
 import io
 import json
 import logging
 from os import makedirs, path
 import os
-from random import sample
-from typing import IO
+import struct
+import time
+from typing import IO, Any, Protocol
 import numpy as np
-import soundfile as sf
-from pyparsing import Any
+import numpy.typing as npt
 from bz2 import BZ2Compressor, BZ2Decompressor
-from madmom.io.audio import load_wave_file, write_wave_file, Signal
-from tqdm.notebook import tqdm
 
+from openmxr import metrics
+from openmxr.cache_backends import CACHE_DIR, CacheBackend, FileBackend, SQLiteBackend
+from openmxr.utils.files import unique_tmp_filename
 from openmxr.utils.hash import mkmd5
+from openmxr.utils.stream_url import stream_url_expires
+from openmxr.waveform import WaveformPyramid
 
 
 class Cache:
+    """JSON entries in the shared SQLite store, see `openmxr.cache_backends`.
+
+    Subclasses change the serialization through `load`/`dump` and the
+    storage through `backend`. Entries left in the old one-file-per-key
+    layout are moved over the first time they're read.
+    """
     name: str
     binary_format = False
+    extension = "cache"
+    backend: CacheBackend
+    # seconds an entry stays valid, None keeps it forever
+    ttl: float | None
+    hits: int
+    misses: int
     
-    def __init__(self, name: str):
+    def __init__(self, name: str, backend: CacheBackend | None = None, ttl: float | None = None):
         self.name = name
-        self.check_cache_exists()
+        self.backend = backend or SQLiteBackend(name)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._legacy_files = None if isinstance(self.backend, FileBackend) else FileBackend(path.join(CACHE_DIR, name), self.extension)
 
     def load(self, file: IO[Any]):
         return json.load(file)
@@ -30,71 +51,441 @@ class Cache:
     def dump(self, data, file: TextIOWrapper):
         return json.dump(data, file, ensure_ascii=False)
 
+    def encode(self, data) -> bytes:
+        buffer = io.BytesIO()
+        file = buffer if self.binary_format else TextIOWrapper(buffer, encoding="utf-8")
+        self.dump(data, file) # type: ignore
+        file.flush()
+        return buffer.getvalue()
+
+    def decode(self, raw: bytes):
+        buffer = io.BytesIO(raw)
+        return self.load(buffer if self.binary_format else TextIOWrapper(buffer, encoding="utf-8"))
 
     def check_cache_exists(self):
-        if not path.isdir(path.join("./.cache/", self.name)):
-            logging.debug(f"Creating cache {path.join('./.cache/', self.name)}")
-            makedirs(path.join("./.cache/", self.name))
+        if not path.isdir(path.join(CACHE_DIR, self.name)):
+            logging.debug(f"Creating cache {path.join(CACHE_DIR, self.name)}")
+            makedirs(path.join(CACHE_DIR, self.name))
 
     def get_cache_filename(self, cache_key: str) -> str:
-        return path.join("./.cache/", self.name, f"{mkmd5(cache_key)}.cache")
+        return path.join(CACHE_DIR, self.name, f"{mkmd5(cache_key)}.{self.extension}")
 
-    def get(self, key) -> Any | None:
-        cache_filename = self.get_cache_filename(key)
-        if not path.exists(cache_filename):
+    def _decode_entry(self, key, raw: bytes) -> Any | None:
+        try:
+            return self.decode(raw)
+        except (ValueError, EOFError, OSError) as e:
+            logging.warning(f"{self.name.upper()}: dropping corrupt entry {key!r}: {e}")
+            self.backend.delete(key)
             return None
-        logging.debug(f"{self.name.upper()}: loading {cache_filename}")
-        with open(cache_filename, f'r{"b" if self.binary_format else ""}') as file:
-            try:
-                return self.load(file) #type: ignore
-            except:
-                return None
+
+    def expires_at(self, data) -> float | None:
+        return time.time() + self.ttl if self.ttl else None
+
+    def _migrate_legacy(self, key) -> bytes | None:
+        if not self._legacy_files or (raw := self._legacy_files.get(key)) is None:
+            return None
+        logging.debug(f"{self.name.upper()}: migrating {self._legacy_files.filename(key)}")
+        if (data := self._decode_entry(key, raw)) is not None:
+            self.backend.set(key, raw, self.expires_at(data))
+        self._legacy_files.delete(key)
+        return raw
+
+    def get(self, key, stale: bool = False) -> Any | None:
+        """`stale` also returns entries past their expiry that haven't been pruned yet"""
+        raw = self.backend.get(key, include_expired=stale)
+        if raw is None:
+            raw = self._migrate_legacy(key)
+        data = None if raw is None else self._decode_entry(key, raw)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        metrics.cache_lookup(self.name, data is not None)
+        return data
+
+    def get_many(self, keys) -> dict[str, Any]:
+        keys = list(keys)
+        found = self.backend.get_many(keys)
+        for key in keys:
+            if key not in found and (raw := self._migrate_legacy(key)) is not None:
+                found[key] = raw
+        result = {key: data for key, raw in found.items() if (data := self._decode_entry(key, raw)) is not None}
+        self.hits += len(result)
+        self.misses += len(keys) - len(result)
+        for key in keys:
+            metrics.cache_lookup(self.name, key in result)
+        return result
 
     def set(self, key, data):
-        self.check_cache_exists()
-        cache_filename = self.get_cache_filename(key)
-        logging.debug(f"{self.name.upper()}: saving {cache_filename}")
-        with open(cache_filename, f'w{"b" if self.binary_format else ""}') as file:
-            self.dump(data, file) #type: ignore
-            
+        logging.debug(f"{self.name.upper()}: saving {key}")
+        self.backend.set(key, self.encode(data), self.expires_at(data))
+
+    def set_many(self, items: dict[str, Any]):
+        self.backend.set_many({key: self.encode(data) for key, data in items.items()},
+                              {key: self.expires_at(data) for key, data in items.items()})
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def keys(self) -> list[str]:
+        return self.backend.keys()
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def prune(self) -> int:
+        """Drop expired entries, returns how many"""
+        return self.backend.delete_expired()
+
+
+class Record(Protocol):
+    """A model with a compact dict form, see `openmxr.models`"""
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Record": ...
+
+    def to_dict(self) -> dict[str, Any]: ...
+
+
+class RecordCache(Cache):
+    """Typed records stored in their compact `to_dict` form.
+
+    Entries still holding a full raw dict are projected when read and
+    written back compacted, ones missing fields are dropped as corrupt.
+    """
+    record: type[Record]
+
+    def __init__(self, name: str, record: type[Record], backend: CacheBackend | None = None, ttl: float | None = None):
+        super().__init__(name, backend, ttl)
+        self.record = record
+
+    def load(self, file: IO[Any]):
+        data = json.load(file)
+        try:
+            return self.record.from_dict(data)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"not a {self.record.__name__}: {e!r}") from e
+
+    def dump(self, data, file: TextIOWrapper):
+        return json.dump(data.to_dict(), file, ensure_ascii=False, separators=(",", ":"))
+
+    def _decode_entry(self, key, raw: bytes) -> Any | None:
+        data = super()._decode_entry(key, raw)
+        if data is not None and not raw.startswith(b'{"v":'):
+            self.backend.set(key, self.encode(data), self.expires_at(data))
+        return data
+
+
+class StreamMetaCache(RecordCache):
+    """youtube metadata, valid as long as the stream url inside it is"""
+
+    def expires_at(self, data) -> float | None:
+        if data.url and (expires := stream_url_expires(data.url)):
+            return expires
+        return super().expires_at(data)
+
     
-class AudioCache(Cache):
-    compressor = BZ2Compressor()
-    decompressor = BZ2Decompressor()
+class BZ2AudioCache(Cache):
+    """Original audio format: a WAV file BZ2-compressed in 256 KiB chunks.
+
+    Only kept around so old `.cache/audio/*.cache` files can be migrated
+    into `AudioCache`.
+    """
     binary_format = True
 
+    def __init__(self, name: str):
+        super().__init__(name, FileBackend(path.join(CACHE_DIR, name), self.extension))
+
     def load(self, file: IO[Any]):
+        import soundfile as sf
         logging.debug(f"{self.name.upper()}: decompressing {file.name}")
+        # a decompressor only handles a single stream, it can't be shared between files
+        decompressor = BZ2Decompressor()
         buffer = io.BytesIO()
         buffer.name = "audio.wav"
         file.seek(0, os.SEEK_END)
         size = file.tell()
         file.seek(0)
-        progress_bar = tqdm(total=size, unit='B', unit_scale=True, desc='Decompressing')
+        progress_bar = metrics.progress("decompress", size)
         while True:
                 chunk = file.read(262144)
                 if not chunk:
                     progress_bar.close()
                     break
                 progress_bar.update(len(chunk))
-                buffer.write(self.decompressor.decompress(chunk))
+                buffer.write(decompressor.decompress(chunk))
         logging.debug(f"{self.name.upper()}: converting {file.name}")
         buffer.seek(0)
         y, sr = sf.read(buffer)
         return (sr, np.transpose(y))
     
     def dump(self, data, file):
+        from madmom.io.audio import write_wave_file, Signal
+        compressor = BZ2Compressor()
         uncompressed = io.BytesIO()
         uncompressed.name = "audio.wav"
         logging.debug(f"{self.name.upper()}: converting {file.name}")
-        write_wave_file(Signal(data=np.transpose(data[1]), sample_rate=48000), uncompressed, 48000)
+        write_wave_file(Signal(data=np.transpose(data[1]), sample_rate=data[0]), uncompressed, data[0])
+        uncompressed.seek(0)
         logging.debug(f"{self.name.upper()}: compressing {file.name}")
         size = len(uncompressed.getvalue())
-        progress_bar = tqdm(total=size, unit='B', unit_scale=True, desc='Compressing')
+        progress_bar = metrics.progress("compress", size)
         while True:
             chunk = uncompressed.read(262144)
             if not chunk:
                 progress_bar.close()
                 break
             progress_bar.update(len(chunk))
-            file.write(self.compressor.compress(chunk))
\ No newline at end of file
+            file.write(compressor.compress(chunk))
+        file.write(compressor.flush())
+
+
+PCM_MAGIC = b"OMXRPCM\0"
+PCM_VERSION = 1
+# magic, version, dtype, channels, sample rate, frames, int16 scale, md5 of the samples
+PCM_HEADER = struct.Struct("<8sHHIIQf16s")
+PCM_HEADER_SIZE = 64
+PCM_DTYPES: dict[int, np.dtype] = {1: np.dtype("<f4"), 2: np.dtype("<i2")}
+
+
+@dataclass
+class PCMHeader:
+    dtype: np.dtype
+    channels: int
+    sample_rate: int
+    frames: int
+    scale: float
+    digest: str
+
+    @classmethod
+    def read(cls, file: IO[bytes]):
+        raw = file.read(PCM_HEADER_SIZE)
+        if len(raw) < PCM_HEADER_SIZE:
+            raise ValueError("truncated audio cache header")
+        magic, version, dtype, channels, sample_rate, frames, scale, digest = PCM_HEADER.unpack_from(raw)
+        if magic != PCM_MAGIC or version != PCM_VERSION or dtype not in PCM_DTYPES:
+            raise ValueError("not an audio cache file")
+        return cls(PCM_DTYPES[dtype], channels, sample_rate, frames, scale, digest.hex())
+
+    def write(self, file: IO[bytes]):
+        dtype = next(code for code, value in PCM_DTYPES.items() if value == self.dtype)
+        raw = PCM_HEADER.pack(PCM_MAGIC, PCM_VERSION, dtype, self.channels, self.sample_rate,
+                              self.frames, self.scale, bytes.fromhex(self.digest))
+        file.write(raw.ljust(PCM_HEADER_SIZE, b"\0"))
+
+
+class AudioCache(Cache):
+    """Raw channel-first PCM behind a small header, opened with `np.memmap`.
+
+    float32 files are returned as a read-only memmap without copying, int16
+    files take half the disk space but are scaled back to float32 on load.
+    `get_pcm` maps either without converting, samples in the stored dtype.
+    Every file has a `WaveformPyramid` of its peaks beside it, written with
+    it and evicted with it.
+    """
+    binary_format = True
+    extension = "pcm"
+    waveform_extension = "peaks"
+    dtype: np.dtype
+    # total size of the cache directory, least recently used files go first
+    max_bytes: int | None
+
+    def __init__(self, name: str, dtype: npt.DTypeLike = np.float32, max_bytes: int | None = None):
+        super().__init__(name, FileBackend(path.join(CACHE_DIR, name), self.extension, sidecars=(self.waveform_extension,)))
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        if self.dtype not in PCM_DTYPES.values():
+            raise Exception(f"unsupported audio cache dtype {dtype}")
+        self.max_bytes = max_bytes
+        self.legacy = BZ2AudioCache(name)
+
+    def get(self, key, stale: bool = False) -> tuple[int, npt.NDArray] | None:
+        if (pcm := self.get_pcm(key)) is None:
+            return None
+        header, samples = pcm
+        return (header.sample_rate, self.to_float(header, samples))
+
+    def get_pcm(self, key) -> tuple[PCMHeader, np.memmap] | None:
+        """The header and a read-only (channels, frames) memmap of the samples as stored"""
+        cache_filename = self.get_cache_filename(key)
+        if not path.exists(cache_filename):
+            legacy_filename = self.legacy.get_cache_filename(key)
+            if not path.exists(legacy_filename) or not self.migrate_file(legacy_filename):
+                self.misses += 1
+                metrics.cache_lookup(self.name, False)
+                return None
+        logging.debug(f"{self.name.upper()}: mapping {cache_filename}")
+        with open(cache_filename, "rb") as file:
+            try:
+                data = self.load_pcm(file)
+            except ValueError as e:
+                logging.warning(f"{self.name.upper()}: unreadable {cache_filename}: {e}")
+                self.misses += 1
+                metrics.cache_lookup(self.name, False)
+                return None
+        # the modification time doubles as last use for eviction
+        os.utime(cache_filename)
+        self.hits += 1
+        metrics.cache_lookup(self.name, True)
+        return data
+
+    def set(self, key, data):
+        # written straight to the file, going through `encode` would hold a second copy of the track
+        cache_filename = self.get_cache_filename(key)
+        with metrics.span("cache_write", cache=self.name):
+            self._write(cache_filename, data)
+        metrics.add_bytes("cache_write", data[1].nbytes, cache=self.name)
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes, keep=cache_filename)
+
+    def evict(self, max_bytes: int, keep: str | None = None) -> list[str]:
+        """Remove least recently used files until the cache fits in `max_bytes`"""
+        cache_dir = path.join(CACHE_DIR, self.name)
+        if not path.isdir(cache_dir):
+            return []
+        sidecars = {entry.name: entry.stat().st_size for entry in os.scandir(cache_dir) if entry.name.endswith(f".{self.waveform_extension}")}
+        files = sorted((entry.stat().st_mtime, entry.stat().st_size + sidecars.get(path.basename(self.waveform_filename(entry.path)), 0), entry.path)
+                       for entry in os.scandir(cache_dir) if entry.name.endswith(f".{self.extension}"))
+        total = sum(size for _, size, _ in files)
+        removed = []
+        for _, size, filename in files:
+            if total <= max_bytes:
+                break
+            if keep and path.basename(filename) == path.basename(keep):
+                continue
+            # readers that already mapped the file keep their pages
+            os.remove(filename)
+            if path.exists(waveform_filename := self.waveform_filename(filename)):
+                os.remove(waveform_filename)
+            total -= size
+            removed.append(filename)
+        if removed:
+            logging.info(f"{self.name.upper()}: evicted {len(removed)} files")
+        return removed
+
+    def _write(self, cache_filename: str, data):
+        self.check_cache_exists()
+        logging.debug(f"{self.name.upper()}: saving {cache_filename}")
+        tmp_filename = unique_tmp_filename(cache_filename)
+        with open(tmp_filename, "wb") as file:
+            self.dump(data, file)
+        os.replace(tmp_filename, cache_filename)
+        self._write_waveform(cache_filename)
+
+    @classmethod
+    def waveform_filename(cls, cache_filename: str) -> str:
+        return f"{path.splitext(cache_filename)[0]}.{cls.waveform_extension}"
+
+    def _write_waveform(self, cache_filename: str) -> WaveformPyramid:
+        # read back through the page cache the file was just written to
+        with open(cache_filename, "rb") as file:
+            header, samples = self.load_pcm(file)
+        with metrics.span("waveform", cache=self.name):
+            pyramid = WaveformPyramid.build(samples, header.sample_rate, header.scale if header.dtype == np.int16 else 1.0)
+        pyramid.write(self.waveform_filename(cache_filename))
+        return pyramid
+
+    def waveform(self, key) -> WaveformPyramid | None:
+        """Peak overview of a cached track without mapping its samples, built now for files cached before overviews"""
+        cache_filename = self.get_cache_filename(key)
+        waveform_filename = self.waveform_filename(cache_filename)
+        if path.exists(waveform_filename):
+            try:
+                return WaveformPyramid.read(waveform_filename)
+            except ValueError as e:
+                logging.warning(f"{self.name.upper()}: rebuilding unreadable {waveform_filename}: {e}")
+        if not path.exists(cache_filename):
+            return None
+        return self._write_waveform(cache_filename)
+
+    def header(self, key, migrate: bool = False) -> PCMHeader | None:
+        """`migrate` converts a legacy BZ2 file first, which only gets a header that way"""
+        cache_filename = self.get_cache_filename(key)
+        if not path.exists(cache_filename):
+            legacy_filename = self.legacy.get_cache_filename(key)
+            if not migrate or not path.exists(legacy_filename) or not self.migrate_file(legacy_filename):
+                return None
+        with open(cache_filename, "rb") as file:
+            return PCMHeader.read(file)
+
+    def load(self, file: IO[Any]):
+        header, samples = self.load_pcm(file)
+        return (header.sample_rate, self.to_float(header, samples))
+
+    def load_pcm(self, file: IO[Any]) -> tuple[PCMHeader, np.memmap]:
+        header = PCMHeader.read(file)
+        samples = np.memmap(file, dtype=header.dtype, mode="r", offset=PCM_HEADER_SIZE,
+                            shape=(header.channels, header.frames))
+        return (header, samples)
+
+    @staticmethod
+    def to_float(header: PCMHeader, samples: npt.NDArray) -> npt.NDArray[np.float32]:
+        if header.dtype == np.int16:
+            return np.multiply(samples, header.scale, dtype=np.float32)
+        return samples
+
+    def dump(self, data, file):
+        sample_rate, audio = data
+        audio = np.atleast_2d(audio)
+        scale = 1.0
+        if self.dtype == np.int16:
+            scale = max(float(np.max(np.abs(audio), initial=0.0)), 1.0) / 32767
+            samples = np.ascontiguousarray(np.round(audio / scale), dtype=self.dtype)
+        else:
+            samples = np.ascontiguousarray(audio, dtype=self.dtype)
+        raw = memoryview(samples).cast("B")
+        header = PCMHeader(self.dtype, samples.shape[0], int(sample_rate), samples.shape[1],
+                           scale, hashlib.md5(raw).hexdigest())
+        header.write(file)
+        file.write(raw)
+
+    def migrate_file(self, legacy_filename: str) -> bool:
+        """Re-encode one BZ2 WAV file; broken legacy files are removed so the track gets downloaded again"""
+        cache_filename = path.splitext(legacy_filename)[0] + f".{self.extension}"
+        logging.info(f"{self.name.upper()}: migrating {legacy_filename}")
+        try:
+            with open(legacy_filename, "rb") as file:
+                data = self.legacy.load(file)
+        except Exception as e:
+            # files written with the old shared compressor were never flushed
+            # and all but the first one are missing the bz2 stream header
+            logging.warning(f"{self.name.upper()}: dropping unreadable {legacy_filename}: {e}")
+            os.remove(legacy_filename)
+            return False
+        self._write(cache_filename, data)
+        os.remove(legacy_filename)
+        return True
+
+    def migrate(self) -> int:
+        """Convert every legacy file of this cache, returns how many were migrated"""
+        cache_dir = path.join(CACHE_DIR, self.name)
+        migrated = 0
+        if not path.isdir(cache_dir):
+            return 0
+        for filename in sorted(os.listdir(cache_dir)):
+            if filename.endswith(f".{self.legacy.extension}"):
+                migrated += self.migrate_file(path.join(cache_dir, filename))
+        return migrated
+
+
+# AudioCache budget used by Song, override with OPENMXR_AUDIO_CACHE_BYTES
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("OPENMXR_AUDIO_CACHE_BYTES", 20 * 1024 ** 3))
+# sample format Song caches audio in, float32 or int16 for half the disk and memory
+AUDIO_CACHE_DTYPE = os.environ.get("OPENMXR_AUDIO_DTYPE", "float32")
+
+
+def cache_usage() -> list[tuple[str, int, int, int]]:
+    """(cache, entries, bytes, expired entries) for every cache in the store and every cache directory"""
+    usage = []
+    if path.exists(SQLiteBackend("").filename):
+        for name in sorted(SQLiteBackend("").cache_names()):
+            backend = SQLiteBackend(name)
+            usage.append((name, *backend.usage(), backend.expired()))
+    if path.isdir(CACHE_DIR):
+        for name in sorted(os.listdir(CACHE_DIR)):
+            if path.isdir(directory := path.join(CACHE_DIR, name)):
+                files = [entry for entry in os.scandir(directory) if entry.is_file()]
+                if files:
+                    # waveform overviews are part of their audio file's entry
+                    entries = sum(not entry.name.endswith(f".{AudioCache.waveform_extension}") for entry in files)
+                    usage.append((f"{name}/", entries, sum(entry.stat().st_size for entry in files), 0))
+    return usage
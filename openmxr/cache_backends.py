@@ -0,0 +1,212 @@
+from abc import ABC, abstractmethod
+from os import makedirs, path
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable
+
+from openmxr.utils.files import unique_tmp_filename
+from openmxr.utils.hash import mkmd5
+
+CACHE_DIR = "./.cache/"
+CACHE_DB = path.join(CACHE_DIR, "cache.sqlite")
+
+
+class CacheBackend(ABC):
+    """Stores encoded cache entries, `Cache` takes care of (de)serializing them"""
+
+    @abstractmethod
+    def get(self, key: str, include_expired: bool = False) -> bytes | None:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, expires: float | None = None):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def keys(self) -> list[str]:
+        ...
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, bytes]:
+        return {key: value for key in keys if (value := self.get(key)) is not None}
+
+    def set_many(self, items: dict[str, bytes], expires: dict[str, float | None] | None = None):
+        for key, value in items.items():
+            self.set(key, value, (expires or {}).get(key))
+
+    def delete_expired(self) -> int:
+        return 0
+
+    @abstractmethod
+    def usage(self) -> tuple[int, int]:
+        """number of entries and their total size in bytes"""
+        ...
+
+
+class FileBackend(CacheBackend):
+    """One `<md5(key)>.<extension>` file per entry, the original cache layout.
+
+    Keys can't be recovered from the filenames, so `keys()` lists the hashes.
+    Expiry times aren't stored. Files with the same name and one of the
+    `sidecars` extensions belong to the entry, they're deleted and counted
+    with it.
+    """
+    directory: str
+    extension: str
+    sidecars: tuple[str, ...]
+
+    def __init__(self, directory: str, extension: str = "cache", sidecars: tuple[str, ...] = ()):
+        self.directory = directory
+        self.extension = extension
+        self.sidecars = sidecars
+
+    def filename(self, key: str) -> str:
+        return path.join(self.directory, f"{mkmd5(key)}.{self.extension}")
+
+    def get(self, key: str, include_expired: bool = False) -> bytes | None:
+        filename = self.filename(key)
+        if not path.exists(filename):
+            return None
+        with open(filename, "rb") as file:
+            return file.read()
+
+    def set(self, key: str, value: bytes, expires: float | None = None):
+        makedirs(self.directory, exist_ok=True)
+        filename = self.filename(key)
+        # write next to the target and swap it in, so readers never see half a file
+        tmp_filename = unique_tmp_filename(filename)
+        with open(tmp_filename, "wb") as file:
+            file.write(value)
+        os.replace(tmp_filename, filename)
+
+    def delete(self, key: str):
+        filename = self.filename(key)
+        for name in [filename, *(f"{path.splitext(filename)[0]}.{sidecar}" for sidecar in self.sidecars)]:
+            if path.exists(name):
+                os.remove(name)
+
+    def keys(self) -> list[str]:
+        if not path.isdir(self.directory):
+            return []
+        return [path.splitext(filename)[0] for filename in os.listdir(self.directory) if filename.endswith(f".{self.extension}")]
+
+    def usage(self) -> tuple[int, int]:
+        if not path.isdir(self.directory):
+            return 0, 0
+        entries, size = 0, 0
+        for entry in os.scandir(self.directory):
+            extension = path.splitext(entry.name)[1][1:]
+            if extension == self.extension:
+                entries += 1
+            if extension == self.extension or extension in self.sidecars:
+                size += entry.stat().st_size
+        return entries, size
+
+
+class SQLiteBackend(CacheBackend):
+    """All caches share one SQLite database in WAL mode, one row per entry.
+
+    Every thread of every process opens its own connection, so worker
+    processes can read while another one writes.
+    """
+    cache_name: str
+    filename: str
+
+    def __init__(self, cache_name: str, filename: str = CACHE_DB):
+        self.cache_name = cache_name
+        self.filename = filename
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            makedirs(path.dirname(self.filename) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " cache TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " expires REAL,"
+                " PRIMARY KEY (cache, key))"
+            )
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(entries)")]
+            if "expires" not in columns:
+                # databases created before entries could expire
+                connection.execute("ALTER TABLE entries ADD COLUMN expires REAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str, include_expired: bool = False) -> bytes | None:
+        row = self._connection().execute(
+            "SELECT value FROM entries WHERE cache = ? AND key = ? AND (? OR expires IS NULL OR expires > ?)",
+            (self.cache_name, key, include_expired, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, bytes]:
+        keys = list(dict.fromkeys(keys))
+        found: dict[str, bytes] = {}
+        # stay well below sqlite's limit on bound parameters
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = self._connection().execute(
+                f"SELECT key, value FROM entries WHERE cache = ? AND (expires IS NULL OR expires > ?) AND key IN ({','.join('?' * len(batch))})",
+                (self.cache_name, time.time(), *batch),
+            )
+            found.update(rows)
+        return found
+
+    def set(self, key: str, value: bytes, expires: float | None = None):
+        self.set_many({key: value}, {key: expires})
+
+    def set_many(self, items: dict[str, bytes], expires: dict[str, float | None] | None = None):
+        expires = expires or {}
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO entries (cache, key, value, size, created, expires) VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.cache_name, key, value, len(value), now, expires.get(key)) for key, value in items.items()],
+            )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM entries WHERE cache = ? AND key = ?", (self.cache_name, key))
+
+    def delete_expired(self) -> int:
+        return self._connection().execute(
+            "DELETE FROM entries WHERE cache = ? AND expires <= ?", (self.cache_name, time.time())
+        ).rowcount
+
+    def expired(self) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM entries WHERE cache = ? AND expires <= ?", (self.cache_name, time.time())
+        ).fetchone()[0]
+
+    def keys(self) -> list[str]:
+        return [row[0] for row in self._connection().execute("SELECT key FROM entries WHERE cache = ?", (self.cache_name,))]
+
+    def cache_names(self) -> list[str]:
+        """every cache stored in this database, not only this backend's"""
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT cache FROM entries")]
+
+    def usage(self) -> tuple[int, int]:
+        count, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE cache = ?", (self.cache_name,)
+        ).fetchone()
+        return count, size
@@ -0,0 +1,81 @@
+import threading
+from typing import Any, Callable
+
+
+def _make_sp_client():
+    from spotdl import Spotdl
+    from spotdl.utils.config import DEFAULT_CONFIG
+    return Spotdl(
+        client_id=DEFAULT_CONFIG["client_id"],
+        client_secret=DEFAULT_CONFIG["client_secret"],
+        user_auth=DEFAULT_CONFIG["user_auth"],
+        cache_path=DEFAULT_CONFIG["cache_path"],
+        no_cache=True,
+        headless=True,
+    )
+
+
+def _make_yt_client():
+    from spotdl.download.downloader import Downloader
+    return Downloader(settings={"simple_tui": True})
+
+
+def _make_dl_client():
+    from yt_dlp import YoutubeDL
+    return YoutubeDL({'format': 'bestaudio/best'})
+
+
+def _make_spotify_api():
+    from spotdl.utils.spotify import SpotifyClient
+    # SpotifyClient is a singleton that Spotdl initializes with the credentials
+    get_client("sp_client")
+    return SpotifyClient()
+
+
+_factories: dict[str, Callable[[], Any]] = {
+    "sp_client": _make_sp_client,
+    "yt_client": _make_yt_client,
+    "dl_client": _make_dl_client,
+    "spotify_api": _make_spotify_api,
+}
+_clients: dict[str, Any] = {}
+_lock = threading.RLock()
+
+
+def get_client(name: str) -> Any:
+    """Build the named client the first time it's asked for"""
+    if name in _clients:
+        return _clients[name]
+    with _lock:
+        if name not in _clients:
+            if name not in _factories:
+                raise Exception(f"unknown client {name}")
+            _clients[name] = _factories[name]()
+        return _clients[name]
+
+
+def set_client(name: str, client: Any):
+    """Swap in another client, e.g. a test double, instead of building the real one"""
+    with _lock:
+        _clients[name] = client
+
+
+def reset_clients():
+    with _lock:
+        _clients.clear()
+
+
+def get_sp_client():
+    return get_client("sp_client")
+
+
+def get_yt_client():
+    return get_client("yt_client")
+
+
+def get_dl_client():
+    return get_client("dl_client")
+
+
+def get_spotify_api():
+    return get_client("spotify_api")
@@ -1,19 +1,143 @@
 import subprocess as sp
+import threading
+import time
+from typing import Iterable, Iterator
+import numpy as np
+import numpy.typing as npt
+
+from openmxr import metrics
+
+# bytes read from ffmpeg per pipe read when decoding
+READ_SIZE = 1 << 20
+
 
 def convert_opus_to_wav(input_data):
     ffmpeg = 'ffmpeg'
-    
+
     # Define the ffmpeg command
     cmd = [ffmpeg,
            '-i', 'pipe:',
            '-f', 'wav',
            'pipe:']
-    
+
     # Create a subprocess and communicate with input from input_data
     proc = sp.Popen(cmd, stdout=sp.PIPE, stdin=sp.PIPE)
     out = proc.communicate(input=input_data)[0]
-    
+
     # Wait for the subprocess to finish
     proc.wait()
-    
-    return out
\ No newline at end of file
+
+    return out
+
+
+class _Decoder:
+    """ffmpeg turning any input into raw interleaved float32 on stdout.
+
+    Input is fed from a thread so stdout can be drained at the same time,
+    `input_data` may be a bytes-like object or an iterable of chunks that are
+    still being downloaded.
+    """
+    def __init__(self, input_data: bytes | bytearray | memoryview | Iterable[bytes | bytearray | memoryview], sample_rate: int, channels: int):
+        self.channels = channels
+        cmd = ['ffmpeg',
+               '-hide_banner', '-loglevel', 'error',
+               '-i', 'pipe:0',
+               '-f', 'f32le', '-acodec', 'pcm_f32le',
+               '-ac', str(channels),
+               '-ar', str(sample_rate),
+               'pipe:1']
+        self.proc = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+        self.stderr = b""
+        self.input_error: BaseException | None = None
+        # seconds spent waiting for input (the network, when streaming a download) and bytes fed to ffmpeg
+        self.input_wait = 0.0
+        self.input_bytes = 0
+        self._track = metrics.current_track()
+        self._began = time.perf_counter()
+        if isinstance(input_data, (bytes, bytearray, memoryview)):
+            input_data = [input_data]
+        self.feeder = threading.Thread(target=self._feed, args=(input_data,), daemon=True)
+        self.feeder.start()
+        self.stderr_reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self.stderr_reader.start()
+
+    def _feed(self, chunks):
+        try:
+            chunks = iter(chunks)
+            while True:
+                waited = time.perf_counter()
+                chunk = next(chunks, None)
+                self.input_wait += time.perf_counter() - waited
+                if chunk is None:
+                    break
+                self.input_bytes += len(chunk)
+                self.proc.stdin.write(chunk) # type: ignore
+        except BrokenPipeError:
+            # ffmpeg gave up, the reason ends up on stderr
+            pass
+        except BaseException as e:
+            self.input_error = e
+        finally:
+            try:
+                self.proc.stdin.close() # type: ignore
+            except BrokenPipeError:
+                pass
+
+    def _read_stderr(self):
+        self.stderr = self.proc.stderr.read() # type: ignore
+
+    def read(self, size: int = READ_SIZE) -> bytes:
+        return self.proc.stdout.read(size) # type: ignore
+
+    def close(self, check: bool = True):
+        self.proc.stdout.close() # type: ignore
+        returncode = self.proc.wait()
+        self.feeder.join()
+        self.stderr_reader.join()
+        metrics.add_time("decode", time.perf_counter() - self._began, track=self._track)
+        metrics.add_time("decode_input_wait", self.input_wait, track=self._track)
+        metrics.add_bytes("decode_input", self.input_bytes, track=self._track)
+        if not check:
+            return
+        if self.input_error:
+            raise self.input_error
+        if returncode != 0:
+            raise Exception(f"ffmpeg failed: {self.stderr.decode(errors='replace').strip()}")
+
+
+def decode_audio(input_data, sample_rate: int = 48000, channels: int = 2) -> npt.NDArray[np.float32]:
+    """Decode to a C-contiguous (channels, frames) float32 array at the given rate"""
+    decoder = _Decoder(input_data, sample_rate, channels)
+    buffer = bytearray()
+    try:
+        while chunk := decoder.read():
+            buffer += chunk
+    finally:
+        decoder.close()
+    frame_size = 4 * channels
+    interleaved = np.frombuffer(buffer, dtype="<f4", count=len(buffer) // frame_size * channels)
+    return np.ascontiguousarray(interleaved.reshape(-1, channels).T)
+
+
+def decode_audio_blocks(input_data, sample_rate: int = 48000, channels: int = 2, block_frames: int = 65536) -> Iterator[npt.NDArray[np.float32]]:
+    """Decode incrementally, yielding (channels, block_frames) float32 blocks as ffmpeg produces them.
+
+    The last block may be shorter.
+    """
+    decoder = _Decoder(input_data, sample_rate, channels)
+    block_bytes = block_frames * channels * 4
+    pending = bytearray()
+    finished = False
+    try:
+        while chunk := decoder.read(block_bytes):
+            pending += chunk
+            while len(pending) >= block_bytes:
+                yield np.frombuffer(pending[:block_bytes], dtype="<f4").reshape(-1, channels).T.copy()
+                del pending[:block_bytes]
+        usable = len(pending) // (channels * 4) * channels * 4
+        if usable:
+            yield np.frombuffer(pending[:usable], dtype="<f4").reshape(-1, channels).T.copy()
+        finished = True
+    finally:
+        # a consumer that stops early closes ffmpeg's stdout, that exit status means nothing
+        decoder.close(check=finished)
@@ -1,74 +1,332 @@
+import asyncio
 import concurrent.futures
+import json
 import logging
-from click import progressbar
+import os
+from os import makedirs, path
+import random
+import threading
+import time
+from typing import Iterator
 import requests
-import io
-from tqdm.notebook import tqdm
+
+from openmxr import metrics
+from openmxr.downloader.session import get_session
+from openmxr.executors import connection_budget, run_blocking
+from openmxr.utils.files import unique_tmp_filename
+from openmxr.utils.hash import mkmd5
+
+PARTIAL_DIR = "./.cache/partial/"
+
+
+def prune_partial_downloads(max_age: float) -> int:
+    """Remove interrupted downloads that haven't been touched for `max_age` seconds"""
+    if not path.isdir(PARTIAL_DIR):
+        return 0
+    removed = 0
+    for entry in os.scandir(PARTIAL_DIR):
+        if entry.is_file() and time.time() - entry.stat().st_mtime > max_age:
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+
+class RangeIgnored(Exception):
+    """The server answered a range request with the whole file"""
+
 
 class DownloadTask:
-    progress_bar: tqdm
+    progress_bar: metrics.Progress
     url: str
     chunk_size:int
-    
+    min_chunk_size: int = 256 * 1024
+    max_chunk_size: int = 16 * 1024 * 1024
+    # adaptive chunks are sized so one request takes about this long
+    target_request_seconds: float = 2.0
+    max_workers: int
+    retries: int
+    backoff: float
+    timeout: float = 30
+    resume_key: str | None
+    size: int
+    buffer: bytearray
+
     def get_size(self, url):
-        response = requests.head(url)
+        with metrics.span("download_head", track=self._track):
+            return self._get_size(url)
+
+    def _get_size(self, url):
+        response = get_session().head(url, allow_redirects=True, timeout=self.timeout)
         size = int(response.headers['Content-Length'])
         logging.debug(f"HEAD REQUEST!! headers returned: {response.headers}")
         if size == 0:
             logging.warning(f"Head request body size returned 0, trying with body")
-            response = requests.get(url, stream=True)
-            logging.debug(f"HEAD REQUEST!! headers returned: {response.headers}")
-            size = int(response.headers['Content-Length'])
+            with get_session().get(url, stream=True, timeout=self.timeout) as response:
+                logging.debug(f"HEAD REQUEST!! headers returned: {response.headers}")
+                size = int(response.headers['Content-Length'])
         return size
 
-    def download_range(self, url, start, end, id):
-        headers = {'Range': f'bytes={start}-{end}'}
-        response = requests.get(url, headers=headers, stream=True)
-        logging.debug(f"range download headers returned: {response.headers}")
-        output = io.BytesIO()
-        for part in response.iter_content(1024):
-            output.write(part)
-            self.progress_bar.update(len(part))
-        return output
-
-    def run_async_functions_asyncio(self, url):
-        file_size = self.get_size(url)
-        self.progress_bar = tqdm(total=file_size, unit='B', unit_scale=True)
-        chunks = range(0, file_size, self.chunk_size)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=12) as executor:
-            futures = {executor.submit(self.download_range, url, start, start + self.chunk_size - 1, i): (self.download_range, (url, start, start + self.chunk_size - 1, i)) for i, start in enumerate(chunks)}
-            concurrent.futures.wait(futures.keys())
-            self.progress_bar.close()
-
-            results = []
-            intermediate = []
-            for future in concurrent.futures.as_completed(futures):
-                _, args = futures[future]
-                result = future.result()
-                intermediate.append((args[3], result))
-        results = [a[1] for a in list(sorted(intermediate, key=lambda x:x[0]))]
-        return results
-
-    def __init__(self, url:str, chunk_size:int=1000000):
+    def download_range(self, url, start, end):
+        """Fetch one range into the buffer, retrying from the last received byte"""
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                offset = start + self._ranges[start][1]
+            received = 0
+            began = time.monotonic()
+            try:
+                headers = {'Range': f'bytes={offset}-{end}'}
+                with get_session().get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    logging.debug(f"range download headers returned: {response.headers}")
+                    response.raise_for_status()
+                    if response.status_code != 206 and offset > 0:
+                        raise RangeIgnored(f"server ignored range request for bytes {offset}-{end}")
+                    for part in response.iter_content(65536):
+                        if self._cancelled:
+                            return
+                        size = min(len(part), end + 1 - offset)
+                        self._view[offset:offset + size] = part[:size]
+                        offset += size
+                        received += size
+                        self.progress_bar.update(size)
+                        with self._lock:
+                            self._ranges[start][1] = offset - start
+                            self._lock.notify_all()
+                        if offset > end:
+                            break
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else 0
+                # an expired or forbidden url won't get better by asking again
+                if status < 500 and status != 429:
+                    raise
+                logging.warning(f"range {start}-{end} failed with {status} (attempt {attempt + 1})")
+            except (requests.RequestException, RangeIgnored) as e:
+                # a CDN node without range support is usually gone by the next attempt
+                logging.warning(f"range {start}-{end} failed: {e} (attempt {attempt + 1})")
+            finally:
+                metrics.add_bytes("download", received, track=self._track)
+            if offset > end:
+                self._range_finished(start, end, received, time.monotonic() - began)
+                return
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        raise Exception(f"range {start}-{end} failed after {self.retries + 1} attempts")
+
+    def _claim_range(self) -> tuple[int, int] | None:
+        with self._lock:
+            if not self._pending:
+                return None
+            start, gap_end = self._pending[0]
+            end = min(start + self.chunk_size - 1, gap_end)
+            if end == gap_end:
+                self._pending.pop(0)
+            else:
+                self._pending[0] = (end + 1, gap_end)
+            self._ranges[start] = [end, 0]
+            return start, end
+
+    def _range_finished(self, start, end, received, elapsed):
+        with self._lock:
+            if received and elapsed > 0:
+                throughput = received / elapsed
+                wanted = int(throughput * self.target_request_seconds)
+                # smooth it out, a single slow or fast request shouldn't swing the chunk size
+                self.chunk_size = min(self.max_chunk_size, max(self.min_chunk_size, (self.chunk_size + wanted) // 2))
+            if self._partial_fd is not None:
+                os.pwrite(self._partial_fd, self._view[start:end + 1], start)
+                self._completed.append((start, end))
+                self._save_partial_state()
+            self._lock.notify_all()
+
+    def _worker(self, url):
+        while not self._cancelled and (claimed := self._claim_range()):
+            self.download_range(url, *claimed)
+
+    def _partial_filenames(self):
+        base = path.join(PARTIAL_DIR, mkmd5(self.resume_key)) # type: ignore
+        return f"{base}.part", f"{base}.json"
+
+    def _load_partial_state(self):
+        """Open the on-disk copy of this download and pick up the ranges it already has"""
+        self._completed = []
+        self._partial_fd = None
+        if not self.resume_key:
+            return
+        makedirs(PARTIAL_DIR, exist_ok=True)
+        data_filename, state_filename = self._partial_filenames()
+        if path.exists(state_filename) and path.exists(data_filename):
+            try:
+                with open(state_filename) as file:
+                    state = json.load(file)
+                if state["size"] == self.size:
+                    self._completed = [(start, end) for start, end in state["done"]]
+            except (ValueError, KeyError) as e:
+                logging.warning(f"ignoring broken partial download state {state_filename}: {e}")
+        if not self._completed and path.exists(data_filename):
+            os.remove(data_filename)
+        self._partial_fd = os.open(data_filename, os.O_RDWR | os.O_CREAT)
+        os.ftruncate(self._partial_fd, self.size)
+        for start, end in self._completed:
+            os.preadv(self._partial_fd, [self._view[start:end + 1]], start)
+            self._ranges[start] = [end, end + 1 - start]
+        if self._completed:
+            logging.info(f"resuming download with {sum(end + 1 - start for start, end in self._completed)} of {self.size} bytes")
+
+    def _save_partial_state(self):
+        _, state_filename = self._partial_filenames()
+        # another task may be resuming the same download
+        tmp_filename = unique_tmp_filename(state_filename)
+        with open(tmp_filename, "w") as file:
+            json.dump({"size": self.size, "done": self._completed}, file)
+        os.replace(tmp_filename, state_filename)
+
+    def _close_partial_state(self, finished: bool):
+        if self._partial_fd is None:
+            return
+        os.close(self._partial_fd)
+        self._partial_fd = None
+        if finished:
+            for filename in self._partial_filenames():
+                if path.exists(filename):
+                    os.remove(filename)
+
+    def _prepare(self, url):
+        self.size = self.get_size(url)
+        # the whole file lives in one buffer, every range is written straight into its slice
+        self.buffer = bytearray(self.size)
+        self._view = memoryview(self.buffer)
+        self._lock = threading.Condition()
+        self._cancelled = False
+        # start -> [end, bytes received], for claimed and already completed ranges
+        self._ranges: dict[int, list[int]] = {}
+        self._load_partial_state()
+        self._pending = []
+        position = 0
+        for start, end in sorted(self._completed):
+            if start > position:
+                self._pending.append((position, start - 1))
+            position = end + 1
+        if position < self.size:
+            self._pending.append((position, self.size - 1))
+        self._frontier = 0
+        self.progress_bar = metrics.progress("download", self.size, self.size - sum(end + 1 - start for start, end in self._pending))
+
+    def _run_workers(self, executor: concurrent.futures.ThreadPoolExecutor, url):
+        return [executor.submit(self._worker, url) for _ in range(self.max_workers)]
+
+    def _contiguous(self) -> int:
+        """number of bytes at the start of the buffer that are already downloaded"""
+        position = self._frontier
+        while position in self._ranges:
+            end, filled = self._ranges[position]
+            if filled < end + 1 - position:
+                return position + filled
+            position = self._frontier = end + 1
+        return position
+
+    def _finish(self, futures, finished: bool):
+        self._cancelled = True
+        for future in futures:
+            future.cancel()
+        self.progress_bar.close()
+        with self._lock:
+            self._close_partial_state(finished)
+
+    def __init__(self, url:str, chunk_size:int=1000000, max_workers:int=12, retries:int=4, backoff:float=0.5, resume_key:str|None=None):
         self.url = url
-        self.chunk_size = chunk_size        
-    
-    def start(self):        
-        results = self.run_async_functions_asyncio(self.url)
-        buffer = bytes()
-        for result in results:
-            buffer+=result.getvalue()
-        return buffer
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.resume_key = resume_key
+        # the worker threads don't see the caller's context, keep the track it belongs to
+        self._track = metrics.current_track()
+
+    def start(self) -> bytearray:
+        with metrics.span("download", track=self._track):
+            return self._start()
+
+    def _start(self) -> bytearray:
+        self._prepare(self.url)
+        finished = False
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = self._run_workers(executor, self.url)
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+                finished = True
+            finally:
+                self._finish(futures, finished)
+        return self.buffer
+
+    def stream(self) -> Iterator[memoryview]:
+        """Yield the file front to back while later ranges are still downloading.
+
+        The slices point into `self.buffer`, which holds the whole file once the
+        generator is exhausted.
+        """
+        began = time.perf_counter()
+        self._prepare(self.url)
+        sent = 0
+        finished = False
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = self._run_workers(executor, self.url)
+            try:
+                while sent < self.size:
+                    with self._lock:
+                        while (available := self._contiguous()) == sent:
+                            if failed := [future for future in futures if future.done() and future.exception()]:
+                                raise failed[0].exception() # type: ignore
+                            self._lock.wait(0.5)
+                    yield self._view[sent:available]
+                    sent = available
+                finished = True
+            finally:
+                self._finish(futures, finished)
+                # includes time the consumer spent between reads, the decoder's input wait tells them apart
+                metrics.add_time("download", time.perf_counter() - began, track=self._track)
 
     def start_legacy(self):
         file_size = self.get_size(self.url)
-        print("downloading", file_size, "bytes")
-        self.progress_bar = tqdm(total=file_size, unit='B', unit_scale=True)
-        content = bytes()
-        response = requests.get(self.url, stream=True)
+        logging.info(f"downloading {file_size} bytes")
+        self.progress_bar = metrics.progress("download", file_size)
+        content = bytearray(file_size)
+        view = memoryview(content)
+        offset = 0
+        response = get_session().get(self.url, stream=True, timeout=self.timeout)
         logging.debug(f"range download headers returned: {response.headers}")
-        for i in response.iter_content(1024):
-            content += i
+        for i in response.iter_content(65536):
+            view[offset:offset + len(i)] = i
+            offset += len(i)
             self.progress_bar.update(len(i))
         self.progress_bar.close()
-        return content
\ No newline at end of file
+        return content
+
+
+class AsyncDownloadTask(DownloadTask):
+    """`DownloadTask` for asyncio: no thread pool of its own.
+
+    Range requests run on the shared io executor and wait for a slot in the
+    event loop's connection budget, so any number of concurrent downloads
+    never open more than `DOWNLOAD_CONNECTIONS` connections together.
+    """
+
+    async def _aworker(self):
+        while not self._cancelled and (claimed := self._claim_range()):
+            async with connection_budget():
+                await run_blocking("io", self.download_range, self.url, *claimed)
+
+    async def start(self) -> bytearray: # type: ignore[override]
+        began = time.perf_counter()
+        await run_blocking("io", self._prepare, self.url)
+        finished = False
+        workers = [asyncio.ensure_future(self._aworker()) for _ in range(self.max_workers)]
+        try:
+            await asyncio.gather(*workers)
+            finished = True
+        finally:
+            for worker in workers:
+                worker.cancel()
+            # ranges still running in a thread stop at their next read
+            self._finish([], finished)
+            metrics.add_time("download", time.perf_counter() - began, track=self._track)
+        return self.buffer
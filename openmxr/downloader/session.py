@@ -0,0 +1,21 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# enough connections for a few downloads running their range workers side by side
+POOL_SIZE = 32
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Process wide session, keeps connections alive between range requests"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
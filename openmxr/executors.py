@@ -0,0 +1,85 @@
+"""Executors shared by everything running on an event loop.
+
+Blocking work (spotdl, yt-dlp, range requests) goes to one thread pool,
+decoding to one process pool, and the number of HTTP connections open at
+once is capped per event loop, however many tracks are in flight.
+"""
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import contextvars
+import functools
+import multiprocessing
+import os
+import threading
+from typing import Any, Callable, TypeVar
+import weakref
+
+from openmxr import metrics
+from openmxr.downloader.session import POOL_SIZE
+
+# range requests in flight across all downloads, matches the session's connection pool
+DOWNLOAD_CONNECTIONS = POOL_SIZE
+# threads for blocking calls: every download connection plus a few metadata lookups
+IO_WORKERS = DOWNLOAD_CONNECTIONS + 8
+
+T = TypeVar("T")
+
+
+def _make_io_executor():
+    return ThreadPoolExecutor(IO_WORKERS, thread_name_prefix="openmxr-io")
+
+
+def _make_cpu_executor():
+    # spawn, forking a process with running threads can deadlock on their locks
+    return ProcessPoolExecutor(os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
+
+
+_factories: dict[str, Callable[[], Executor]] = {
+    "io": _make_io_executor,
+    "cpu": _make_cpu_executor,
+}
+_executors: dict[str, Executor] = {}
+_lock = threading.Lock()
+_budgets: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+
+
+def get_executor(name: str) -> Executor:
+    """The shared "io" thread pool or "cpu" process pool, built the first time it's asked for"""
+    with _lock:
+        if name not in _executors:
+            if name not in _factories:
+                raise Exception(f"unknown executor {name}")
+            _executors[name] = _factories[name]()
+        return _executors[name]
+
+
+def set_executor(name: str, executor: Executor):
+    with _lock:
+        _executors[name] = executor
+
+
+def shutdown_executors(wait: bool = True):
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+async def run_blocking(name: str, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run `function` on a shared executor without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    if name == "cpu":
+        # worker processes send their metrics back with the result
+        return metrics.replay(await loop.run_in_executor(get_executor(name), metrics.recorded(function, *args, **kwargs)))
+    # threads keep the caller's context, e.g. the track metrics are recorded for
+    call = functools.partial(contextvars.copy_context().run, functools.partial(function, *args, **kwargs))
+    return await loop.run_in_executor(get_executor(name), call)
+
+
+def connection_budget() -> asyncio.Semaphore:
+    """Caps the range requests the running event loop has open at once"""
+    loop = asyncio.get_running_loop()
+    if loop not in _budgets:
+        _budgets[loop] = asyncio.Semaphore(DOWNLOAD_CONNECTIONS)
+    return _budgets[loop]
@@ -0,0 +1,183 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import logging
+import multiprocessing
+import os
+from queue import Queue
+import threading
+import time
+from typing import Any, Callable
+import yaml
+
+from openmxr import metrics
+from openmxr.models.Resolution import Resolution
+from openmxr.song import Song
+
+
+@dataclass
+class PlaylistEntry:
+    spotify_url: str | None = None
+    youtube_url: str | None = None
+    query: str | None = None
+
+    def find(self, load_audio=True) -> Song:
+        song = Song.find(spotify_link=self.spotify_url, youtube_link=self.youtube_url, query=self.query, load_audio=load_audio)
+        if not song:
+            raise Exception("playlist entry has no spotify_url, youtube_url or query")
+        return song
+
+
+def resolve_playlist(entries: list[PlaylistEntry]) -> dict[str, Resolution]:
+    """Run every search the playlist needs at once, entries naming their youtube video need none"""
+    return Song.resolve_many(entry.spotify_url or entry.query for entry in entries if not entry.youtube_url and (entry.spotify_url or entry.query)) # type: ignore
+
+
+def load_playlist(filename: str = "playlist.yaml") -> list[PlaylistEntry]:
+    with open(filename) as file:
+        data = yaml.safe_load(file) or {}
+    return [PlaylistEntry(**(item or {})) for item in data.get("playlist") or []]
+
+
+@dataclass
+class TrackProgress:
+    index: int
+    entry: PlaylistEntry
+    # queued, resolving, downloading, decoding, done or failed
+    stage: str = "queued"
+    song: Song | None = None
+    error: BaseException | None = None
+    # seconds spent in each stage
+    timings: dict[str, float] = field(default_factory=dict)
+    data: bytearray | None = field(default=None, repr=False)
+    _stage_started: float = field(default=0, repr=False)
+
+
+_DONE = object()
+
+
+class _Stage:
+    """A pool of threads moving items from one bounded queue to the next"""
+    def __init__(self, name: str, work: Callable[[Any], Any], inbox: Queue, outbox: Queue | None, workers: int, on_error: Callable[[Any, BaseException], None]):
+        self.name = name
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_error = on_error
+        self._running = workers
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._run, name=f"ingest-{name}-{i}", daemon=True) for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self):
+        while (item := self.inbox.get()) is not _DONE:
+            try:
+                result = self.work(item)
+            except Exception as e:
+                self.on_error(item, e)
+                continue
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+        # let the sibling threads see it too
+        self.inbox.put(_DONE)
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last and self.outbox is not None:
+            self.outbox.put(_DONE)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+
+class PlaylistIngest:
+    """Loads a playlist as a pipeline: metadata and downloads run on threads,
+    decoding into the audio cache runs on a process pool.
+
+    Bounded queues between the stages keep at most `queue_size` downloaded
+    tracks waiting for a decoder. A failing track is reported and skipped,
+    the rest of the batch carries on.
+    """
+    entries: list[PlaylistEntry]
+    io_workers: int
+    cpu_workers: int
+    queue_size: int
+    on_progress: Callable[[TrackProgress], None]
+
+    def __init__(self, entries: list[PlaylistEntry], io_workers: int = 8, cpu_workers: int | None = None, queue_size: int = 4, on_progress: Callable[[TrackProgress], None] | None = None):
+        self.entries = entries
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.on_progress = on_progress or self.log_progress
+
+    @staticmethod
+    def log_progress(track: TrackProgress):
+        if track.stage == "failed":
+            logging.error(f"[{track.index}] failed: {track.error}")
+        else:
+            logging.info(f"[{track.index}] {track.stage} {track.entry}")
+
+    def _report(self, track: TrackProgress, stage: str):
+        now = time.monotonic()
+        if track._stage_started:
+            track.timings[track.stage] = now - track._stage_started
+        track._stage_started = now
+        track.stage = stage
+        self.on_progress(track)
+
+    def _fail(self, track: TrackProgress, error: BaseException):
+        track.error = error
+        track.data = None
+        self._report(track, "failed")
+
+    def _resolve(self, track: TrackProgress):
+        self._report(track, "resolving")
+        track.song = track.entry.find(load_audio=False)
+        if track.song.has_cached_audio:
+            track.song.load_audio()
+            self._report(track, "done")
+            return None
+        return track
+
+    def _download(self, track: TrackProgress):
+        self._report(track, "downloading")
+        track.data = track.song.download_audio_bytes() # type: ignore
+        return track
+
+    def _decode(self, processes: ProcessPoolExecutor, track: TrackProgress):
+        self._report(track, "decoding")
+        data, track.data = track.data, None
+        metrics.replay(processes.submit(metrics.recorded(Song.decode_to_cache, track.song.yt_link, data)).result()) # type: ignore
+        track.song.load_audio() # type: ignore
+        self._report(track, "done")
+
+    def run(self) -> list[TrackProgress]:
+        tracks = [TrackProgress(index, entry) for index, entry in enumerate(self.entries)]
+        resolve_queue: Queue = Queue()
+        download_queue: Queue = Queue(self.queue_size)
+        decode_queue: Queue = Queue(self.queue_size)
+        # forking a process full of running threads can deadlock on their locks
+        with ProcessPoolExecutor(self.cpu_workers, mp_context=multiprocessing.get_context("spawn")) as processes:
+            stages = [
+                _Stage("resolve", self._resolve, resolve_queue, download_queue, self.io_workers, self._fail),
+                _Stage("download", self._download, download_queue, decode_queue, self.io_workers, self._fail),
+                _Stage("decode", lambda track: self._decode(processes, track), decode_queue, None, self.cpu_workers, self._fail),
+            ]
+            for stage in stages:
+                stage.start()
+            for track in tracks:
+                resolve_queue.put(track)
+            resolve_queue.put(_DONE)
+            for stage in stages:
+                stage.join()
+        failed = [track for track in tracks if track.stage == "failed"]
+        logging.info(f"ingested {len(tracks) - len(failed)} of {len(tracks)} tracks")
+        return tracks
+
+
+def ingest_playlist(filename: str = "playlist.yaml", **kwargs) -> list[TrackProgress]:
+    return PlaylistIngest(load_playlist(filename), **kwargs).run()
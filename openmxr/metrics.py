@@ -0,0 +1,304 @@
+"""Timing spans, byte counts and cache hits per stage and track.
+
+Nothing is recorded until a recorder is installed:
+
+    from openmxr import metrics
+    metrics.set_recorder(metrics.MetricsRecorder([metrics.JSONLinesExporter("metrics.jsonl")]))
+    ...
+    print(metrics.prometheus_text())
+
+Progress of long transfers goes through a separate, equally pluggable,
+progress reporter.
+
+Worker processes don't share the recorder, functions sent to one are
+wrapped with `recorded` and their events `replay`ed in the parent.
+"""
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+import functools
+import json
+import logging
+import threading
+import time
+from typing import IO, Any, Callable, Iterator
+
+
+@dataclass
+class Event:
+    # span, bytes or cache
+    kind: str
+    name: str
+    # seconds for spans, a byte count, or 1 for a cache hit and 0 for a miss
+    value: float
+    track: str | None = None
+    labels: dict[str, str] = field(default_factory=dict)
+    time: float = field(default_factory=time.time)
+
+
+class Recorder:
+    """Drops everything, the default"""
+    enabled = False
+
+    def record(self, event: Event):
+        pass
+
+
+class BufferRecorder(Recorder):
+    """Keeps the events in a list, for a worker process to send back"""
+    enabled = True
+
+    def __init__(self):
+        self.events: list[Event] = []
+
+    def record(self, event: Event):
+        self.events.append(event)
+
+
+class Exporter(ABC):
+    @abstractmethod
+    def export(self, event: Event):
+        ...
+
+
+class JSONLinesExporter(Exporter):
+    """Appends every event as one JSON object per line"""
+    def __init__(self, file: str | IO[str]):
+        self.file = open(file, "a", encoding="utf-8") if isinstance(file, str) else file
+        self._lock = threading.Lock()
+
+    def export(self, event: Event):
+        line = json.dumps(asdict(event), ensure_ascii=False)
+        with self._lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+
+class MetricsRecorder(Recorder):
+    """Keeps running totals per metric and per track, and hands every event to the exporters"""
+    enabled = True
+
+    def __init__(self, exporters: list[Exporter] | None = None):
+        self.exporters = exporters or []
+        # (kind, name, sorted labels) -> [count, total]
+        self.totals: dict[tuple, list[float]] = {}
+        # track -> span or byte counter name -> total
+        self.tracks: dict[str, dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, event: Event):
+        key = (event.kind, event.name, tuple(sorted(event.labels.items())))
+        with self._lock:
+            total = self.totals.setdefault(key, [0, 0.0])
+            total[0] += 1
+            total[1] += event.value
+            if event.track is not None and event.kind != "cache":
+                name = event.name if event.kind == "span" else f"{event.name}_bytes"
+                stages = self.tracks.setdefault(event.track, {})
+                stages[name] = stages.get(name, 0) + event.value
+        for exporter in self.exporters:
+            exporter.export(event)
+
+    def track_summary(self, track: str) -> dict[str, float]:
+        """Seconds per span and bytes per counter for one track, to tell what a slow track waited on"""
+        with self._lock:
+            return dict(self.tracks.get(track, {}))
+
+
+_recorder: Recorder = Recorder()
+_track: ContextVar[str | None] = ContextVar("openmxr_track", default=None)
+
+
+def get_recorder() -> Recorder:
+    return _recorder
+
+
+def set_recorder(recorder: Recorder | None):
+    """Install a recorder, None goes back to recording nothing"""
+    global _recorder
+    _recorder = recorder or Recorder()
+
+
+def recorded(function: Callable[..., Any], *args: Any, **kwargs: Any) -> Callable[[], tuple[Any, list[Event]]]:
+    """`function` ready to submit to a process pool, returning its result along with the events it recorded.
+
+    Only recorded when the parent records, under the parent's current
+    track. Events of a call that raises are lost.
+    """
+    return functools.partial(_call_recorded, _recorder.enabled, _track.get(), function, *args, **kwargs)
+
+
+def _call_recorded(enabled: bool, track_name: str | None, function: Callable[..., Any], *args: Any, **kwargs: Any) -> tuple[Any, list[Event]]:
+    global _recorder
+    if not enabled:
+        return function(*args, **kwargs), []
+    previous, recorder = _recorder, BufferRecorder()
+    _recorder = recorder
+    token = _track.set(track_name)
+    try:
+        return function(*args, **kwargs), recorder.events
+    finally:
+        _track.reset(token)
+        _recorder = previous
+
+
+def replay(outcome: tuple[Any, list[Event]]) -> Any:
+    """Record the events a `recorded` call sent back, returns its result"""
+    result, events = outcome
+    if _recorder.enabled:
+        for event in events:
+            _recorder.record(event)
+    return result
+
+
+@contextmanager
+def track(name: str | None) -> Iterator[None]:
+    """Everything recorded inside belongs to this track"""
+    token = _track.set(name)
+    try:
+        yield
+    finally:
+        _track.reset(token)
+
+
+def current_track() -> str | None:
+    return _track.get()
+
+
+@contextmanager
+def span(name: str, track: str | None = None, **labels: str) -> Iterator[None]:
+    """Time the block, recorded even when it raises"""
+    recorder = _recorder
+    if not recorder.enabled:
+        yield
+        return
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.record(Event("span", name, time.perf_counter() - began, track or _track.get(), labels))
+
+
+def add_time(name: str, seconds: float, track: str | None = None, **labels: str):
+    """Record a span measured some other way, e.g. summed up over a loop"""
+    if _recorder.enabled:
+        _recorder.record(Event("span", name, seconds, track or _track.get(), labels))
+
+
+def add_bytes(name: str, count: int, track: str | None = None, **labels: str):
+    if _recorder.enabled:
+        _recorder.record(Event("bytes", name, count, track or _track.get(), labels))
+
+
+def cache_lookup(cache: str, hit: bool, track: str | None = None):
+    if _recorder.enabled:
+        _recorder.record(Event("cache", cache, 1 if hit else 0, track or _track.get()))
+
+
+def _labels(**values) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(values, escaped)) + "}"
+
+
+def prometheus_text(recorder: Recorder | None = None) -> str:
+    """The totals of a `MetricsRecorder` in Prometheus' text exposition format"""
+    recorder = recorder or _recorder
+    if not isinstance(recorder, MetricsRecorder):
+        return ""
+    with recorder._lock:
+        totals = dict(recorder.totals)
+
+    lines = []
+    # hits and misses of one cache are two events of the same key, split them back up
+    cache_totals: dict[str, list[float]] = {}
+    for (kind, name, extra), (count, total) in sorted(totals.items()):
+        if kind == "span":
+            lines.append(f"openmxr_span_seconds_total{_labels(span=name, **dict(extra))} {total}")
+            lines.append(f"openmxr_span_count_total{_labels(span=name, **dict(extra))} {count}")
+        elif kind == "bytes":
+            lines.append(f"openmxr_bytes_total{_labels(name=name, **dict(extra))} {total:.0f}")
+        elif kind == "cache":
+            cache_totals[name] = [count, total]
+    for name, (count, hits) in cache_totals.items():
+        lines.append(f"openmxr_cache_requests_total{_labels(cache=name, result='hit')} {hits:.0f}")
+        lines.append(f"openmxr_cache_requests_total{_labels(cache=name, result='miss')} {count - hits:.0f}")
+    return "\n".join(
+        [
+            "# TYPE openmxr_span_seconds_total counter",
+            "# TYPE openmxr_span_count_total counter",
+            "# TYPE openmxr_bytes_total counter",
+            "# TYPE openmxr_cache_requests_total counter",
+        ] + lines
+    ) + "\n"
+
+
+class Progress:
+    """One running transfer, does nothing by default"""
+    def update(self, count: int):
+        pass
+
+    def close(self):
+        pass
+
+
+class ProgressReporter:
+    def start(self, name: str, total: int, initial: int = 0) -> Progress:
+        return Progress()
+
+
+class LogProgress(Progress):
+    def __init__(self, name: str, total: int, initial: int, interval: float, track: str | None):
+        self.name = name
+        self.total = total
+        self.done = initial
+        self.interval = interval
+        self.track = track
+        self._began = self._logged = time.monotonic()
+        self._initial = initial
+        self._lock = threading.Lock()
+
+    def update(self, count: int):
+        with self._lock:
+            self.done += count
+            now = time.monotonic()
+            if now - self._logged < self.interval:
+                return
+            self._logged = now
+        self._log(now)
+
+    def _log(self, now: float):
+        rate = (self.done - self._initial) / max(now - self._began, 1e-9)
+        percent = 100 * self.done / self.total if self.total else 100
+        logging.info(f"{self.name}{f' {self.track}' if self.track else ''}: {percent:.0f}% of {self.total / 1024 ** 2:.1f}MiB, {rate / 1024 ** 2:.1f}MiB/s")
+
+    def close(self):
+        self._log(time.monotonic())
+
+
+class LogProgressReporter(ProgressReporter):
+    """A log line every `interval` seconds per transfer, for headless workers"""
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+
+    def start(self, name: str, total: int, initial: int = 0) -> Progress:
+        return LogProgress(name, total, initial, self.interval, _track.get())
+
+
+class TqdmProgressReporter(ProgressReporter):
+    """tqdm bars, the notebook widget when running in a notebook"""
+    def start(self, name: str, total: int, initial: int = 0) -> Progress:
+        from tqdm.auto import tqdm
+        return tqdm(total=total, initial=initial, unit='B', unit_scale=True, desc=name) # type: ignore
+
+
+_progress_reporter: ProgressReporter = ProgressReporter()
+
+
+def set_progress_reporter(reporter: ProgressReporter | None):
+    global _progress_reporter
+    _progress_reporter = reporter or ProgressReporter()
+
+
+def progress(name: str, total: int, initial: int = 0) -> Progress:
+    return _progress_reporter.start(name, total, initial)
@@ -0,0 +1,50 @@
+from typing import IO, Iterable
+import wave
+import numpy as np
+import numpy.typing as npt
+
+from openmxr.mix.renderer import MixRenderer
+
+
+def write_wav(blocks: Iterable[npt.NDArray[np.float32]], file: str | IO[bytes], sample_rate: int, channels: int = 2) -> int:
+    """Write float blocks as 16 bit WAV, returns the number of frames written"""
+    written = 0
+    pcm = None
+    with wave.open(file, "wb") as output:
+        output.setnchannels(channels)
+        output.setsampwidth(2)
+        output.setframerate(sample_rate)
+        for block in blocks:
+            frames = block.shape[-1]
+            if pcm is None or pcm.shape[0] < frames:
+                pcm = np.empty((frames, channels), dtype="<i2")
+                scaled = np.empty((channels, frames), dtype=np.float32)
+            # interleave into one reused buffer, clipping what the crossfades pushed over full scale
+            np.multiply(block, 32767, out=scaled[:, :frames])
+            np.clip(scaled[:, :frames], -32768, 32767, out=scaled[:, :frames])
+            pcm[:frames] = scaled[:, :frames].T
+            output.writeframes(pcm[:frames].tobytes())
+            written += frames
+    return written
+
+
+def write_raw(blocks: Iterable[npt.NDArray[np.float32]], file: IO[bytes]) -> int:
+    """Write interleaved float32 little endian, e.g. into `ffmpeg -f f32le -i pipe:` or a sound card"""
+    written = 0
+    interleaved = None
+    for block in blocks:
+        channels, frames = block.shape
+        if interleaved is None or interleaved.shape[0] < frames:
+            interleaved = np.empty((frames, channels), dtype="<f4")
+        interleaved[:frames] = block.T
+        file.write(interleaved[:frames].tobytes())
+        written += frames
+    file.flush()
+    return written
+
+
+def render_to(renderer: MixRenderer, file: str | IO[bytes]) -> int:
+    """Render the whole mix, to a WAV file by name or as raw float32 into an open file or pipe"""
+    if isinstance(file, str):
+        return write_wav(renderer.blocks(), file, renderer.sample_rate, renderer.channels)
+    return write_raw(renderer.blocks(), file)
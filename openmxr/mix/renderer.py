@@ -0,0 +1,168 @@
+from dataclasses import dataclass
+import math
+from typing import Iterator
+import numpy as np
+import numpy.typing as npt
+
+from openmxr.models.AnalyzedTrack import AnalyzedTrack
+from openmxr.song import Song
+
+# bars the outgoing and incoming track play over each other
+FADE_BARS = 8
+BLOCK_FRAMES = 4096
+
+
+@dataclass
+class MixTrack:
+    """A song and where it's mixed, all positions in frames of its own audio"""
+    song: Song
+    # downbeat the track comes in on
+    start: int
+    # downbeat the fade to the next track starts on
+    transition: int
+    # median distance between downbeats, which sets how fast it has to play to match the mix tempo
+    bar_frames: float
+
+    @classmethod
+    def from_analysis(cls, song: Song, analysis: AnalyzedTrack, fade_bars: int = FADE_BARS) -> "MixTrack":
+        """Come in on the first downbeat, start fading out `fade_bars` bars before the last one"""
+        downbeats = np.asarray(analysis.downbeats, dtype=np.int64)
+        if len(downbeats) < fade_bars + 2:
+            raise Exception(f"{analysis.meta.title}: {len(downbeats)} downbeats aren't enough to mix")
+        scale = song.sample_rate / analysis.sample_rate
+        downbeats = np.round(downbeats * scale).astype(np.int64)
+        return cls(song, int(downbeats[0]), int(downbeats[-1 - fade_bars]), float(np.median(np.diff(downbeats))))
+
+
+@dataclass
+class _Voice:
+    track: MixTrack
+    # samples as cached, int16 ones are converted a window at a time and scaled through the gains
+    audio: npt.NDArray
+    scale: float
+    # source frames per output frame
+    step: float
+    # output frames the track starts and stops playing at
+    begin: int
+    end: int
+    fade_in: int
+    # output frame the fade out starts at, None for the last track
+    fade_out: int | None
+    fade_frames: int
+
+
+class MixRenderer:
+    """Renders tracks into one continuous mix, one fixed-size block at a time.
+
+    Every track is played at the mix tempo, resampled like a turntable's
+    pitch fader, so their downbeats line up, and each transition is an
+    equal-power crossfade starting on a downbeat of both tracks. Audio is
+    read through the cached memmaps a block at a time and every block is
+    written into the same preallocated buffer, so memory doesn't grow
+    with the length of the set.
+    """
+    tracks: list[MixTrack]
+    sample_rate: int
+    channels: int
+    bpm: float
+    fade_bars: int
+    block_frames: int
+
+    def __init__(self, tracks: list[MixTrack], sample_rate: int = 48000, bpm: float | None = None, fade_bars: int = FADE_BARS, block_frames: int = BLOCK_FRAMES, channels: int = 2):
+        if not tracks:
+            raise Exception("nothing to mix")
+        self.tracks = tracks
+        self.sample_rate = sample_rate
+        self.channels = channels
+        # the tempo the tracks meet at, the median of theirs unless asked for another one
+        self.bpm = bpm or float(np.median([4 * 60 * track.song.sample_rate / track.bar_frames for track in tracks]))
+        self.fade_bars = fade_bars
+        self.block_frames = block_frames
+        self.voices = self._plan()
+
+    @property
+    def bar_frames(self) -> float:
+        """output frames per bar"""
+        return 4 * 60 * self.sample_rate / self.bpm
+
+    @property
+    def frames(self) -> int:
+        return max(voice.end for voice in self.voices)
+
+    def _plan(self) -> list[_Voice]:
+        fade_frames = int(round(self.fade_bars * self.bar_frames))
+        voices = []
+        begin = 0
+        for i, track in enumerate(self.tracks):
+            audio, scale = track.song.pcm
+            step = track.bar_frames / self.bar_frames
+            last = i == len(self.tracks) - 1
+            fade_out = None if last else begin + int(round((track.transition - track.start) / step))
+            playable = begin + int((audio.shape[-1] - 1 - track.start) / step)
+            end = playable if fade_out is None else min(playable, fade_out + fade_frames)
+            voices.append(_Voice(track, audio, scale, step, begin, end, 0 if i == 0 else fade_frames, fade_out, fade_frames))
+            if fade_out is not None:
+                begin = fade_out
+        return voices
+
+    def blocks(self) -> Iterator[npt.NDArray[np.float32]]:
+        """(channels, frames) float32 blocks, `block_frames` long except the last.
+
+        The same buffer is yielded every time, copy a block to keep it.
+        """
+        block = np.zeros((self.channels, self.block_frames), dtype=np.float32)
+        offsets = np.arange(self.block_frames, dtype=np.float64)
+        positions = np.empty(self.block_frames, dtype=np.float64)
+        whole = np.empty(self.block_frames, dtype=np.float64)
+        indices = np.empty(self.block_frames, dtype=np.intp)
+        fractions = np.empty(self.block_frames, dtype=np.float64)
+        gains = np.empty(self.block_frames, dtype=np.float32)
+        left = np.empty((self.channels, self.block_frames), dtype=np.float32)
+        right = np.empty((self.channels, self.block_frames), dtype=np.float32)
+        total = self.frames
+        for first in range(0, total, self.block_frames):
+            count = min(self.block_frames, total - first)
+            block[:] = 0
+            for voice in self.voices:
+                begin, end = max(first, voice.begin), min(first + count, voice.end)
+                if begin >= end:
+                    continue
+                n = end - begin
+                out = slice(begin - first, end - first)
+                # fractional source positions of this stretch, read through a window just wide enough
+                base = voice.track.start + (begin - voice.begin) * voice.step
+                low = int(base)
+                np.multiply(offsets[:n], voice.step, out=positions[:n])
+                positions[:n] += base - low
+                high = min(low + int(positions[n - 1]) + 2, voice.audio.shape[-1])
+                window = voice.audio[..., low:high]
+                if window.ndim == 1:
+                    window = window[None]
+                if window.dtype != np.float32:
+                    window = window.astype(np.float32)
+                np.modf(positions[:n], out=(fractions[:n], whole[:n]))
+                indices[:n] = whole[:n]
+                channels = slice(0, self.channels) if window.shape[0] >= self.channels else [0] * self.channels
+                np.take(window[channels], indices[:n], axis=1, out=left[:, :n], mode="clip")
+                np.take(window[channels], indices[:n] + 1, axis=1, out=right[:, :n], mode="clip")
+                # linear interpolation, left + (right - left) * fraction
+                right[:, :n] -= left[:, :n]
+                right[:, :n] *= fractions[:n]
+                left[:, :n] += right[:, :n]
+                self._gains(voice, begin, n, gains[:n], offsets)
+                if voice.scale != 1:
+                    gains[:n] *= voice.scale
+                left[:, :n] *= gains[:n]
+                block[:, out] += left[:, :n]
+            yield block if count == self.block_frames else block[:, :count]
+
+    @staticmethod
+    def _gains(voice: _Voice, begin: int, n: int, gains: npt.NDArray[np.float32], offsets: npt.NDArray):
+        """Equal-power fade in and out, the two gains of a crossfade always add up to constant power"""
+        gains[:] = 1
+        if voice.fade_in and begin < voice.begin + voice.fade_in:
+            progress = (offsets[:n] + begin - voice.begin) / voice.fade_in
+            np.minimum(gains, np.sin(np.clip(progress, 0, 1) * math.pi / 2), out=gains)
+        if voice.fade_out is not None and begin + n > voice.fade_out:
+            progress = (offsets[:n] + begin - voice.fade_out) / voice.fade_frames
+            np.minimum(gains, np.cos(np.clip(progress, 0, 1) * math.pi / 2), out=gains)
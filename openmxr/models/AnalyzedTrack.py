@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from openmxr.models.Metadata import Metadata
-import numpy.typing as npt
+from openmxr.waveform import WaveformPyramid
 
 
 @dataclass
@@ -8,7 +8,8 @@ class AnalyzedTrack:
     meta: Metadata
     sample_rate: int
     key: int
-    waveform: npt.NDArray
+    # peaks at every zoom, `waveform.query(start, end, width)` to draw it
+    waveform: WaveformPyramid
     downbeats: list[int]
     best_downbeats: list[int]
     bpm: int  
@@ -0,0 +1,31 @@
+from dataclasses import asdict, dataclass
+from typing import Any
+
+
+@dataclass(slots=True)
+class Resolution:
+    """What a search resolved to, or when it's worth searching again.
+
+    `score` is how closely the Spotify match fits what was searched for,
+    1.0 for lookups by id. A failed search has no `spotify_id` and a
+    `retry_after` timestamp instead.
+    """
+    spotify_id: str | None = None
+    youtube_id: str | None = None
+    score: float | None = None
+    error: str | None = None
+    retry_after: float | None = None
+    resolved_at: float | None = None
+
+    VERSION = 1
+
+    @property
+    def found(self) -> bool:
+        return self.spotify_id is not None
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Resolution":
+        return cls(**{key: value for key, value in data.items() if key != "v"})
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"v": self.VERSION, **{key: value for key, value in asdict(self).items() if value is not None}}
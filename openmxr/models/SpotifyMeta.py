@@ -0,0 +1,49 @@
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from openmxr.models.Metadata import Metadata
+
+
+@dataclass(slots=True)
+class SpotifyMeta:
+    """The part of a spotdl `Song.json` OpenMXR actually reads"""
+    song_id: str
+    name: str
+    url: str
+    artist: str | None = None
+    artists: list[str] | None = None
+    album_name: str | None = None
+    album_id: str | None = None
+    duration: float | None = None
+    year: int | None = None
+    genres: list[str] | None = None
+    cover_url: str | None = None
+    isrc: str | None = None
+    # youtube link spotdl matched to this track
+    download_url: str | None = None
+
+    VERSION = 1
+
+    @classmethod
+    def from_info(cls, info: dict[str, Any]) -> "SpotifyMeta":
+        """Project a full spotdl `Song.json`"""
+        return cls(**{field: info.get(field) for field in cls.__dataclass_fields__}) # type: ignore
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "SpotifyMeta":
+        if data.get("v") != cls.VERSION:
+            return cls.from_info(data)
+        return cls(**{key: value for key, value in data.items() if key != "v"})
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"v": self.VERSION, **{key: value for key, value in asdict(self).items() if value is not None}}
+
+    def to_metadata(self) -> Metadata:
+        return Metadata(
+            title=self.name,
+            artist=self.artist,
+            cover=self.cover_url,
+            album=self.album_name,
+            year=str(self.year) if self.year else None,
+            genre=self.genres[0] if self.genres else None,
+        )
@@ -0,0 +1,26 @@
+from dataclasses import asdict, dataclass
+from typing import Any
+
+
+@dataclass(slots=True)
+class TrackRecord:
+    """One track, whichever link or search it was found by.
+
+    `yt_link` and `spotify_link` are the exact keys its audio and metadata
+    are cached under, `digest` is the md5 of its cached audio once there is
+    any.
+    """
+    youtube_id: str
+    yt_link: str
+    spotify_id: str | None = None
+    spotify_link: str | None = None
+    digest: str | None = None
+
+    VERSION = 1
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "TrackRecord":
+        return cls(**{key: value for key, value in data.items() if key != "v"})
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"v": self.VERSION, **{key: value for key, value in asdict(self).items() if value is not None}}
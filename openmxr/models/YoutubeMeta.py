@@ -0,0 +1,52 @@
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from openmxr.models.Metadata import Metadata
+
+
+@dataclass(slots=True)
+class YoutubeMeta:
+    """The part of a yt-dlp info dict OpenMXR actually reads"""
+    id: str
+    # direct stream url, expires after a few hours
+    url: str
+    fulltitle: str
+    duration: float | None = None
+    artist: str | None = None
+    track: str | None = None
+    # (start_time, end_time, value) of youtube's "most replayed" graph
+    heatmap: list[tuple[float, float, float]] | None = None
+    spotify_url: str | None = None
+
+    VERSION = 1
+
+    @classmethod
+    def from_info(cls, info: dict[str, Any]) -> "YoutubeMeta":
+        """Project a full `YoutubeDL.extract_info` result"""
+        heatmap = info.get("heatmap")
+        return cls(
+            id=info.get("id", ""),
+            url=info["url"],
+            fulltitle=info.get("fulltitle") or info.get("title", ""),
+            duration=info.get("duration"),
+            artist=info.get("artist"),
+            track=info.get("track"),
+            heatmap=[(item["start_time"], item["end_time"], item["value"]) for item in heatmap] if heatmap else None,
+            spotify_url=info.get("CUSTOM__spotify_url"),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "YoutubeMeta":
+        if data.get("v") != cls.VERSION:
+            # cached before metadata was projected
+            return cls.from_info(data)
+        fields = {key: value for key, value in data.items() if key != "v"}
+        if fields.get("heatmap"):
+            fields["heatmap"] = [tuple(item) for item in fields["heatmap"]]
+        return cls(**fields)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"v": self.VERSION, **{key: value for key, value in asdict(self).items() if value is not None}}
+
+    def to_metadata(self) -> Metadata:
+        return Metadata(title=self.track or self.fulltitle, artist=self.artist, cover=None, album=None, year=None, genre=None)
@@ -0,0 +1,247 @@
+from concurrent.futures import Future
+from dataclasses import astuple, dataclass, field
+import logging
+import threading
+from typing import Callable
+
+from openmxr.ingest import PlaylistEntry
+from openmxr.models.AnalyzedTrack import AnalyzedTrack
+from openmxr.song import Song
+
+
+@dataclass(eq=False)
+class PrefetchedTrack:
+    entry: PlaylistEntry
+    # queued, resolved, cached (audio on disk), ready (analyzed too) or failed,
+    # whether the audio is loaded as well is up to the memory budget
+    stage: str = "queued"
+    song: Song | None = None
+    analysis: AnalyzedTrack | None = None
+    error: BaseException | None = None
+    ready: threading.Event = field(default_factory=threading.Event, repr=False)
+    # a worker is on it
+    busy: bool = field(default=False, repr=False)
+
+
+class Prefetcher:
+    """Keeps the tracks from `position` to `position + lookahead` of a set resolved, cached and analyzed.
+
+    Work always goes to the nearest track that needs it, so moving the
+    position or reordering the set reprioritizes at once, and tracks that
+    fall out of the window are dropped before their next step. Ready tracks
+    stay loaded while their audio fits in `max_memory`, nearest first, the
+    rest are released back to the on-disk cache. `io_workers` bounds the
+    downloads and metadata lookups in flight, `cpu_workers` the tracks
+    analyzed at once.
+    """
+    entries: list[PlaylistEntry]
+    position: int
+    lookahead: int
+    max_memory: int | None
+    analyze: bool
+    on_progress: Callable[[PrefetchedTrack], None]
+
+    def __init__(self, entries: list[PlaylistEntry], position: int = 0, lookahead: int = 2, max_memory: int | None = None,
+                 io_workers: int = 2, cpu_workers: int = 1, analyze: bool = True, on_progress: Callable[[PrefetchedTrack], None] | None = None):
+        self.entries = list(entries)
+        self.position = position
+        self.lookahead = lookahead
+        self.max_memory = max_memory
+        self.analyze = analyze
+        self.on_progress = on_progress or self.log_progress
+        self._tracks = {astuple(entry): PrefetchedTrack(entry) for entry in self.entries}
+        self._changed = threading.Condition()
+        self._closed = False
+        # yt_link -> download running for it, entries resolving to the same video share it
+        self._downloads: dict[str, Future] = {}
+        self._downloads_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._worker, args=("io",), name=f"prefetch-io-{i}", daemon=True) for i in range(io_workers)]
+        self._threads += [threading.Thread(target=self._worker, args=("cpu",), name=f"prefetch-cpu-{i}", daemon=True) for i in range(cpu_workers)]
+
+    @staticmethod
+    def log_progress(track: PrefetchedTrack):
+        if track.stage == "failed":
+            logging.error(f"prefetch failed: {track.entry}: {track.error}")
+        else:
+            logging.info(f"prefetch {track.stage} {track.entry}")
+
+    def start(self) -> "Prefetcher":
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def close(self):
+        """Stops after the steps running now, everything fetched so far stays in the cache"""
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.close()
+
+    def window(self) -> list[PrefetchedTrack]:
+        """The tracks being prefetched, nearest first"""
+        return [self._tracks[astuple(entry)] for entry in self.entries[self.position:self.position + self.lookahead + 1]]
+
+    def track(self, index: int) -> PrefetchedTrack:
+        return self._tracks[astuple(self.entries[index])]
+
+    def set_position(self, position: int):
+        with self._changed:
+            self.position = position
+            self._demote()
+            self._changed.notify_all()
+
+    def set_entries(self, entries: list[PlaylistEntry], position: int | None = None):
+        """A reordered or edited set, whatever was fetched for entries still in it is kept"""
+        with self._changed:
+            tracks = {}
+            for entry in entries:
+                key = astuple(entry)
+                tracks[key] = self._tracks.get(key) or PrefetchedTrack(entry)
+            for key, track in self._tracks.items():
+                if key not in tracks and track.song and track.song.is_loaded and not track.busy:
+                    track.song.release()
+            self._tracks = tracks
+            self.entries = list(entries)
+            if position is not None:
+                self.position = position
+            self._demote()
+            self._changed.notify_all()
+
+    def wait(self, index: int, timeout: float | None = None) -> PrefetchedTrack:
+        """Block until the track at `index`, which has to be in the window, is ready or failed"""
+        if not self.position <= index <= self.position + self.lookahead:
+            raise Exception(f"track {index} is outside the prefetch window")
+        track = self.track(index)
+        if not track.ready.wait(timeout):
+            raise TimeoutError(f"track {index} isn't ready after {timeout}s")
+        return track
+
+    def _step(self, track: PrefetchedTrack) -> tuple[str, Callable[[PrefetchedTrack], None]] | None:
+        if track.stage == "queued":
+            return ("io", self._resolve)
+        if track.stage == "resolved":
+            return ("io", self._download)
+        if track.stage == "cached" and self.analyze:
+            return ("cpu", self._analyze)
+        if track.stage == "ready" and not track.song.is_loaded: # type: ignore
+            return ("io", self._load)
+        return None
+
+    def _next_job(self, kind: str) -> tuple[PrefetchedTrack, Callable[[PrefetchedTrack], None]] | None:
+        window = self.window()
+        budget = self.max_memory
+        for track in window:
+            step = self._step(track)
+            if budget is not None and track.song and (track.song.is_loaded or (step and step[1] == self._load)):
+                size = self._track_bytes(track)
+                # loading has to fit in what the nearer tracks left, the nearest one always loads
+                if not track.song.is_loaded and size > budget and track is not window[0]:
+                    continue
+                budget -= size
+            if step and not track.busy and step[0] == kind:
+                return (track, step[1])
+        return None
+
+    def _worker(self, kind: str):
+        while True:
+            with self._changed:
+                while True:
+                    if self._closed:
+                        return
+                    if (job := self._next_job(kind)) is not None:
+                        break
+                    self._changed.wait()
+                track, step = job
+                track.busy = True
+            try:
+                step(track)
+            except Exception as e:
+                track.error = e
+                track.stage = "failed"
+                track.ready.set()
+            finally:
+                with self._changed:
+                    track.busy = False
+                    # set_entries left it alone while it was being worked on
+                    if self._tracks.get(astuple(track.entry)) is not track and track.song and track.song.is_loaded:
+                        track.song.release()
+                    self._demote()
+                    self._changed.notify_all()
+            self.on_progress(track)
+
+    def _resolve(self, track: PrefetchedTrack):
+        track.song = track.entry.find(load_audio=False)
+        track.stage = "resolved"
+
+    def _download(self, track: PrefetchedTrack):
+        song: Song = track.song # type: ignore
+        with self._downloads_lock:
+            running = self._downloads.get(song.yt_link)
+            owner = running is None
+            if running is None:
+                running = self._downloads[song.yt_link] = Future()
+        if owner:
+            try:
+                # mapping it is up to the analysis and the memory budget
+                song.cache_audio()
+                running.set_result(None)
+            except BaseException as e:
+                running.set_exception(e)
+                raise
+            finally:
+                with self._downloads_lock:
+                    del self._downloads[song.yt_link]
+        else:
+            running.result()
+        track.stage = "cached"
+        if not self.analyze:
+            self._set_ready(track)
+
+    def _analyze(self, track: PrefetchedTrack):
+        song: Song = track.song # type: ignore
+        song.load_audio()
+        track.analysis = song.analyze()
+        # drop the resampled and downmixed copies the analysis left behind, the audio is mapped again if it fits
+        song.release()
+        self._set_ready(track)
+
+    def _load(self, track: PrefetchedTrack):
+        track.song.load_audio() # type: ignore
+
+    def _set_ready(self, track: PrefetchedTrack):
+        track.stage = "ready"
+        track.ready.set()
+
+    @staticmethod
+    def _track_bytes(track: PrefetchedTrack) -> int:
+        """Memory the track's audio takes loaded, from its cache header or else its duration"""
+        song = track.song
+        if song is None:
+            return 0
+        if (header := song.audio_header):
+            return header.frames * header.channels * header.dtype.itemsize
+        duration = song._yt_cache.duration if song._yt_cache else None
+        return int((duration or 0) * song.decode_sample_rate * song.decode_channels * 4)
+
+    def _demote(self):
+        """Release tracks outside the window, and the farthest ones in it while over the memory budget"""
+        window = self.window()
+        for track in self._tracks.values():
+            if track.song and track.song.is_loaded and not track.busy and track not in window:
+                track.song.release()
+        if self.max_memory is None:
+            return
+        used = 0
+        for track in window:
+            if track.song and track.song.is_loaded:
+                used += self._track_bytes(track)
+                if used > self.max_memory and track is not window[0] and not track.busy:
+                    used -= self._track_bytes(track)
+                    track.song.release()
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from fractions import Fraction
+import logging
+import threading
+from typing import Callable
+import numpy as np
+import numpy.typing as npt
+
+from openmxr.cache import AudioCache
+
+
+def resample(audio: npt.NDArray, sample_rate: int, new_sample_rate: int) -> npt.NDArray[np.float32]:
+    """Polyphase resampling along the last axis, 48000 -> 44100 runs as 147/160"""
+    if sample_rate == new_sample_rate:
+        return np.asarray(audio, dtype=np.float32)
+    from scipy.signal import resample_poly
+    ratio = Fraction(new_sample_rate, sample_rate)
+    resampled = resample_poly(audio, ratio.numerator, ratio.denominator, axis=-1)
+    return resampled.astype(np.float32, copy=False)
+
+
+class ResampleCache:
+    """Bounded LRU of resampled tracks, optionally persisted as extra AudioCache entries"""
+    max_bytes: int
+    persist: AudioCache | None
+    _entries: OrderedDict[tuple[str, int, bool], npt.NDArray]
+    _size: int
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, persist: AudioCache | None = None):
+        self.max_bytes = max_bytes
+        self.persist = persist
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def persist_key(track: str, sample_rate: int, mono: bool):
+        return f"{track}@{sample_rate}{'/mono' if mono else ''}"
+
+    def get(self, track: str, sample_rate: int, mono: bool, compute: Callable[[], npt.NDArray]) -> npt.NDArray:
+        key = (track, sample_rate, mono)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        audio = None
+        if self.persist and (cached := self.persist.get(self.persist_key(*key))):
+            audio = cached[1][0] if mono else cached[1]
+        if audio is None:
+            logging.debug(f"resampling {track} to {sample_rate}Hz{' mono' if mono else ''}")
+            audio = compute()
+            if self.persist:
+                self.persist.set(self.persist_key(*key), (sample_rate, audio))
+                # swap the computed array for the mapped file
+                if (cached := self.persist.get(self.persist_key(*key))):
+                    audio = cached[1][0] if mono else cached[1]
+        self._store(key, audio)
+        return audio
+
+    def _store(self, key: tuple[str, int, bool], audio: npt.NDArray):
+        # memmapped results cost no memory, only count what actually lives in RAM
+        size = 0 if isinstance(audio, np.memmap) else audio.nbytes
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = audio
+            self._size += size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= 0 if isinstance(evicted, np.memmap) else evicted.nbytes
+
+    def clear(self, track: str | None = None):
+        with self._lock:
+            for key in [key for key in self._entries if track is None or key[0] == track]:
+                evicted = self._entries.pop(key)
+                self._size -= 0 if isinstance(evicted, np.memmap) else evicted.nbytes
+
+
+resampled_cache = ResampleCache()
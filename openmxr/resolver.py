@@ -0,0 +1,118 @@
+"""Remembers what searches resolved to, so a track is only ever searched once.
+
+Spotify and YouTube searches take seconds each and are rate limited. Every
+outcome is cached under a key naming what was searched for, failures too:
+a search that found nothing isn't retried for `NOT_FOUND_RETRY` seconds,
+one that hit a network or search error for `ERROR_RETRY`. Any other
+error is a bug, it propagates and nothing is cached. Identical searches
+running at the same time share one call.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from difflib import SequenceMatcher
+import logging
+import sys
+import threading
+import time
+from typing import Callable
+import requests
+
+from openmxr import metrics
+from openmxr.cache import CacheBackend, RecordCache
+from openmxr.models.Resolution import Resolution
+from openmxr.utils.ids import normalize_query
+
+NOT_FOUND_RETRY = 7 * 24 * 3600
+# rate limits and network trouble, worth trying again in the next run
+ERROR_RETRY = 10 * 60
+# (module, exception) a search fails with for reasons outside our code, anything else is a bug and propagates
+SEARCH_ERRORS = [
+    ("spotipy.exceptions", "SpotifyException"),
+    ("spotdl.types.song", "SongError"),
+    ("spotdl.utils.spotify", "SpotifyError"),
+    ("yt_dlp.utils", "DownloadError"),
+]
+
+
+def search_errors() -> tuple[type[BaseException], ...]:
+    """Network and search failures, only from the modules already imported, a search can't raise the others'"""
+    errors: list[type[BaseException]] = [requests.RequestException, ConnectionError, TimeoutError]
+    for module, name in SEARCH_ERRORS:
+        if (error := getattr(sys.modules.get(module), name, None)) is not None:
+            errors.append(error)
+    return tuple(errors)
+
+
+def match_score(searched: str, found: str) -> float:
+    """0 to 1, how much of what was searched for the result's name covers"""
+    return round(SequenceMatcher(None, normalize_query(searched), normalize_query(found)).ratio(), 3)
+
+
+class ResolutionCache(RecordCache):
+    """Positive results are kept forever, negative ones until they may be retried"""
+
+    def __init__(self, name: str = "resolutions", backend: CacheBackend | None = None):
+        super().__init__(name, Resolution, backend)
+
+    def expires_at(self, data) -> float | None:
+        return data.retry_after
+
+
+class Resolver:
+    cache: ResolutionCache
+    workers: int
+
+    def __init__(self, cache: ResolutionCache | None = None, workers: int = 8):
+        self.cache = cache or ResolutionCache()
+        self.workers = workers
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, key: str, search: Callable[[], Resolution]) -> Resolution:
+        """The cached resolution of `key`, running `search` only when there is none"""
+        if (cached := self.cache.get(key)) is not None:
+            return cached
+        with self._lock:
+            running = self._inflight.get(key)
+            if running is None:
+                running = self._inflight[key] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return running.result()
+        try:
+            # it may have finished between the cache read and taking the lock
+            if (result := self.cache.get(key)) is None:
+                result = self._search(key, search)
+                self.cache.set(key, result)
+            running.set_result(result)
+            return result
+        except BaseException as e:
+            running.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _search(self, key: str, search: Callable[[], Resolution]) -> Resolution:
+        now = time.time()
+        try:
+            with metrics.span("search", kind=key.split(":", 1)[0]):
+                result = search()
+        except search_errors() as e:
+            logging.warning(f"search for {key} failed: {e}")
+            return Resolution(error=str(e), retry_after=now + ERROR_RETRY, resolved_at=now)
+        result.resolved_at = now
+        if not result.found:
+            result.retry_after = now + NOT_FOUND_RETRY
+        return result
+
+    def resolve_many(self, searches: dict[str, Callable[[], Resolution]]) -> dict[str, Resolution]:
+        """Resolve every key, the cached ones in one read and the rest on `workers` threads"""
+        results = self.cache.get_many(searches)
+        missing = [key for key in searches if key not in results]
+        if missing:
+            with ThreadPoolExecutor(min(self.workers, len(missing)), thread_name_prefix="openmxr-resolve") as pool:
+                for key, result in zip(missing, pool.map(lambda key: self.resolve(key, searches[key]), missing)):
+                    results[key] = result
+        return results
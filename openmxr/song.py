@@ -1,50 +1,118 @@
 from dataclasses import dataclass
-from io import BytesIO, TextIOWrapper
-import librosa
 import numpy as np
 import numpy.typing as npt
-import requests
-from pyparsing import Any
+from typing import Any, Iterable, Iterator
+import functools
 import logging
-import soundfile
-from openmxr.cache import AudioCache, Cache
-from openmxr.convert import convert_opus_to_wav
-from openmxr.downloader.DownloadTask import DownloadTask
-from openmxr import sp_client, dl_client, yt_client
-from scipy.signal import resample
+import time
+from openmxr import metrics
+from openmxr.aliases import AliasIndex, canonical_spotify_link
+from openmxr.cache import AUDIO_CACHE_DTYPE, AUDIO_CACHE_MAX_BYTES, AudioCache, Cache, PCMHeader, RecordCache, StreamMetaCache
+from openmxr.convert import decode_audio, decode_audio_blocks
+from openmxr.downloader.DownloadTask import AsyncDownloadTask, DownloadTask
+from openmxr.downloader.session import get_session
+from openmxr.models.AnalyzedTrack import AnalyzedTrack
+from openmxr.models.Metadata import Metadata
+from openmxr.models.Resolution import Resolution
+from openmxr.models.SpotifyMeta import SpotifyMeta
+from openmxr.models.YoutubeMeta import YoutubeMeta
+from openmxr.clients import get_dl_client, get_sp_client, get_yt_client
+from openmxr.executors import run_blocking
+from openmxr.resample import resample, resampled_cache
+from openmxr.resolver import Resolver, match_score
+from openmxr.utils.ids import normalize_query, spotify_track_id, spotify_url, youtube_url, youtube_video_id
+from openmxr.utils.stream_url import stream_url_expires
+from openmxr.waveform import WaveformPyramid
 
 
 class Song():
     yt_link: str
     spotify_link: str
+    # sample rate and the (channels, frames) samples as cached, a memmap in the storage dtype
     _audio_cache: tuple[int, npt.NDArray] | None = None
-    _spotify_cache: dict[str, Any] | None = None
-    _yt_cache: dict[str, Any] | None = None
+    _audio_scale: float = 1.0
+    _audio_float: npt.NDArray[np.float32] | None = None
+    _audio_mono: npt.NDArray[np.float32] | None = None
+    _audio_header: PCMHeader | None = None
+    _spotify_cache: SpotifyMeta | None = None
+    _yt_cache: YoutubeMeta | None = None
+    # youtube serves opus, which is 48kHz internally
+    decode_sample_rate = 48000
+    decode_channels = 2
+    # also keep the full yt-dlp and spotdl dicts, in the yt_raw and spotify_raw caches
+    keep_raw_meta = False
     
-    __yt_cache_instance = Cache("yt")
-    __spotify_cache_instance = Cache("spotify")
-    __audio_cache_instance = AudioCache("audio")
+    __yt_cache_instance = StreamMetaCache("yt", YoutubeMeta)
+    __spotify_cache_instance = RecordCache("spotify", SpotifyMeta)
+    __yt_raw_cache_instance = Cache("yt_raw")
+    __spotify_raw_cache_instance = Cache("spotify_raw")
+    __audio_cache_instance = AudioCache("audio", dtype=AUDIO_CACHE_DTYPE, max_bytes=AUDIO_CACHE_MAX_BYTES)
+    __alias_index_instance = AliasIndex()
+    __resolver_instance = Resolver()
     
     @property
-    def audio(self):
+    def audio(self) -> npt.NDArray[np.float32]:
+        """(channels, frames) float32, the cached memmap itself unless it's stored as int16"""
+        if self._audio_float is None:
+            samples, scale = self.pcm
+            self._audio_float = samples if samples.dtype == np.float32 else np.multiply(samples, scale, dtype=np.float32)
+        return self._audio_float
+
+    @property
+    def waveform(self) -> WaveformPyramid:
+        """Min/max/RMS overview, read from beside the cached audio without loading it"""
+        if (pyramid := self.__audio_cache_instance.waveform(self.yt_link)) is None:
+            raise Exception("waveform not available")
+        return pyramid
+
+    @property
+    def pcm(self) -> tuple[npt.NDArray, float]:
+        """The samples as stored and the factor that scales them to float, nothing converted"""
         if (not self._audio_cache):
             raise Exception("audio not available")
-        return self._audio_cache[1]
+        return self._audio_cache[1], self._audio_scale
     
     @property
-    def audio_mono(self):
-        if (not self._audio_cache):
-            raise Exception("audio not available")
-        return self.to_mono(self._audio_cache[1])
+    def audio_mono(self) -> npt.NDArray[np.float32]:
+        """Downmixed once and kept until `release`"""
+        if self._audio_mono is None:
+            samples, scale = self.pcm
+            self._audio_mono = self.to_mono(samples, scale)
+        return self._audio_mono
     
-    def to_mono(self, audio):
-        return librosa.to_mono(audio)
+    def to_mono(self, audio, scale: float = 1.0, block_frames: int = 1 << 20):
+        # same downmix as librosa.to_mono, without importing librosa, in blocks so int16 is never converted whole
+        if audio.ndim == 1 or audio.shape[0] == 1:
+            audio = audio.reshape(-1)
+            return audio if audio.dtype == np.float32 and scale == 1 else np.multiply(audio, scale, dtype=np.float32)
+        mono = np.empty(audio.shape[-1], dtype=np.float32)
+        for start in range(0, audio.shape[-1], block_frames):
+            block = mono[start:start + block_frames]
+            np.sum(audio[:, start:start + block_frames], axis=0, dtype=np.float32, out=block)
+            block *= scale / audio.shape[0]
+        return mono
+
+    def release(self):
+        """Drop the samples and everything computed from them, metadata stays and `load_audio` maps them again"""
+        self._audio_cache = None
+        self._audio_float = None
+        self._audio_mono = None
+        resampled_cache.clear(self.yt_link)
     
     @property
     def sample_rate(self):
-        if (not self._audio_cache) or self._audio_cache[0] == None:
-            raise Exception("sample_rate not available")
-        return self._audio_cache[0]
+        if self._audio_cache and self._audio_cache[0] != None:
+            return self._audio_cache[0]
+        if self.audio_header:
+            return self.audio_header.sample_rate
+        raise Exception("sample_rate not available")
+
+    @property
+    def audio_header(self) -> PCMHeader | None:
+        """Header of the cached audio, readable without mapping the samples"""
+        if self._audio_header is None:
+            self._audio_header = self.__audio_cache_instance.header(self.yt_link)
+        return self._audio_header
         
         
     @property
@@ -58,132 +126,345 @@ class Song():
         if not self._spotify_cache:
             raise Exception("spotify metadata not available")
         return self._spotify_cache
+
+    @property
+    def metadata(self) -> Metadata:
+        if self._spotify_cache:
+            return self._spotify_cache.to_metadata()
+        return self.youtube_meta.to_metadata()
     
     def resampled(self, new_sample_rate, mono=False):
-        if mono:
-            audio = self.audio_mono
-        else:
-            audio = self.audio
-        if len(audio.shape) > 1:
-            return np.array([resample(channel, (len(channel)//self.sample_rate)*new_sample_rate) for channel in audio])
-        return resample(audio, (len(self.audio_mono)//self.sample_rate)*new_sample_rate)
+        def compute():
+            with metrics.span("resample", track=self.yt_link):
+                return resample(self.audio_mono if mono else self.audio, self.sample_rate, new_sample_rate)
+        return resampled_cache.get(self.yt_link, new_sample_rate, mono, compute)
     
     
-    def __init__(self, yt_url, spotify_url):
+    def __init__(self, yt_url, spotify_url, load_audio=True, yt_meta=None, spotify_meta=None):
         self.yt_link = yt_url
         self.spotify_link = spotify_url
+        # metadata the classmethods already fetched, kept per instance so concurrent loads don't mix
+        self._yt_cache = yt_meta
+        self._spotify_cache = spotify_meta
         
-        if not self._yt_cache:
-            if (cached := self.__yt_cache_instance.get(self.yt_link)):
-                self._yt_cache = cached
-            else:
-                self._yt_cache = self._download_yt_meta()
-                self.__yt_cache_instance.set(self.yt_link, self._yt_cache)
-        if not self._spotify_cache:
-            if (cached := self.__spotify_cache_instance.get(self.yt_link)):
-                self._spotify_cache = cached
-            else:
-                self._spotify_cache = self._download_spotify_meta()
-                self.__spotify_cache_instance.set(self.yt_link, self._spotify_cache)
+        with metrics.track(self.yt_link):
+            if not self._yt_cache:
+                with metrics.span("yt_meta"):
+                    # an expired stream url only matters once audio is downloaded, `_audio_url` renews it
+                    if (cached := self.__yt_cache_instance.get(self.yt_link, stale=True)):
+                        self._yt_cache = cached
+                    else:
+                        self._yt_cache = self._download_yt_meta()
+            if not self._spotify_cache:
+                with metrics.span("spotify_meta"):
+                    spotify_key = canonical_spotify_link(self.spotify_link)
+                    if (cached := self.__spotify_cache_instance.get(spotify_key)):
+                        self._spotify_cache = cached
+                    elif (cached := self.__spotify_cache_instance.get(self.yt_link)):
+                        # older caches stored it under the youtube link
+                        self._spotify_cache = cached
+                        self.__spotify_cache_instance.set(spotify_key, cached)
+                    else:
+                        self._spotify_cache = self._download_spotify_meta()
+                        self.__spotify_cache_instance.set(spotify_key, self._spotify_cache)
+            self.__alias_index_instance.register(self.yt_link, self.spotify_link)
+
+            if load_audio:
+                self.load_audio()
 
-        if not self._audio_cache:
-            if (cached := self.__audio_cache_instance.get(self.yt_link)):
-                self._audio_cache = cached
-            else:
-                self._audio_cache = self._download_audio()
-                self.__audio_cache_instance.set(self.yt_link, self._audio_cache)
+        logging.info(f"loaded {self._spotify_cache.name}")
 
-        logging.info(f"loaded {self._spotify_cache['name']}")
+    @property
+    def is_loaded(self) -> bool:
+        return self._audio_cache is not None
+
+    @property
+    def has_cached_audio(self) -> bool:
+        if self._audio_cache is not None or self.audio_header is not None:
+            return True
+        # legacy BZ2 files have no header, get_pcm migrates them
+        if (pcm := self.__audio_cache_instance.get_pcm(self.yt_link)) is None:
+            return False
+        self._audio_header = pcm[0]
+        return True
+
+    def load_audio(self):
+        if self._audio_cache:
+            return
+        with metrics.track(self.yt_link), metrics.span("load_audio"):
+            self._load_audio()
+
+    def _load_audio(self):
+        if (pcm := self.__audio_cache_instance.get_pcm(self.yt_link)) is None:
+            self.__audio_cache_instance.set(self.yt_link, self._download_audio())
+            # reopen from disk so the decoded array can be dropped in favour of the memmap
+            pcm = self.__audio_cache_instance.get_pcm(self.yt_link)
+        if pcm is None:
+            raise Exception(f"audio of {self.yt_link} could not be cached")
+        self._audio_header, samples = pcm
+        self._audio_cache = (self._audio_header.sample_rate, samples)
+        self._audio_scale = self._audio_header.scale if samples.dtype == np.int16 else 1.0
+        self.__alias_index_instance.register(self.yt_link, self.spotify_link, digest=self._audio_header.digest)
+
+    def cache_audio(self):
+        """Download the audio into the cache if it isn't there yet, without mapping it"""
+        if self.has_cached_audio:
+            return
+        with metrics.track(self.yt_link), metrics.span("cache_audio"):
+            self.__audio_cache_instance.set(self.yt_link, self._download_audio())
+
+    def stream_audio_blocks(self, block_frames: int = 65536) -> Iterator[npt.NDArray[np.float32]]:
+        """(channels, frames) float32 blocks as they're decoded from the download, cached once the last one is through"""
+        if self._audio_cache is None and self.has_cached_audio:
+            self.load_audio()
+        if self._audio_cache:
+            samples, scale = self.pcm
+            for start in range(0, samples.shape[-1], block_frames):
+                yield np.multiply(samples[:, start:start + block_frames], scale, dtype=np.float32)
+            return
+        with metrics.track(self.yt_link):
+            logging.info(f"Streaming {self._yt_cache.fulltitle}") # type: ignore
+            stream = DownloadTask(self._audio_url(), resume_key=self.yt_link).stream()
+            blocks = []
+            for block in decode_audio_blocks(stream, self.decode_sample_rate, self.decode_channels, block_frames):
+                blocks.append(block)
+                yield block
+            if not blocks:
+                raise Exception(f"audio of {self.yt_link} could not be cached")
+            audio = np.concatenate(blocks, axis=1)
+            blocks.clear()
+            self.__audio_cache_instance.set(self.yt_link, (self.decode_sample_rate, audio))
+        del audio
+        self._load_audio()
+
+    async def aload_audio(self):
+        if self._audio_cache:
+            return
+        with metrics.track(self.yt_link), metrics.span("load_audio"):
+            if not self.has_cached_audio:
+                data = await self.adownload_audio_bytes()
+                await run_blocking("cpu", type(self).decode_to_cache, self.yt_link, data)
+            self._load_audio()
+
+    @classmethod
+    def decode_to_cache(cls, key: str, data: bytes | bytearray):
+        """Decode downloaded bytes straight into the audio cache, cheap to run in a worker process"""
+        with metrics.track(key):
+            audio = decode_audio(data, cls.decode_sample_rate, cls.decode_channels)
+            cls.__audio_cache_instance.set(key, (cls.decode_sample_rate, audio))
 
     @staticmethod
     def _check_link_valid(url: str):
-        req = requests.head(url)
+        with metrics.span("validate_url"):
+            req = get_session().head(url, allow_redirects=True, timeout=30)
         return req.status_code < 400
             
     
     @classmethod
-    def find(cls, spotify_link = None, youtube_link = None, query = None):
+    def find(cls, spotify_link = None, youtube_link = None, query = None, load_audio = True):
         if spotify_link and youtube_link:
             logging.info("Loading custom song config")
-            return cls(spotify_link, youtube_link)
+            # another url of a video we already have keeps using the cached audio
+            record = cls.__alias_index_instance.lookup(youtube_link=youtube_link)
+            return cls(record.yt_link if record else youtube_link, spotify_link, load_audio)
         if spotify_link:
             logging.info("Loading from spotify")
-            return cls.from_spotify_link(spotify_link)
+            return cls.from_spotify_link(spotify_link, load_audio)
         if youtube_link:
             logging.info("Loading from youtube")
-            return cls.from_yt_link(youtube_link)
+            return cls.from_yt_link(youtube_link, load_audio)
         if query:
             logging.info(f"Searching {query}")
-            return cls.from_search(query)
+            return cls.from_search(query, load_audio)
     
     @classmethod
-    def from_spotify_link(cls, spotify_link: str):
-        if (_cache_spotify := cls.__spotify_cache_instance.get(spotify_link)):
-            cls._spotify_cache = _cache_spotify
-            return cls(_cache_spotify["download_url"], _cache_spotify["url"])
-
-        spotify_song = sp_client.search([spotify_link])[0]
-        yt_url = yt_client.search(spotify_song)
-        spotify_song.download_url = yt_url
-        cls._spotify_cache = spotify_song.json
-        cls.__spotify_cache_instance.set(spotify_song.url, spotify_song.json)
-        return cls(yt_url, spotify_song.url)
+    async def afind(cls, spotify_link = None, youtube_link = None, query = None, load_audio = True):
+        """`find` for asyncio: spotdl and yt-dlp run on the shared io executor, decoding on the cpu pool"""
+        song = await run_blocking("io", cls.find, spotify_link, youtube_link, query, False)
+        if song and load_audio:
+            await song.aload_audio()
+        return song
+
+    @classmethod
+    async def afrom_spotify_link(cls, spotify_link: str, load_audio=True):
+        song = await run_blocking("io", cls.from_spotify_link, spotify_link, False)
+        if load_audio:
+            await song.aload_audio()
+        return song
+
+    @classmethod
+    async def afrom_yt_link(cls, youtube_link: str, load_audio=True):
+        song = await run_blocking("io", cls.from_yt_link, youtube_link, False)
+        if load_audio:
+            await song.aload_audio()
+        return song
+
+    @classmethod
+    def from_spotify_link(cls, spotify_link: str, load_audio=True):
+        if (song := cls._from_alias(load_audio, spotify_link=spotify_link)):
+            return song
+        if (_cache_spotify := cls.__spotify_cache_instance.get(canonical_spotify_link(spotify_link))) and _cache_spotify.download_url:
+            return cls(_cache_spotify.download_url, _cache_spotify.url, load_audio, spotify_meta=_cache_spotify)
+
+        resolution = cls.__resolver_instance.resolve(cls._resolution_key(spotify_link), lambda: cls._search_spotify(spotify_link))
+        return cls._from_resolution(resolution, spotify_link, load_audio)
     
     @classmethod
-    def from_yt_link(cls, youtube_link: str):
-        if (_cache_yt := cls.__yt_cache_instance.get(youtube_link)):    
-            cls._yt_cache = _cache_yt
-            return cls(_cache_yt["url"], _cache_yt["CUSTOM__spotify_url"])
+    def from_yt_link(cls, youtube_link: str, load_audio=True):
+        if (song := cls._from_alias(load_audio, youtube_link=youtube_link)):
+            return song
+        if (yt_meta := cls.__yt_cache_instance.get(youtube_link, stale=True)) and yt_meta.spotify_url:
+            return cls(youtube_link, yt_meta.spotify_url, load_audio, yt_meta=yt_meta)
         
-        yt_song = dl_client.extract_info(youtube_link, download=False)
-        cls._yt_cache = yt_song
-        
-        if yt_song:
-            title = f"{yt_song.get('artist', '')} {yt_song.get('track', yt_song['fulltitle'])}"
-            spotify_song = sp_client.search([title])[0]
-            cls._spotify_cache = spotify_song.json
+        if not yt_meta:
+            yt_song = get_dl_client().extract_info(youtube_link, download=False)
+            if not yt_song:
+                raise Exception("this url is not valid")
+            yt_meta = YoutubeMeta.from_info(yt_song)
+            cls._store_yt_meta(youtube_link, yt_song, yt_meta)
+        title = f"{yt_meta.artist or ''} {yt_meta.track or yt_meta.fulltitle}"
+        resolution = cls.__resolver_instance.resolve(f"title:{normalize_query(title)}", lambda: cls._search_spotify(title, youtube_link))
+        song = cls._from_resolution(resolution, title, load_audio, youtube_link, yt_meta)
+        yt_meta.spotify_url = song.spotify_link
+        cls.__yt_cache_instance.set(youtube_link, yt_meta)
+        return song
+
+    @classmethod
+    def resolve_many(cls, searches: Iterable[str]) -> dict[str, Resolution]:
+        """Resolve spotify links and search queries at once, each distinct one searched at most once"""
+        keys = {search: cls._resolution_key(search) for search in searches if not cls.__alias_index_instance.lookup(spotify_link=search)}
+        resolved = cls.__resolver_instance.resolve_many({key: functools.partial(cls._search_spotify, search) for search, key in keys.items()})
+        return {search: resolved[key] for search, key in keys.items()}
+
+    @staticmethod
+    def _resolution_key(search: str) -> str:
+        if (track_id := spotify_track_id(search)):
+            return f"spotify:{track_id}"
+        return f"query:{normalize_query(search)}"
+
+    @classmethod
+    def _search_spotify(cls, search: str, youtube_link: str | None = None) -> Resolution:
+        """Search spotify, and youtube for its audio unless `youtube_link` already is"""
+        from spotdl.types.song import SongError
+        try:
+            spotify_song = get_sp_client().search([search])[0]
+        except (SongError, IndexError) as e:
+            return Resolution(error=str(e) or "no spotify match")
+        score = 1.0 if spotify_track_id(search) else match_score(search, f"{', '.join(spotify_song.artists)} {spotify_song.name}")
+        if youtube_link is None:
+            try:
+                youtube_link = get_yt_client().search(spotify_song)
+            except LookupError as e:
+                return Resolution(error=str(e))
+            if not youtube_link:
+                return Resolution(error="no youtube match")
             spotify_song.download_url = youtube_link
-            yt_song["CUSTOM__spotify_url"] = spotify_song.url
-            cls.__spotify_cache_instance.set(spotify_song.url, spotify_song.json)
-            cls.__yt_cache_instance.set(youtube_link, yt_song)
-            return cls(youtube_link, spotify_song.url)
-        raise Exception("this url is not valid")
+            spotify_meta = cls._store_spotify_meta(spotify_song.json)
+            cls.__alias_index_instance.register(youtube_link, spotify_meta.url)
+            return Resolution(spotify_meta.song_id, youtube_video_id(youtube_link), score)
+        spotify_song.download_url = youtube_link
+        spotify_meta = cls._store_spotify_meta(spotify_song.json)
+        return Resolution(spotify_meta.song_id, score=score)
+
+    @classmethod
+    def _from_resolution(cls, resolution: Resolution, search: str, load_audio: bool, youtube_link: str | None = None, yt_meta: YoutubeMeta | None = None):
+        if not resolution.found:
+            raise Exception(f"nothing found for {search}: {resolution.error}")
+        spotify_link = spotify_url(resolution.spotify_id) # type: ignore
+        if youtube_link is None:
+            if (song := cls._from_alias(load_audio, spotify_link=spotify_link)):
+                return song
+            youtube_link = youtube_url(resolution.youtube_id) # type: ignore
+        return cls(youtube_link, spotify_link, load_audio, yt_meta=yt_meta)
+
+    @classmethod
+    def _from_alias(cls, load_audio: bool, spotify_link=None, youtube_link=None):
+        """The song either link already resolved to, without a search"""
+        record = cls.__alias_index_instance.lookup(spotify_link, youtube_link)
+        if record and record.spotify_link:
+            logging.debug(f"alias hit {record.youtube_id}")
+            return cls(record.yt_link, record.spotify_link, load_audio)
+        return None
+
+    @classmethod
+    def from_cache(cls, youtube_link: str):
+        """A song whose audio is already cached, built from cached metadata only, never touches the network"""
+        song = cls.__new__(cls)
+        song.yt_link = youtube_link
+        if not song.has_cached_audio:
+            raise Exception(f"audio of {youtube_link} is not cached")
+        song._yt_cache = cls.__yt_cache_instance.get(youtube_link, stale=True)
+        song.spotify_link = song._yt_cache.spotify_url if song._yt_cache else None # type: ignore
+        song._spotify_cache = (song.spotify_link and cls.__spotify_cache_instance.get(canonical_spotify_link(song.spotify_link))) or cls.__spotify_cache_instance.get(youtube_link)
+        return song
+
+    @classmethod
+    def _store_spotify_meta(cls, info: dict[str, Any]) -> SpotifyMeta:
+        spotify_meta = SpotifyMeta.from_info(info)
+        cls.__spotify_cache_instance.set(spotify_meta.url, spotify_meta)
+        if cls.keep_raw_meta:
+            cls.__spotify_raw_cache_instance.set(spotify_meta.url, info)
+        return spotify_meta
+
+    @classmethod
+    def _store_yt_meta(cls, youtube_link: str, info: dict[str, Any], yt_meta: YoutubeMeta):
+        cls.__yt_cache_instance.set(youtube_link, yt_meta)
+        if cls.keep_raw_meta:
+            cls.__yt_raw_cache_instance.set(youtube_link, info)
     
     @classmethod
-    def from_search(cls, query: str):
-        return cls.from_spotify_link(query) # dirty way to search for song
+    def from_search(cls, query: str, load_audio=True):
+        return cls.from_spotify_link(query, load_audio) # dirty way to search for song, resolved once per distinct query
     
-    def _download_audio(self) -> tuple[int, npt.NDArray]:
+    def _audio_url(self) -> str:
         if not self._yt_cache:
             raise Exception("youtube cache not initialized")
                     
-        audio_url = self._yt_cache["url"]
-        if not self._check_link_valid(audio_url):
+        audio_url = self._yt_cache.url
+        expires = stream_url_expires(audio_url)
+        # only urls that don't say when they expire need a HEAD request to find out
+        if (expires is not None and expires < time.time()) or (expires is None and not self._check_link_valid(audio_url)):
             self._yt_cache = self._download_yt_meta()
-            self.__yt_cache_instance.set(self.yt_link, self._yt_cache)
-            audio_url = self._yt_cache["url"]
-        
-        logging.info(f"Downloading {self._yt_cache['fulltitle']}")
-        buffer = DownloadTask(audio_url).start()
-        logging.info(f"Downloaded {self._yt_cache['fulltitle']}")
+            audio_url = self._yt_cache.url
+        return audio_url
+
+    def download_audio_bytes(self) -> bytearray:
+        """Only the network half of `_download_audio`, the encoded stream as served"""
+        audio_url = self._audio_url()
+        logging.info(f"Downloading {self._yt_cache.fulltitle}") # type: ignore
+        return DownloadTask(audio_url, resume_key=self.yt_link).start()
+
+    async def adownload_audio_bytes(self) -> bytearray:
+        audio_url = await run_blocking("io", self._audio_url)
+        logging.info(f"Downloading {self._yt_cache.fulltitle}") # type: ignore
+        return await AsyncDownloadTask(audio_url, resume_key=self.yt_link).start()
+
+    def _download_audio(self) -> tuple[int, npt.NDArray]:
+        audio_url = self._audio_url()
+        assert self._yt_cache
         
-        logging.info(f"Converting {self._yt_cache['fulltitle']}")
-        buffer = convert_opus_to_wav(buffer)
-        logging.info(f"Converted {self._yt_cache['fulltitle']}")
-        y, sr = soundfile.read(BytesIO(buffer))
-        return (sr, np.transpose(y))
-    
-    def _download_spotify_meta(self) -> dict[str, Any]:
-        spotify_song = sp_client.search([self.spotify_link])[0]
-        return spotify_song.json
-    
-    def _download_yt_meta(self) -> dict[str, Any]:
-        yt_song = dl_client.extract_info(self.yt_link, download=False)
+        logging.info(f"Downloading and decoding {self._yt_cache.fulltitle}")
+        # ffmpeg starts decoding as soon as the first bytes are in
+        stream = DownloadTask(audio_url, resume_key=self.yt_link).stream()
+        audio = decode_audio(stream, self.decode_sample_rate, self.decode_channels)
+        logging.info(f"Decoded {self._yt_cache.fulltitle}")
+        return (self.decode_sample_rate, audio)
+    
+    def _download_spotify_meta(self) -> SpotifyMeta:
+        spotify_song = get_sp_client().search([self.spotify_link])[0]
+        return SpotifyMeta.from_info(spotify_song.json)
+    
+    def _download_yt_meta(self) -> YoutubeMeta:
+        yt_song = get_dl_client().extract_info(self.yt_link, download=False)
         if yt_song:
-            return yt_song
+            yt_meta = YoutubeMeta.from_info(yt_song)
+            yt_meta.spotify_url = self.spotify_link
+            self._store_yt_meta(self.yt_link, yt_song, yt_meta)
+            return yt_meta
         raise Exception("this url is not valid")
     
-    # def analyze(self) -> AnalyzedTrack:
-    #     return AnalyzedTrack() 
+    def analyze(self) -> AnalyzedTrack:
+        from openmxr.analyze.engine import get_engine
+        return get_engine().analyze(self)
     
 # logging.basicConfig(level=logging.INFO)
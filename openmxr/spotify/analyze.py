@@ -1,7 +1,11 @@
 from dataclasses import dataclass
-from typing import Any
-from spotdl.utils.spotify import SpotifyClient
+from functools import cached_property
+import json
+from typing import IO, Any
+import numpy as np
+import numpy.typing as npt
 from openmxr.cache import Cache
+from openmxr.clients import get_spotify_api
 
 from openmxr.song import Song
 
@@ -79,49 +83,146 @@ class Tatum(BaseSection):
     pass
 
 
+BASE_FIELDS = [("start", "f8"), ("duration", "f8"), ("confidence", "f4")]
+BAR_DTYPE = BEAT_DTYPE = TATUM_DTYPE = np.dtype(BASE_FIELDS)
+SECTION_DTYPE = np.dtype(BASE_FIELDS + [
+    ("loudness", "f4"), ("tempo", "f4"), ("tempo_confidence", "f4"),
+    ("key", "i1"), ("key_confidence", "f4"), ("mode", "i1"), ("mode_confidence", "f4"),
+    ("time_signature", "f4"), ("time_signature_confidence", "f4"),
+])
+SEGMENT_DTYPE = np.dtype(BASE_FIELDS + [
+    ("loudness_start", "f4"), ("loudness_max", "f4"), ("loudness_max_time", "f4"), ("loudness_end", "f4"),
+    ("pitches", "f4", (12,)), ("timbre", "f4", (12,)),
+])
+COLUMN_DTYPES = {"bars": BAR_DTYPE, "beats": BEAT_DTYPE, "sections": SECTION_DTYPE, "segments": SEGMENT_DTYPE, "tatums": TATUM_DTYPE}
+
+
+@dataclass
+class AnalysisColumns:
+    """An audio analysis parsed once into structured arrays, one row per item"""
+    track: dict[str, Any]
+    bars: npt.NDArray
+    beats: npt.NDArray
+    sections: npt.NDArray
+    segments: npt.NDArray
+    tatums: npt.NDArray
+
+    @classmethod
+    def from_raw(cls, analysis: dict[str, Any]) -> "AnalysisColumns":
+        columns = {}
+        for name, dtype in COLUMN_DTYPES.items():
+            items = analysis.get(name) or []
+            columns[name] = np.array([tuple(item.get(field, 0) for field in dtype.names or ()) for item in items], dtype=dtype)
+        return cls(track=analysis["track"], **columns)
+
+    def to_npz(self, file: IO[bytes]):
+        track = np.frombuffer(json.dumps(self.track).encode(), dtype=np.uint8)
+        np.savez(file, track=track, **{name: getattr(self, name) for name in COLUMN_DTYPES})
+
+    @classmethod
+    def from_npz(cls, file: IO[bytes]) -> "AnalysisColumns":
+        with np.load(file) as arrays:
+            return cls(track=json.loads(arrays["track"].tobytes()), **{name: arrays[name] for name in COLUMN_DTYPES})
+
+
+class SpotifyAnalysisCache(Cache):
+    """Analyses in npz form, entries still cached as JSON get converted when read"""
+    binary_format = True
+
+    def load(self, file: IO[Any]):
+        if file.read(1) == b"{":
+            file.seek(0)
+            return AnalysisColumns.from_raw(json.load(file))
+        file.seek(0)
+        return AnalysisColumns.from_npz(file)
+
+    def dump(self, data, file):
+        data.to_npz(file)
+
+    def _decode_entry(self, key, raw: bytes) -> Any | None:
+        data = super()._decode_entry(key, raw)
+        if data is not None and raw.startswith(b"{"):
+            self.backend.set(key, self.encode(data), self.expires_at(data))
+        return data
+
+
+def nearest_start(items: npt.NDArray, times: npt.ArrayLike) -> npt.NDArray[np.intp]:
+    """Index of the item starting closest to each time, `items` sorted by start, rows with a start or the starts themselves"""
+    starts = items["start"] if items.dtype.names else items
+    times = np.asarray(times, dtype=np.float64)
+    if len(starts) < 2:
+        return np.zeros(times.shape, dtype=np.intp)
+    right = np.clip(np.searchsorted(starts, times), 1, len(starts) - 1)
+    left = right - 1
+    return np.where(np.abs(times - starts[left]) <= np.abs(starts[right] - times), left, right)
+
+
 class SpotifyAnalysis:
-    spotify_api = SpotifyClient()
     track: Song
     track_id: str
-    cache = Cache("spotify_analysis")
-    __audio_analysis: dict[str, Any]
+    cache = SpotifyAnalysisCache("spotify_analysis")
+    columns: AnalysisColumns
 
     def __init__(self, track: Song):
-        self.cache.check_cache_exists()
         self.track = track
         if not track.spotify_meta:
             raise Exception("No spotify meta found")
-        self.track_id = track.spotify_meta["song_id"]
+        self.track_id = track.spotify_meta.song_id
 
         if (data := self.cache.get(self.track_id)):
-            self.__audio_analysis = data
+            self.columns = data
         else:
-            self.__audio_analysis = self.spotify_api.audio_analysis(self.track_id)
-            self.cache.set(self.track_id, self.__audio_analysis)
+            self.columns = AnalysisColumns.from_raw(get_spotify_api().audio_analysis(self.track_id))
+            self.cache.set(self.track_id, self.columns)
     
+    @classmethod
+    def cached(cls, track: Song) -> AnalysisColumns | None:
+        """The parsed analysis if it's already cached, never calls the API"""
+        if not track._spotify_cache:
+            return None
+        return cls.cache.get(track._spotify_cache.song_id)
+
     @property
     def info(self):
-        return TrackAnalysisMeta(**self.__audio_analysis["track"])
+        return TrackAnalysisMeta(**self.columns.track)
 
-    @property
+    @cached_property
     def bars(self):
-        return [Bar(**item) for item in self.__audio_analysis["bars"]]
+        return [Bar(*item) for item in self.columns.bars.tolist()]
     
-    @property
+    @cached_property
     def beats(self):
-        return [Beat(**item) for item in self.__audio_analysis["beats"]]
+        return [Beat(*item) for item in self.columns.beats.tolist()]
     
-    @property
+    @cached_property
     def sections(self):
-        return [Section(**item) for item in self.__audio_analysis["sections"]]
+        return [Section(*item) for item in self.columns.sections.tolist()]
     
-    @property
+    @cached_property
     def segments(self):
-        return [Segment(**item) for item in self.__audio_analysis["segments"]]
+        # pitches and timbre come out of tolist() as arrays
+        return [Segment(*(field.tolist() if isinstance(field, np.ndarray) else field for field in item))
+                for item in self.columns.segments.tolist()]
     
-    @property
+    @cached_property
     def tatums(self):
-        return [Tatum(**item) for item in self.__audio_analysis["tatums"]]
+        return [Tatum(*item) for item in self.columns.tatums.tolist()]
+
+    def loudest_section(self) -> Section:
+        return self.sections[int(np.argmax(self.columns.sections["loudness"]))]
+
+    def beats_between(self, start: float, end: float) -> npt.NDArray:
+        """Rows of the beats starting in [start, end) seconds"""
+        starts = self.columns.beats["start"]
+        return self.columns.beats[np.searchsorted(starts, start):np.searchsorted(starts, end)]
+
+    def nearest_bar(self, samples: npt.ArrayLike, sample_rate: int) -> npt.NDArray[np.int64]:
+        """Start sample of the bar closest to each sample position, left as they are when there are no bars"""
+        bars = self.columns.bars
+        if not len(bars):
+            return np.round(np.asarray(samples, dtype=np.float64)).astype(np.int64)
+        indices = nearest_start(bars, np.asarray(samples, dtype=np.float64) / sample_rate)
+        return np.round(bars["start"][indices] * sample_rate).astype(np.int64)
 
 def get_loudest(items: list[Section]):
-    return sorted(items, key=lambda x:x.loudness, reverse=True)[0]
+    return max(items, key=lambda x:x.loudness)
@@ -0,0 +1,7 @@
+import os
+import threading
+
+
+def unique_tmp_filename(filename: str) -> str:
+    """A name next to `filename` that no other process or thread writes to, for swapping it in with os.replace"""
+    return f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
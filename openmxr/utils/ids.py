@@ -0,0 +1,59 @@
+import re
+from urllib.parse import parse_qs, urlparse
+
+SPOTIFY_ID = re.compile(r"[0-9A-Za-z]{22}")
+YOUTUBE_ID = re.compile(r"[0-9A-Za-z_-]{11}")
+
+
+def spotify_track_id(link: str) -> str | None:
+    """The track id of an open.spotify.com url (share parameters and all), a spotify:track: uri or a bare id"""
+    link = link.strip()
+    if link.startswith("spotify:track:"):
+        candidate = link.rsplit(":", 1)[1]
+    elif SPOTIFY_ID.fullmatch(link):
+        candidate = link
+    else:
+        parsed = urlparse(link)
+        if not parsed.netloc.endswith("spotify.com"):
+            return None
+        segments = [segment for segment in parsed.path.split("/") if segment]
+        # /track/<id>, also with a locale in front like /intl-de/track/<id>
+        if "track" not in segments or segments.index("track") + 1 >= len(segments):
+            return None
+        candidate = segments[segments.index("track") + 1]
+    return candidate if SPOTIFY_ID.fullmatch(candidate) else None
+
+
+def youtube_video_id(link: str) -> str | None:
+    """The video id of a youtube, youtube music or youtu.be url, or a bare id"""
+    link = link.strip()
+    if YOUTUBE_ID.fullmatch(link):
+        return link
+    parsed = urlparse(link if "//" in link else f"//{link}")
+    host = parsed.netloc.lower().removeprefix("www.").removeprefix("m.")
+    if host == "youtu.be":
+        candidate = parsed.path.strip("/").split("/")[0]
+    elif host.endswith("youtube.com") or host.endswith("youtube-nocookie.com"):
+        segments = [segment for segment in parsed.path.split("/") if segment]
+        if segments[:1] == ["watch"]:
+            candidate = (parse_qs(parsed.query).get("v") or [""])[0]
+        elif len(segments) >= 2 and segments[0] in ("shorts", "embed", "v", "live"):
+            candidate = segments[1]
+        else:
+            return None
+    else:
+        return None
+    return candidate if YOUTUBE_ID.fullmatch(candidate) else None
+
+
+def spotify_url(track_id: str) -> str:
+    return f"https://open.spotify.com/track/{track_id}"
+
+
+def youtube_url(video_id: str) -> str:
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def normalize_query(query: str) -> str:
+    """Searches that only differ in case or spacing are the same search"""
+    return " ".join(query.casefold().split())
@@ -0,0 +1,48 @@
+import json
+import subprocess
+import sys
+
+# modules that cost seconds to import or need credentials, only code paths that use them may import them
+HEAVY_MODULES = ("librosa", "madmom", "scipy", "spotdl", "yt_dlp", "soundfile", "pychorus")
+
+# seconds each entry point may take to import in a fresh interpreter
+IMPORT_BUDGETS = {
+    "openmxr": 0.2,
+    "openmxr.cache": 0.5,
+    "openmxr.models.Metadata": 0.2,
+    "openmxr.spotify.analyze": 1.0,
+    "openmxr.song": 1.0,
+}
+
+
+def measure_import(module: str) -> tuple[float, list[str]]:
+    """Import `module` in a fresh interpreter, returns the seconds it took and the heavy modules it pulled in"""
+    code = (
+        "import sys, time, json\n"
+        "started = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - started\n"
+        f"heavy = sorted(name for name in {HEAVY_MODULES!r} if name in sys.modules)\n"
+        "print(json.dumps([elapsed, heavy]))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    elapsed, heavy = json.loads(output.strip().splitlines()[-1])
+    return elapsed, heavy
+
+
+def check_import_budgets(budgets: dict[str, float] = IMPORT_BUDGETS) -> list[str]:
+    """Every module over its budget or importing a heavy dependency, empty when all is well"""
+    problems = []
+    for module, budget in budgets.items():
+        elapsed, heavy = measure_import(module)
+        if elapsed > budget:
+            problems.append(f"{module} took {elapsed:.2f}s to import, budget is {budget:.2f}s")
+        if heavy:
+            problems.append(f"{module} imports {', '.join(heavy)}")
+    return problems
+
+
+if __name__ == "__main__":
+    problems = check_import_budgets()
+    print("\n".join(problems) or "all imports within budget")
+    sys.exit(1 if problems else 0)
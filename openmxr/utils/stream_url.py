@@ -0,0 +1,19 @@
+from urllib.parse import parse_qs, urlparse
+
+# don't hand out urls that would expire in the middle of a download
+EXPIRY_MARGIN = 600
+
+
+def stream_url_expires(url: str) -> float | None:
+    """Unix time a googlevideo stream url stops working, from its `expire=` parameter"""
+    parsed = urlparse(url)
+    expire = parse_qs(parsed.query).get("expire")
+    if not expire:
+        # some urls carry their parameters as /key/value path segments instead
+        segments = parsed.path.split("/")
+        if "expire" in segments and segments.index("expire") + 1 < len(segments):
+            expire = [segments[segments.index("expire") + 1]]
+    try:
+        return float(expire[0]) - EXPIRY_MARGIN if expire else None
+    except ValueError:
+        return None
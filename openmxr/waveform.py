@@ -0,0 +1,138 @@
+"""Min/max/RMS overviews of cached audio, to draw and zoom a track without reading its samples."""
+from dataclasses import dataclass
+import math
+import os
+import struct
+import numpy as np
+import numpy.typing as npt
+
+from openmxr.utils.files import unique_tmp_filename
+
+WAVEFORM_MAGIC = b"OMXRPEAK"
+WAVEFORM_VERSION = 1
+# magic, version, sample rate, frames, frames per bin of the finest level, levels
+WAVEFORM_HEADER = struct.Struct("<8sHIQII")
+WAVEFORM_HEADER_SIZE = 32
+# frames per bin of the finest level, every level above it has half as many bins
+BASE_BIN_FRAMES = 256
+# min, max and rms are stored as int16 of full scale
+PEAK_SCALE = 32767
+# bins summarized at once while building, bounds the float copy of the samples
+BUILD_BLOCK_BINS = 4096
+
+
+def _bin_stats(samples: npt.NDArray, bin_frames: int, scale: float) -> npt.NDArray[np.float32]:
+    """(bins, 3) min, max and rms over all channels, the last bin may be short"""
+    channels, frames = samples.shape
+    full = frames // bin_frames * bin_frames
+    parts = [samples[:, :full].reshape(channels, -1, bin_frames)]
+    if full < frames:
+        parts.append(samples[:, None, full:])
+    stats = []
+    for part in parts:
+        values = np.multiply(part, scale, dtype=np.float32)
+        stats.append(np.stack([values.min(axis=(0, 2)), values.max(axis=(0, 2)),
+                               np.sqrt(np.mean(np.square(values), axis=(0, 2)))], axis=1))
+    return np.concatenate(stats)
+
+
+def _coarsen(level: npt.NDArray[np.int16]) -> npt.NDArray[np.int16]:
+    bins = level.astype(np.float32)
+    if len(bins) % 2:
+        bins = np.concatenate([bins, bins[-1:]])
+    pairs = bins.reshape(-1, 2, 3)
+    coarse = np.stack([pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1),
+                       np.sqrt(np.mean(np.square(pairs[:, :, 2]), axis=1))], axis=1)
+    return np.round(coarse).astype(np.int16)
+
+
+@dataclass
+class WaveformPyramid:
+    """Peaks of a track at power of two decimations of `bin_frames`.
+
+    Level k has one (min, max, rms) row per `bin_frames << k` frames. A
+    query picks the level with about one bin per pixel, so drawing costs
+    the same whatever the zoom.
+    """
+    sample_rate: int
+    frames: int
+    bin_frames: int
+    levels: list[npt.NDArray[np.int16]]
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.sample_rate
+
+    @classmethod
+    def build(cls, samples: npt.NDArray, sample_rate: int, scale: float = 1.0, bin_frames: int = BASE_BIN_FRAMES) -> "WaveformPyramid":
+        """One pass over (channels, frames) samples, `scale` converts them to float"""
+        samples = np.atleast_2d(samples)
+        frames = samples.shape[1]
+        base = np.zeros((max(-(-frames // bin_frames), 1), 3), dtype=np.int16)
+        block = BUILD_BLOCK_BINS * bin_frames
+        for first in range(0, frames, block):
+            stats = _bin_stats(samples[:, first:first + block], bin_frames, scale)
+            np.clip(np.round(stats * PEAK_SCALE), -PEAK_SCALE, PEAK_SCALE, out=stats)
+            base[first // bin_frames:first // bin_frames + len(stats)] = stats
+        levels = [base]
+        while len(levels[-1]) > 1:
+            levels.append(_coarsen(levels[-1]))
+        return cls(int(sample_rate), frames, bin_frames, levels)
+
+    def query(self, start: float = 0.0, end: float | None = None, width: int = 1000) -> npt.NDArray[np.float32]:
+        """(width, 3) min, max and rms between two times in seconds, one row per pixel"""
+        peaks = np.zeros((max(width, 0), 3), dtype=np.float32)
+        first = max(int(start * self.sample_rate), 0)
+        last = self.frames if end is None else min(int(math.ceil(end * self.sample_rate)), self.frames)
+        if width <= 0 or last <= first:
+            return peaks
+        frames_per_pixel = (last - first) / width
+        level = min(max(int(math.log2(frames_per_pixel / self.bin_frames)), 0), len(self.levels) - 1) if frames_per_pixel >= self.bin_frames else 0
+        bins = self.levels[level]
+        bin_frames = self.bin_frames << level
+        edges = first + np.arange(width + 1) * frames_per_pixel
+        starts = np.minimum(edges[:-1] // bin_frames, len(bins) - 1).astype(np.intp)
+        # a bin straddling two pixels counts towards both, so no peak falls between them
+        ends = np.minimum(np.maximum(np.ceil(edges[1:] / bin_frames).astype(np.intp), starts + 1), len(bins))
+        # only the bins under the requested range are read, about one or two per pixel
+        window = bins[starts[0]:ends[-1]].astype(np.float32)
+        ends -= starts[0]
+        starts -= starts[0]
+        counts = np.diff(np.append(starts, len(window)))
+        # a pixel narrower than a bin reads that one bin
+        counts[counts <= 0] = 1
+        peaks[:, 0] = np.minimum(np.minimum.reduceat(window[:, 0], starts), window[ends - 1, 0])
+        peaks[:, 1] = np.maximum(np.maximum.reduceat(window[:, 1], starts), window[ends - 1, 1])
+        peaks[:, 2] = np.sqrt(np.add.reduceat(np.square(window[:, 2]), starts) / counts)
+        peaks /= PEAK_SCALE
+        return peaks
+
+    def write(self, filename: str):
+        tmp_filename = unique_tmp_filename(filename)
+        with open(tmp_filename, "wb") as file:
+            file.write(WAVEFORM_HEADER.pack(WAVEFORM_MAGIC, WAVEFORM_VERSION, self.sample_rate, self.frames,
+                                            self.bin_frames, len(self.levels)).ljust(WAVEFORM_HEADER_SIZE, b"\0"))
+            for level in self.levels:
+                file.write(level.astype("<i2").tobytes())
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def read(cls, filename: str) -> "WaveformPyramid":
+        """Maps the file, only the rows a query touches are ever read"""
+        with open(filename, "rb") as file:
+            raw = file.read(WAVEFORM_HEADER_SIZE)
+        if len(raw) < WAVEFORM_HEADER_SIZE:
+            raise ValueError("truncated waveform header")
+        magic, version, sample_rate, frames, bin_frames, count = WAVEFORM_HEADER.unpack_from(raw)
+        if magic != WAVEFORM_MAGIC or version != WAVEFORM_VERSION:
+            raise ValueError("not a waveform file")
+        data = np.memmap(filename, dtype="<i2", mode="r", offset=WAVEFORM_HEADER_SIZE)
+        levels = []
+        bins, offset = max(-(-frames // bin_frames), 1), 0
+        for _ in range(count):
+            levels.append(data[offset:offset + bins * 3].reshape(bins, 3))
+            offset += bins * 3
+            bins = -(-bins // 2)
+        if offset != len(data):
+            raise ValueError("waveform file doesn't match its header")
+        return cls(sample_rate, frames, bin_frames, levels)
@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Run in an empty directory, the caches and partial downloads live under the relative ./.cache"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
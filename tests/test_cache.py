@@ -0,0 +1,121 @@
+import bz2
+import io
+import json
+import os
+import time
+import numpy as np
+import pytest
+
+from openmxr.cache import AudioCache, Cache, PCMHeader, StreamMetaCache
+from openmxr.cache_backends import FileBackend
+from openmxr.models.YoutubeMeta import YoutubeMeta
+from openmxr.utils.stream_url import EXPIRY_MARGIN, stream_url_expires
+
+
+def tone(frames: int = 48000) -> np.ndarray:
+    t = np.arange(frames) / 48000
+    return np.stack([np.sin(2 * np.pi * 440 * t), 0.5 * np.cos(2 * np.pi * 220 * t)]).astype(np.float32)
+
+
+def test_pcm_header_round_trip():
+    # the scale is stored as float32, pick one it holds exactly
+    header = PCMHeader(np.dtype("<i2"), 2, 44100, 12345, 0.5, "ab" * 16)
+    file = io.BytesIO()
+    header.write(file)
+    assert len(file.getvalue()) == 64
+    file.seek(0)
+    assert PCMHeader.read(file) == header
+
+
+def test_pcm_header_rejects_other_files():
+    with pytest.raises(ValueError):
+        PCMHeader.read(io.BytesIO(b"RIFF" + bytes(60)))
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int16"])
+def test_audio_cache_round_trip(cache_dir, dtype):
+    cache = AudioCache("audio", dtype=dtype)
+    audio = tone()
+    cache.set("track", (48000, audio))
+    header, samples = cache.get_pcm("track")
+    assert (header.channels, header.sample_rate, header.frames) == (2, 48000, audio.shape[1])
+    assert samples.dtype == np.dtype(dtype) and isinstance(samples, np.memmap)
+    assert cache.header("track") == header
+    sample_rate, loaded = cache.get("track")
+    assert sample_rate == 48000 and loaded.dtype == np.float32
+    np.testing.assert_allclose(loaded, audio, atol=0 if dtype == "float32" else 1 / 32767)
+
+
+def test_audio_cache_delete_removes_waveform(cache_dir):
+    cache = AudioCache("audio")
+    cache.set("track", (48000, tone()))
+    assert cache.waveform("track") is not None
+    cache.delete("track")
+    assert os.listdir(cache_dir / ".cache" / "audio") == []
+
+
+def test_bz2_audio_migration(cache_dir):
+    sf = pytest.importorskip("soundfile")
+    cache = AudioCache("audio")
+    audio = tone()
+    wav = io.BytesIO()
+    sf.write(wav, audio.T, 48000, format="WAV", subtype="FLOAT")
+    os.makedirs(cache_dir / ".cache" / "audio")
+    legacy_filename = cache.legacy.get_cache_filename("track")
+    with open(legacy_filename, "wb") as file:
+        file.write(bz2.compress(wav.getvalue()))
+
+    assert cache.header("track") is None
+    assert cache.header("track", migrate=True) is not None
+    assert not os.path.exists(legacy_filename)
+    sample_rate, loaded = cache.get("track")
+    assert sample_rate == 48000
+    np.testing.assert_array_equal(loaded, audio)
+
+
+def test_broken_bz2_audio_is_dropped(cache_dir):
+    cache = AudioCache("audio")
+    os.makedirs(cache_dir / ".cache" / "audio")
+    legacy_filename = cache.legacy.get_cache_filename("track")
+    with open(legacy_filename, "wb") as file:
+        file.write(b"not bz2")
+    assert cache.get_pcm("track") is None
+    assert not os.path.exists(legacy_filename)
+
+
+def test_json_files_migrate_to_sqlite(cache_dir):
+    FileBackend(".cache/spotify_raw").set("track", json.dumps({"name": "Song"}).encode())
+    cache = Cache("spotify_raw")
+    assert cache.get("track") == {"name": "Song"}
+    assert os.listdir(cache_dir / ".cache" / "spotify_raw") == []
+    assert cache.backend.get("track") is not None
+
+
+def test_full_info_dicts_are_compacted(cache_dir):
+    info = {"id": "abc", "url": "https://example.com/videoplayback", "fulltitle": "Title", "formats": [{}] * 50}
+    FileBackend(".cache/yt").set("track", json.dumps(info).encode())
+    cache = StreamMetaCache("yt", YoutubeMeta)
+    assert cache.get("track") == YoutubeMeta("abc", "https://example.com/videoplayback", "Title")
+    assert json.loads(cache.backend.get("track"))["v"] == YoutubeMeta.VERSION
+
+
+@pytest.mark.parametrize("url", [
+    "https://r1.googlevideo.com/videoplayback?expire=1700000000&id=1",
+    "https://r1.googlevideo.com/videoplayback/id/1/expire/1700000000/sig/x",
+])
+def test_stream_url_expires(url):
+    assert stream_url_expires(url) == 1700000000 - EXPIRY_MARGIN
+
+
+def test_stream_meta_expires_with_its_url(cache_dir):
+    cache = StreamMetaCache("yt", YoutubeMeta)
+    fresh = YoutubeMeta("a", f"https://x/videoplayback?expire={int(time.time()) + 3600}", "A")
+    # inside the margin, it would run out during a download
+    expiring = YoutubeMeta("b", f"https://x/videoplayback?expire={int(time.time()) + EXPIRY_MARGIN // 2}", "B")
+    cache.set("a", fresh)
+    cache.set("b", expiring)
+    assert cache.get("a") == fresh
+    assert cache.get("b") is None
+    assert cache.get("b", stale=True) == expiring
+    assert cache.prune() == 1
+    assert cache.get("b", stale=True) is None
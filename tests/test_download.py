@@ -0,0 +1,56 @@
+import os
+import pytest
+
+from benchmarks.server import RangeServer
+from openmxr.downloader.DownloadTask import PARTIAL_DIR, DownloadTask
+
+SIZE = 3 * 1024 * 1024
+
+
+class CountingServer(RangeServer):
+    """Counts the bytes asked for, to tell a resumed download from a fresh one"""
+    sent = 0
+
+    def _send(self, file, start: int, end: int):
+        self.sent += end + 1 - start
+        super()._send(file, start, end)
+
+
+@pytest.fixture
+def data() -> bytes:
+    return os.urandom(SIZE)
+
+
+def test_ranged_download(cache_dir, data):
+    with CountingServer(data) as server:
+        assert bytes(DownloadTask(server.url, chunk_size=256 * 1024, max_workers=4).start()) == data
+        assert server.requests > 1
+
+
+def test_stream_yields_the_file_in_order(cache_dir, data):
+    with RangeServer(data) as server:
+        assert b"".join(bytes(part) for part in DownloadTask(server.url, chunk_size=256 * 1024, max_workers=4).stream()) == data
+
+
+def test_resume_after_interruption(cache_dir, data, monkeypatch):
+    download_range = DownloadTask.download_range
+
+    def interrupted(self, url, start, end):
+        if start >= SIZE // 2:
+            raise Exception("connection lost")
+        return download_range(self, url, start, end)
+
+    # fixed size ranges, so the first half is done when it's interrupted
+    monkeypatch.setattr(DownloadTask, "max_chunk_size", 256 * 1024)
+    with CountingServer(data) as server:
+        monkeypatch.setattr(DownloadTask, "download_range", interrupted)
+        with pytest.raises(Exception, match="connection lost"):
+            DownloadTask(server.url, chunk_size=256 * 1024, max_workers=1, resume_key="track").start()
+        assert len(os.listdir(PARTIAL_DIR)) == 2
+
+        monkeypatch.setattr(DownloadTask, "download_range", download_range)
+        server.sent = 0
+        assert bytes(DownloadTask(server.url, chunk_size=256 * 1024, max_workers=1, resume_key="track").start()) == data
+        # only what the first attempt didn't get is fetched again
+        assert server.sent <= SIZE - SIZE // 2
+        assert os.listdir(PARTIAL_DIR) == []
@@ -0,0 +1,12 @@
+import os
+from os import path
+
+from openmxr.utils.importtime import check_import_budgets
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def test_import_budgets(monkeypatch):
+    # every entry point is imported in its own fresh interpreter, which has to find the package from anywhere
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    assert check_import_budgets() == []
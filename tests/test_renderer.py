@@ -0,0 +1,25 @@
+import numpy as np
+
+from openmxr.mix.renderer import MixRenderer, _Voice
+
+
+def gains(voice: _Voice, begin: int, n: int) -> np.ndarray:
+    out = np.empty(n, dtype=np.float32)
+    MixRenderer._gains(voice, begin, n, out, np.arange(n, dtype=np.float64))
+    return out
+
+
+def test_crossfade_is_equal_power():
+    fade = 1000
+    outgoing = _Voice(None, np.zeros(0), 1.0, 1.0, 0, 5000, 0, 4000, fade) # type: ignore
+    incoming = _Voice(None, np.zeros(0), 1.0, 1.0, 4000, 9000, fade, None, fade) # type: ignore
+    fading_out = gains(outgoing, 4000, fade)
+    fading_in = gains(incoming, 4000, fade)
+    np.testing.assert_allclose(fading_out ** 2 + fading_in ** 2, 1, atol=1e-6)
+    assert fading_out[0] == 1 and fading_in[0] == 0
+    assert fading_out[-1] < 0.01 and fading_in[-1] > 0.99
+
+
+def test_full_gain_outside_the_fades():
+    voice = _Voice(None, np.zeros(0), 1.0, 1.0, 0, 9000, 1000, 8000, 1000) # type: ignore
+    np.testing.assert_array_equal(gains(voice, 2000, 4000), 1)